@@ -1,169 +1,290 @@
-import os
+import re
 import sys
 import logging
-from flask import Flask, request, jsonify, send_file, redirect
+from flask import Flask, Response, g, request, jsonify, redirect
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import tempfile
 from datetime import datetime
 
 # Import config first to set up logging
-from config import JWT_CLAIMS, JWT_EXPIRATION_MINUTES, JWT_ISSUER, MINIMUM_AGE, LOG_LEVEL
+from config import (LOG_LEVEL, FAST_START, ASYNC_JOBS, JOB_MAX_WAIT_SECONDS, JOB_RETRY_AFTER_SECONDS,
+                    JWKS_MAX_AGE_SECONDS, SERVER_TIMING, MAX_CONTENT_LENGTH, PIPELINE_EXECUTOR, BATCH_TOKEN)
+
+from utils.logging_utils import configure_logging
+configure_logging()
 
 # Configure logging for this module
 logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
 
-# Import other modules after logging is configured
-from verification.ocr import extract_text
-from verification.face_match import match_faces
-from verification.extract_photo import extract_photo_from_xml, extract_photo_from_pdf
-from verification.signature_validation import validate_xml_signature, validate_pdf_signature
-from verification.age_verification import extract_dob_from_text, verify_age
-from utils.jwt_utils import issue_token
+# Import other modules after logging is configured. The OCR, PDF, signature and
+# face modules pull in heavy dependencies and are only imported by the pipeline
+# functions when they run, so /start and /public-key are up without waiting for them.
+from verification import warmup
+from verification.pipeline import process_document, process_selfie
+from utils.admission import AdmissionController, AdmissionRejected
+from utils.jobs import JobManager, JobQueueFull, PipelinePool
+from utils.jwt_utils import KEY_RING, REVOCATIONS, verify_token
 from utils.logging_utils import log_failure
+from utils import metrics
+from utils.session_store import create_session_store, new_session_id
+from utils.uploads import IMAGE_TYPES, UploadRejected, UploadRequest, admit_upload, read_upload
+
+metrics.init()
 
 app = Flask(__name__)
+# Uploads stream into size-limited in-memory buffers (see utils/uploads.py)
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 CORS(app)
 
-sessions = {}  # In-memory session store for demo
+BATCH_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+sessions = create_session_store()
+jobs = JobManager(sessions, initializer=warmup.warm_up) if ASYNC_JOBS else None
+# Bounds the inline verifications; async jobs are bounded by the job pool
+admission = AdmissionController('verification') if jobs is None else None
+pipeline_pool = PipelinePool(initializer=warmup.warm_up) if jobs is None and PIPELINE_EXECUTOR == 'process' else None
+
+@app.before_request
+def start_timings():
+    g.timings_token = metrics.start_request_timings()
+
+@app.after_request
+def add_server_timing(response):
+    timings = metrics.finish_request_timings(g.pop('timings_token', None))
+    timings.update(g.pop('job_timings', None) or {})
+    if SERVER_TIMING and timings:
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings)
+    return response
 
 @app.route('/start', methods=['GET'])
 def start_verification():
     callback_url = request.args.get('callback')
     if not callback_url:
         return jsonify({'error': 'Missing callback URL'}), 400
-    # Generate a session token (for demo, use a simple counter)
-    session_id = str(len(sessions) + 1)
-    sessions[session_id] = {'callback_url': callback_url}
+    session_id = sessions.create({'callback_url': callback_url})
     return jsonify({'session_id': session_id})
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    state = warmup.readiness()
+    return jsonify(state), 200 if state['status'] == 'ready' else 503
+
+def _server_busy(retry_after):
+    response = jsonify({'error': 'Server busy, please retry'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+def _shed_early():
+    """
+    Answer 503 before the upload is read if it would be shed anyway.
+    """
+    if admission is None:
+        return None
+    try:
+        admission.check(request.endpoint)
+    except AdmissionRejected as e:
+        log_failure('Request shed', {'endpoint': request.endpoint, 'reason': e.reason})
+        return _server_busy(e.retry_after)
+    return None
+
+def _run_pipeline(session_id, fn, *args):
+    """
+    Run a verification pipeline in this request (in the pipeline process pool
+    if enabled), or queue it as a job in async mode.
+    """
+    if jobs is not None:
+        try:
+            job_id = jobs.submit(session_id, fn, *args)
+        except JobQueueFull:
+            log_failure('Job queue full', {'session_id': session_id})
+            return _server_busy(JOB_RETRY_AFTER_SECONDS)
+        return jsonify({'job_id': job_id, 'status_url': f'/status/{job_id}'}), 202
+    try:
+        with admission.admit(request.endpoint):
+            if pipeline_pool is not None:
+                (body, status, session_updates), g.job_timings = pipeline_pool.run(fn, *args)
+            else:
+                body, status, session_updates = fn(*args)
+    except AdmissionRejected as e:
+        log_failure('Request shed', {'session_id': session_id, 'endpoint': request.endpoint, 'reason': e.reason})
+        return _server_busy(e.retry_after)
+    if session_updates:
+        sessions.update(session_id, session_updates)
+    return jsonify(body), status
+
 @app.route('/upload-doc', methods=['POST'])
 def upload_doc():
+    shed = _shed_early()
+    if shed:
+        return shed
     session_id = request.form.get('session_id')
     if not session_id or session_id not in sessions:
         return jsonify({'error': 'Invalid session'}), 400
     if 'doc' not in request.files:
         return jsonify({'error': 'Missing document'}), 400
     doc_file = request.files['doc']
-    filename = secure_filename(doc_file.filename)
-    ext = os.path.splitext(filename)[1].lower()
-    with tempfile.TemporaryDirectory(dir='backend/temp') as temp_dir:
-        doc_path = os.path.join(temp_dir, filename)
-        doc_file.save(doc_path)
-        # Extract text for age verification
-        extracted_text = ''
-        if ext == '.pdf':
-            import PyPDF2
-            try:
-                with open(doc_path, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    for page in reader.pages:
-                        extracted_text += page.extract_text() or ''
-            except Exception as e:
-                log_failure(f'Error reading PDF: {str(e)}', {'session_id': session_id})
-                return jsonify({'error': 'Error processing PDF'}), 400
-        elif ext == '.xml':
-            if not validate_xml_signature(doc_path):
-                log_failure('Invalid XML signature', {'session_id': session_id})
-                return jsonify({'error': 'Invalid XML signature'}), 400
-            with open(doc_path, 'r', encoding='utf-8') as f:
-                extracted_text = f.read()
-        else:  # For images
-            try:
-                extracted_text = extract_text(doc_path)
-            except Exception as e:
-                log_failure(f'Error extracting text from image: {str(e)}', 
-                           {'session_id': session_id})
-                extracted_text = ''
-
-        # Extract and verify age
-        dob = extract_dob_from_text(extracted_text)
-        if not dob:
-            log_failure('Could not extract date of birth', {'session_id': session_id})
-            return jsonify({'error': 'Could not verify age from document'}), 400
-            
-        is_valid, age, is_minor = verify_age(dob)
-        if not is_valid:
-            log_failure(f'Age verification failed: User is {age} years old (minimum {MINIMUM_AGE})',
-                      {'session_id': session_id, 'age': age, 'is_minor': is_minor})
-            return jsonify({
-                'error': f'Age verification failed: Must be at least {MINIMUM_AGE} years old',
-                'age': age,
-                'is_minor': is_minor
-            }), 403
-            
-        # Store age verification details in session
-        sessions[session_id].update({
-            'age_verified': is_valid,
-            'age': age,
-            'date_of_birth': dob
-        })
-
-        # Extract photo for face matching
-        if ext == '.xml':
-            photo = extract_photo_from_xml(doc_path)
-        elif ext == '.pdf':
-            if not validate_pdf_signature(doc_path):
-                log_failure('Invalid PDF signature', {'session_id': session_id})
-                return jsonify({'error': 'Invalid PDF signature'}), 400
-            photo = extract_photo_from_pdf(doc_path)
-        else:  # For images
-            photo = doc_file
-
-        if photo is None:
-            log_failure('Photo extraction failed', {'session_id': session_id})
-            return jsonify({'error': 'Photo extraction failed'}), 400
-        # Save photo for next step
-        photo_path = os.path.join(temp_dir, 'doc_photo.jpg')
-        photo.save(photo_path)
-        # For demo, store photo bytes in session (not for production)
-        with open(photo_path, 'rb') as f:
-            sessions[session_id]['doc_photo'] = f.read()
-        return jsonify({'success': True})
+    # The whole pipeline works on this buffer; nothing is written to disk.
+    # The digest is the document result cache key, so re-uploads skip the pipeline
+    try:
+        doc_data, digest = read_upload(doc_file)
+        # The content decides between the XML, PDF and image paths, not the filename
+        ext = admit_upload(doc_data)
+    except UploadRejected as e:
+        log_failure('Document upload rejected', {'session_id': session_id, 'error': str(e),
+                                                  'filename': secure_filename(doc_file.filename or '')})
+        return jsonify({'error': str(e)}), e.status
+    return _run_pipeline(session_id, process_document, doc_data, ext, session_id, digest)
 
 @app.route('/upload-selfie', methods=['POST'])
 def upload_selfie():
+    shed = _shed_early()
+    if shed:
+        return shed
     session_id = request.form.get('session_id')
-    if not session_id or session_id not in sessions:
+    session = sessions.get(session_id) if session_id else None
+    if session is None:
         return jsonify({'error': 'Invalid session'}), 400
     if 'selfie' not in request.files:
         return jsonify({'error': 'Missing selfie'}), 400
-    selfie_file = request.files['selfie']
-    with tempfile.TemporaryDirectory(dir='backend/temp') as temp_dir:
-        selfie_path = os.path.join(temp_dir, secure_filename(selfie_file.filename))
-        selfie_file.save(selfie_path)
-        # Save doc photo to temp file
-        doc_photo_path = os.path.join(temp_dir, 'doc_photo.jpg')
-        with open(doc_photo_path, 'wb') as f:
-            f.write(sessions[session_id]['doc_photo'])
-        # Face match
-        if not match_faces(doc_photo_path, selfie_path):
-            log_failure('Face match failed', {'session_id': session_id})
-            return jsonify({'error': 'Face match failed'}), 401
-        # Get age verification status
-        age_verified = sessions[session_id].get('age_verified', False)
-        
-        # Create JWT payload with age verification status
-        # Start with default claims and update with our values
-        payload = {**JWT_CLAIMS}  # Start with default claims
-        payload.update({
-            'sub': session_id,
-            'iss': JWT_ISSUER,
-            'age_verified': age_verified  # This will override the default False value
-        })
-        token = issue_token(payload)
-        callback_url = sessions[session_id]['callback_url']
-        # Redirect with JWT as query param
-        redirect_url = f"{callback_url}?token={token}"
-        return jsonify({'redirect_url': redirect_url, 'token': token})
+    if session.get('doc_embedding') is None:
+        return jsonify({'error': 'Document not uploaded'}), 400
+    try:
+        selfie_data, _ = read_upload(request.files['selfie'])
+        admit_upload(selfie_data, IMAGE_TYPES)
+    except UploadRejected as e:
+        log_failure('Selfie upload rejected', {'session_id': session_id, 'error': str(e)})
+        return jsonify({'error': str(e)}), e.status
+    return _run_pipeline(session_id, process_selfie, selfie_data, session, session_id)
+
+@app.route('/status/<job_id>', methods=['GET'])
+def job_status(job_id):
+    if jobs is None:
+        return jsonify({'error': 'Async jobs are disabled'}), 404
+    wait = min(request.args.get('wait', 0, type=float), JOB_MAX_WAIT_SECONDS)
+    job = jobs.wait(job_id, wait) if wait > 0 else jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] == 'pending':
+        return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+    # Finished jobs answer with the same payload the endpoint returns in sync
+    # mode, with the worker's stage timings in the Server-Timing header
+    g.job_timings = job.get('timings')
+    return jsonify(job['result']), job['http_status']
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/batch', methods=['POST'])
+def start_batch():
+    # Back-office re-verification of archived documents (see verification/batch.py)
+    from verification import batch
+    if not BATCH_TOKEN:
+        return jsonify({'error': 'Batch re-verification is disabled'}), 404
+    if not batch.is_authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Unauthorized'}), 401
+    params = request.get_json(silent=True) or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    batch_id = params.get('batch_id') or new_session_id()
+    if not isinstance(batch_id, str) or not BATCH_ID_PATTERN.fullmatch(batch_id):
+        return jsonify({'error': 'Invalid batch_id'}), 400
+    if not params.get('source'):
+        return jsonify({'error': 'Missing source'}), 400
+    if not isinstance(params['source'], str) or not isinstance(params.get('selfie_dir') or '', str):
+        return jsonify({'error': 'Paths must be strings'}), 400
+    try:
+        source = batch.resolve_batch_path(params['source'])
+        selfie_dir = batch.resolve_batch_path(params['selfie_dir']) if params.get('selfie_dir') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Passing an existing batch_id resumes it where it stopped
+    try:
+        batch.start_batch(batch_id, source, selfie_dir)
+    except batch.BatchRunning:
+        return jsonify({'error': 'Batch is already running', **(batch.batch_status(batch_id) or {})}), 409
+    return jsonify({'batch_id': batch_id, 'status_url': f'/batch/{batch_id}'}), 202
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    from verification import batch
+    if not BATCH_TOKEN:
+        return jsonify({'error': 'Batch re-verification is disabled'}), 404
+    if not batch.is_authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Unauthorized'}), 401
+    status = batch.batch_status(batch_id) if BATCH_ID_PATTERN.fullmatch(batch_id) else None
+    if status is None:
+        return jsonify({'error': 'Unknown batch'}), 404
+    return jsonify(status)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': 'Upload too large'}), 413
 
 @app.route('/public-key', methods=['GET'])
 def public_key():
-    key_path = os.path.join('static', 'keys', 'public.pem')
-    if os.path.exists(key_path):
-        return send_file(key_path)
-    return jsonify({'error': 'Public key not found'}), 404
+    # Served from the parsed key ring; relying parties can revalidate with ETags
+    response = Response(KEY_RING.signing_key.pem, mimetype='application/x-pem-file')
+    return _cacheable(response, KEY_RING.public_pem_etag)
+
+@app.route('/.well-known/jwks.json', methods=['GET'])
+def jwks():
+    response = Response(KEY_RING.jwks_body, mimetype='application/json')
+    return _cacheable(response, KEY_RING.jwks_etag)
+
+@app.route('/verify-token', methods=['POST'])
+def verify_token_endpoint():
+    # Token introspection in the shape of RFC 7662: always 200, 'active' says
+    # whether the token is valid, unexpired and not revoked
+    params = request.get_json(silent=True) or request.form
+    if not isinstance(params, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    token = params.get('token')
+    if not token:
+        return jsonify({'error': 'Missing token'}), 400
+    if not isinstance(token, str):
+        return jsonify({'error': 'Token must be a string'}), 400
+    claims = verify_token(token)
+    if claims is None:
+        return jsonify({'active': False})
+    return jsonify({'active': True, **claims})
+
+@app.route('/revocations', methods=['GET'])
+def revocations():
+    # Bloom filter of revoked token ids, for utils.token_verifier.TokenVerifier
+    REVOCATIONS.reload_if_changed()
+    response = Response(REVOCATIONS.body, mimetype='application/octet-stream')
+    return _cacheable(response, REVOCATIONS.etag)
+
+def _cacheable(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = JWKS_MAX_AGE_SECONDS
+    return response.make_conditional(request)
+
+def _warm_up():
+    # The models are loaded where the pipeline runs: in this process when it
+    # runs inline, otherwise only in the pool workers, which warm up in their
+    # initializer
+    pool = jobs or pipeline_pool
+    if pool is not None:
+        workers = pool.start_workers()
+        if FAST_START:
+            warmup.start_background_warm_up(warmup.warm_up_workers, workers)
+        else:
+            warmup.warm_up_workers(workers)
+    elif FAST_START:
+        warmup.start_background_warm_up()
+    else:
+        warmup.warm_up()
+
+# Spawned pool workers import the main script as __mp_main__ when the app is
+# run with `python app.py`; only the web process warms up and starts the pools
+if __name__ != '__mp_main__':
+    _warm_up()
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    app.run(debug=True)
+ 
\ No newline at end of file
@@ -0,0 +1,229 @@
+"""
+ASGI entry point, for uvicorn (development) or gunicorn with uvicorn workers
+(production, see gunicorn.conf.py):
+
+    cd backend && uvicorn asgi:application
+    cd backend && gunicorn -c gunicorn.conf.py
+
+The Flask app stays a WSGI app. This adapter receives request bodies and
+sends responses on the event loop, so slow clients never hold a thread, and
+runs the app on two bounded thread pools: the upload endpoints on one sized to
+the admission limits, everything else on another, so /start, /status,
+/public-key and /metrics never queue behind a verification. Long-polls of
+/status/<job_id>?wait= wait on the event loop, not in a thread. With
+ALTID_PIPELINE_EXECUTOR=process the CPU-bound stages also leave the web
+process (see _run_pipeline in app.py).
+"""
+import asyncio
+import io
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from werkzeug.exceptions import HTTPException
+
+from config import (ASGI_LIGHT_THREADS, ASGI_HEAVY_THREADS, JOB_RETRY_AFTER_SECONDS, JOB_MAX_WAIT_SECONDS,
+                    JOB_POLL_INTERVAL_SECONDS, MAX_CONTENT_LENGTH, UPLOAD_FORM_OVERHEAD_BYTES)
+from app import app, admission, jobs
+from utils.jobs import JobManager
+from utils.metrics import increment
+from utils.uploads import upload_limit
+
+HEAVY_PATHS = frozenset({'/upload-doc', '/upload-selfie'})
+STATUS_PATH = re.compile(r'/status/([^/]+)')
+
+_url_adapter = app.url_map.bind('localhost')
+
+def endpoint_body_limit(method: str, path: str) -> int:
+    """
+    The largest body app accepts for a request: the endpoint's upload limit
+    (see UPLOAD_LIMITS) plus the form overhead, as UploadRequest enforces.
+    """
+    try:
+        endpoint, _ = _url_adapter.match(path, method)
+    except HTTPException:
+        endpoint = None
+    return upload_limit(endpoint) + UPLOAD_FORM_OVERHEAD_BYTES
+
+class ClientDisconnected(Exception):
+    pass
+
+def wsgi_environ(scope: dict, body: bytes) -> dict:
+    """
+    Build the WSGI environ for an ASGI HTTP scope and its complete body.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] if server[1] is not None else 80),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-length':
+            continue  # The body has been read; its actual length is set above
+        key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+class WsgiAdapter:
+    """
+    Serve a WSGI app over ASGI with separate thread pools for heavy and light
+    paths. Heavy requests beyond the heavy pool's size are answered with 503
+    instead of waiting for a thread or reading their body.
+
+    Args:
+        body_limit: Largest body accepted for a request's (method, path);
+            MAX_CONTENT_LENGTH for every request by default
+        jobs: Job manager whose /status/<job_id>?wait= long-polls are awaited
+            here, so they do not hold a light thread
+    """
+
+    def __init__(self, wsgi_app, heavy_paths=HEAVY_PATHS, heavy_threads: int = ASGI_HEAVY_THREADS,
+                 light_threads: int = ASGI_LIGHT_THREADS, body_limit: Optional[Callable[[str, str], int]] = None,
+                 jobs: Optional[JobManager] = None):
+        self.wsgi_app = wsgi_app
+        self.heavy_paths = heavy_paths
+        self.heavy_threads = heavy_threads
+        self.body_limit = body_limit or (lambda method, path: MAX_CONTENT_LENGTH)
+        self.jobs = jobs
+        self.heavy_pool = ThreadPoolExecutor(heavy_threads, thread_name_prefix='asgi-heavy')
+        self.light_pool = ThreadPoolExecutor(light_threads, thread_name_prefix='asgi-light')
+        self.heavy_in_flight = 0  # Only touched on the event loop
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported ASGI scope type: {scope["type"]}')
+
+        if scope['path'] not in self.heavy_paths:
+            await self._serve(scope, receive, send, self.light_pool)
+            return
+        if self.heavy_in_flight >= self.heavy_threads:
+            increment('altid_admission_shed_total', controller='asgi', endpoint=scope['path'], reason='threads_busy')
+            retry_after = admission.retry_after() if admission is not None else JOB_RETRY_AFTER_SECONDS
+            await self._send_error(send, 503, b'Server busy, please retry', [(b'retry-after', str(retry_after).encode())])
+            return
+        # The slot is taken before the body is read, so concurrent uploads
+        # cannot all pass the check above while their bodies arrive
+        self.heavy_in_flight += 1
+        try:
+            await self._serve(scope, receive, send, self.heavy_pool)
+        finally:
+            self.heavy_in_flight -= 1
+
+    async def _serve(self, scope, receive, send, pool):
+        try:
+            body = await self._read_body(scope, receive, self.body_limit(scope['method'], scope['path']))
+        except ClientDisconnected:
+            return
+        if body is None:
+            await self._send_error(send, 413, b'Upload too large')
+            return
+
+        environ = wsgi_environ(scope, body)
+        if self.jobs is not None:
+            await self._await_long_poll(scope, environ)
+        status, headers, content = await asyncio.get_running_loop().run_in_executor(pool, self._call_wsgi, environ)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def _await_long_poll(self, scope, environ):
+        """
+        Wait on the event loop for the job of a /status/<job_id>?wait= request
+        and drop 'wait', so the app answers straight away from a light thread.
+        """
+        match = STATUS_PATH.fullmatch(scope['path'])
+        if match is None or scope['method'] != 'GET':
+            return
+        params = parse_qsl(environ['QUERY_STRING'], keep_blank_values=True)
+        try:
+            wait = min(float(dict(params).get('wait', 0)), JOB_MAX_WAIT_SECONDS)
+        except ValueError:
+            return  # The app ignores an invalid wait too
+        environ['QUERY_STRING'] = urlencode([(k, v) for k, v in params if k != 'wait'])
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            job = await loop.run_in_executor(self.light_pool, self.jobs.get, match.group(1))
+            if job is None or job['status'] != 'pending':
+                return
+            await asyncio.sleep(min(JOB_POLL_INTERVAL_SECONDS, max(0.0, deadline - time.monotonic())))
+
+    async def _read_body(self, scope, receive, max_body: int):
+        """
+        Receive the whole request body. Returns None if it is larger than
+        max_body, without reading the rest when Content-Length says so.
+        """
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit() and int(value) > max_body:
+                return None
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > max_body:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def _call_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            content = b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return response['status'], response['headers'], content
+
+    async def _send_error(self, send, status, message, headers=()):
+        content = b'{"error": "' + message + b'"}'
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(content)).encode())] + list(headers)})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.heavy_pool.shutdown(wait=False)
+                self.light_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+application = WsgiAdapter(app, body_limit=endpoint_body_limit, jobs=jobs)
@@ -0,0 +1,82 @@
+"""
+Microbenchmark for extract_dob_from_text over large OCR-like outputs.
+
+Run from the backend directory:
+
+    python -m benchmarks.dob_extraction [--sizes 2000 20000 200000] [--json]
+"""
+import argparse
+import random
+import string
+import time
+
+from benchmarks.report import build_report, write_report
+from verification.age_verification import extract_dob_from_text
+
+NOISE_LINES = [
+    'GOVERNMENT OF INDIA',
+    'भारत सरकार',
+    'Unique Identification Authority of India',
+    'Address: S/O Ramesh Kumar, House No 12, MG Road',
+    'Enrolment No: 1234/56789/01234',
+    'Issue Date: 12/03/2019',
+    'Download Date: 05-06-2021',
+    'VID : 9123 4567 8912 3456',
+    'Aadhaar - Aam Aadmi ka Adhikar',
+]
+
+def make_ocr_text(size: int, seed: int = 0) -> str:
+    """
+    Build roughly size characters of OCR-like text with one labelled DOB near the end.
+    """
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.3:
+            line = ''.join(rng.choice(string.ascii_letters + string.digits + ' /-.:') for _ in range(60))
+        else:
+            line = rng.choice(NOISE_LINES)
+        lines.append(line)
+        length += len(line) + 1
+    lines.insert(max(0, len(lines) - 3), 'जन्म तिथि / DOB: 15/08/1990')
+    return '\n'.join(lines)
+
+def bench(text: str, min_time: float = 0.5) -> dict:
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        extract_dob_from_text(text)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+    return {
+        'name': f'dob_extraction_{len(text)}',
+        'text_chars': len(text),
+        'calls': calls,
+        'us_per_call': elapsed / calls * 1e6,
+        'mb_per_s': len(text.encode('utf-8')) * calls / elapsed / 1e6,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000, 200000])
+    parser.add_argument('--min-time', type=float, default=0.5, help='Seconds to run each size for')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        text = make_ocr_text(size)
+        assert extract_dob_from_text(text) is not None, 'benchmark text lost its DOB'
+        results.append(bench(text, args.min_time))
+
+    if args.json:
+        write_report(build_report('dob_extraction', results, min_time=args.min_time))
+        return
+    for r in results:
+        print(f"{r['text_chars']:>9} chars  {r['us_per_call']:>10.1f} us/call  {r['mb_per_s']:>7.1f} MB/s")
+
+if __name__ == '__main__':
+    main()
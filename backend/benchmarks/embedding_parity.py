@@ -0,0 +1,179 @@
+"""
+Accuracy parity, latency and memory of the face embedding backends.
+
+Run from the backend directory against a fixed set of local face images, or
+without --images on synthetic faces (see benchmarks/synthetic.py):
+
+    python -m benchmarks.embedding_parity [--images ../data/face_parity] [--backends onnx onnx-int8]
+
+Faces are detected once. Each backend then embeds every crop, one inference
+per call, in its own subprocess, so the peak RSS it reports is the backend's
+alone. The candidate backends are compared with 'deepface' on the pairwise
+cosine distances between all crops and on the match decisions at
+FACE_MATCH_THRESHOLD. The exit status is 1 if a candidate's distances drift
+more than --tolerance from the reference.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.report import build_report, peak_rss_mb, print_table, summarize, write_report
+from config import FACE_MATCH_THRESHOLD
+
+REFERENCE_BACKEND = 'deepface'
+SYNTHETIC_FACES = 12
+
+def load_crops(image_dir: str) -> List[np.ndarray]:
+    """
+    The most confident face crop of each decodable image in image_dir, in
+    file name order.
+    """
+    from verification.face_match import detect_faces
+    from verification.image_ingest import decode_bgr
+
+    crops = []
+    for name in sorted(os.listdir(image_dir)):
+        with open(os.path.join(image_dir, name), 'rb') as f:
+            image = decode_bgr(f.read())
+        faces = detect_faces(image) if image is not None else []
+        if faces:
+            crops.append(faces[0].astype(np.float32))
+        else:
+            print(f'No face in {name}, skipped', file=sys.stderr)
+    if len(crops) < 2:
+        raise SystemExit(f'Need at least two images with a face in {image_dir}')
+    return crops
+
+def synthetic_crops(count: int = SYNTHETIC_FACES) -> List[np.ndarray]:
+    """
+    Float BGR crops in [0, 1] of count synthetic faces, taken as they are:
+    the backends are compared on embedding, not detection.
+    """
+    from benchmarks.synthetic import make_face_photo
+
+    return [np.ascontiguousarray(np.asarray(make_face_photo(seed), dtype=np.float32)[:, :, ::-1]) / 255.0
+            for seed in range(count)]
+
+def save_crops(path: str, crops: List[np.ndarray]):
+    # Crops differ in size, so each is stored as its own array
+    np.savez(path, *crops)
+
+def read_crops(path: str) -> List[np.ndarray]:
+    with np.load(path) as data:
+        return [data[f'arr_{i}'] for i in range(len(data.files))]
+
+def embed_all(backend_name: str, crops: List[np.ndarray]) -> dict:
+    """
+    Embed each crop on its own with the named backend (in this process).
+    """
+    from verification.face_embedding import create_embedding_backend
+    from verification.face_match import embed_faces
+
+    start = time.perf_counter()
+    backend = create_embedding_backend(backend_name)
+    embed_faces([crops[0]], backend)  # Warm-up
+    load_seconds = time.perf_counter() - start
+    embeddings, latencies = [], []
+    for crop in crops:
+        t0 = time.perf_counter()
+        embeddings.append(embed_faces([crop], backend)[0])
+        latencies.append(time.perf_counter() - t0)
+    return {'embeddings': np.stack(embeddings), 'latencies': latencies,
+            'load_seconds': load_seconds, 'peak_rss_mb': peak_rss_mb()}
+
+def embed_in_subprocess(backend_name: str, crops_path: str, workdir: str) -> dict:
+    out_path = os.path.join(workdir, f'{backend_name}.npz')
+    subprocess.run([sys.executable, '-m', 'benchmarks.embedding_parity', '--worker', backend_name,
+                    '--crops', crops_path, '--out', out_path], check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with np.load(out_path) as data:
+        result = json.loads(str(data['meta']))
+        result['embeddings'] = data['embeddings']
+    return result
+
+def distance_matrix(embeddings: np.ndarray) -> np.ndarray:
+    return 1.0 - embeddings @ embeddings.T
+
+def parity(reference: np.ndarray, candidate: np.ndarray, threshold: float = FACE_MATCH_THRESHOLD) -> dict:
+    """
+    Compare two backends' L2-normalised embeddings of the same crops.
+    """
+    upper = np.triu_indices(len(reference), k=1)
+    ref_distances = distance_matrix(reference)[upper]
+    cand_distances = distance_matrix(candidate)[upper]
+    drift = np.abs(ref_distances - cand_distances)
+    return {
+        'pairs': int(len(ref_distances)),
+        'max_distance_drift': float(drift.max()),
+        'mean_distance_drift': float(drift.mean()),
+        'max_self_distance': float((1.0 - np.sum(reference * candidate, axis=1)).max()),
+        'decision_agreement': float(np.mean((ref_distances <= threshold) == (cand_distances <= threshold))),
+    }
+
+def run_worker(backend_name: str, crops_path: str, out_path: str):
+    result = embed_all(backend_name, read_crops(crops_path))
+    embeddings = result.pop('embeddings')
+    np.savez(out_path, embeddings=embeddings, meta=json.dumps(result))
+
+def run_parity(image_dir: Optional[str], backends: List[str], tolerance: float) -> Tuple[List[dict], bool]:
+    crops = load_crops(image_dir) if image_dir else synthetic_crops()
+    results = []
+    passed = True
+    with tempfile.TemporaryDirectory() as workdir:
+        crops_path = os.path.join(workdir, 'crops.npz')
+        save_crops(crops_path, crops)
+        reference = None
+        for name in [REFERENCE_BACKEND] + [b for b in backends if b != REFERENCE_BACKEND]:
+            try:
+                run = embed_in_subprocess(name, crops_path, workdir)
+            except subprocess.CalledProcessError as e:
+                results.append({'name': name, 'skipped': f'worker exited with {e.returncode}'})
+                continue
+            extra = {'backend_peak_rss_mb': run['peak_rss_mb'], 'load_seconds': run['load_seconds']}
+            if name == REFERENCE_BACKEND:
+                reference = run['embeddings']
+            elif reference is not None:
+                extra.update(parity(reference, run['embeddings']))
+                extra['within_tolerance'] = extra['max_distance_drift'] <= tolerance
+                passed = passed and extra['within_tolerance']
+            results.append(summarize(name, run['latencies'], **extra))
+    return results, passed and reference is not None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='Directory of face images (synthetic faces by default)')
+    parser.add_argument('--backends', nargs='+', default=['onnx', 'onnx-int8'])
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='Largest accepted change in any pairwise cosine distance')
+    parser.add_argument('--json', metavar='PATH', help="Write the JSON report here ('-' for stdout)")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--crops', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.crops, args.out)
+        return
+
+    results, passed = run_parity(args.images, args.backends, args.tolerance)
+    report = build_report('embedding_parity', results, images=args.images or 'synthetic', tolerance=args.tolerance,
+                          threshold=FACE_MATCH_THRESHOLD)
+    if args.json:
+        write_report(report, args.json)
+    else:
+        print_table(report)
+        for r in results:
+            if 'max_distance_drift' in r:
+                print(f"  {r['name']:<28} drift max={r['max_distance_drift']:.4f} mean={r['mean_distance_drift']:.4f}  "
+                      f"decisions agree {r['decision_agreement']:.1%}  RSS {r['backend_peak_rss_mb']:.0f} MiB")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
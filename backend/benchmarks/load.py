@@ -0,0 +1,177 @@
+"""
+Concurrent load harness for the /start -> /upload-doc -> /upload-selfie flow.
+
+By default requests go through Flask's test client in this process; pass
+--url to drive a running server instead. Async (202) responses are followed
+through /status/<job_id>?wait= so step latencies include the job time.
+
+Run from the backend directory:
+
+    python -m benchmarks.load --flows 200 --concurrency 8 --doc-type xml [--json report.json]
+"""
+import argparse
+import io
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+from benchmarks import synthetic
+from benchmarks.report import build_report, print_table, summarize, write_report
+
+CALLBACK_URL = 'https://relying-party.invalid/callback'
+
+DOCUMENT_MAKERS = {
+    'xml': ('doc.xml', synthetic.make_oky_xml),
+    'pdf': ('doc.pdf', synthetic.make_pdf),
+    'image': ('doc.jpg', synthetic.make_id_card_image),
+}
+
+class TestClientTransport:
+    """
+    Requests through Flask's test client, one client per thread.
+    """
+
+    def __init__(self):
+        from app import app
+        self.app = app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def get(self, path: str) -> Tuple[int, dict]:
+        response = self._client().get(path)
+        return response.status_code, response.get_json(silent=True) or {}
+
+    def post_file(self, path: str, fields: dict, field: str, filename: str, data: bytes) -> Tuple[int, dict]:
+        form = dict(fields)
+        form[field] = (io.BytesIO(data), filename)
+        response = self._client().post(path, data=form, content_type='multipart/form-data')
+        return response.status_code, response.get_json(silent=True) or {}
+
+class HttpTransport:
+    """
+    Requests to a running server over HTTP.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    def _send(self, request) -> Tuple[int, dict]:
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, {}
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.base_url + path))
+
+    def post_file(self, path, fields, field, filename, data):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        parts.append(data)
+        parts.append(f'\r\n--{boundary}--\r\n'.encode())
+        request = urllib.request.Request(self.base_url + path, data=b''.join(parts), method='POST',
+                                         headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        return self._send(request)
+
+def _follow_job(transport, status: int, body: dict) -> Tuple[int, dict]:
+    while status == 202 and 'status_url' in body:
+        status, next_body = transport.get(body['status_url'] + '?wait=30')
+        if status == 202:
+            continue
+        body = next_body
+    return status, body
+
+def run_flow(transport, doc_name: str, doc_data: bytes, selfie: bytes, record):
+    """
+    One verification flow; record(step, seconds, status) is called per step.
+    """
+    flow_start = time.perf_counter()
+    t0 = time.perf_counter()
+    status, body = transport.get('/start?' + urllib.parse.urlencode({'callback': CALLBACK_URL}))
+    record('start', time.perf_counter() - t0, status)
+    if status != 200:
+        return
+    session_id = body['session_id']
+
+    t0 = time.perf_counter()
+    status, body = transport.post_file('/upload-doc', {'session_id': session_id}, 'doc', doc_name, doc_data)
+    status, body = _follow_job(transport, status, body)
+    record('upload_doc', time.perf_counter() - t0, status)
+    if status != 200:
+        return
+
+    t0 = time.perf_counter()
+    status, body = transport.post_file('/upload-selfie', {'session_id': session_id}, 'selfie', 'selfie.jpg', selfie)
+    status, body = _follow_job(transport, status, body)
+    record('upload_selfie', time.perf_counter() - t0, status)
+    record('flow', time.perf_counter() - flow_start, status)
+
+def run_load(transport, flows: int, concurrency: int, doc_type: str, distinct_docs: int) -> list:
+    filename, maker = DOCUMENT_MAKERS[doc_type]
+    # A few distinct documents, so the document result cache sees both hits and misses
+    documents = [maker(seed=seed) for seed in range(distinct_docs)]
+    selfies = [synthetic.make_selfie(seed) for seed in range(distinct_docs)]
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+
+    def record(step, seconds, status):
+        with lock:
+            latencies[step].append(seconds)
+            statuses[step][status] += 1
+
+    def flow(i):
+        run_flow(transport, filename, documents[i % distinct_docs], selfies[i % distinct_docs], record)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(flow, range(flows)))
+    elapsed = time.perf_counter() - start
+
+    return [summarize(step, latencies[step], elapsed, statuses={str(k): v for k, v in statuses[step].items()})
+            for step in ('start', 'upload_doc', 'upload_selfie', 'flow') if step in latencies]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Base URL of a running server (default: in-process test client)')
+    parser.add_argument('--flows', type=int, default=50, help='Verification flows to run')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--doc-type', choices=sorted(DOCUMENT_MAKERS), default='xml')
+    parser.add_argument('--distinct-docs', type=int, default=10)
+    parser.add_argument('--json', metavar='PATH', help="Write the JSON report here ('-' for stdout)")
+    args = parser.parse_args()
+
+    transport = HttpTransport(args.url) if args.url else TestClientTransport()
+    results = run_load(transport, args.flows, args.concurrency, args.doc_type, args.distinct_docs)
+    report = build_report('load', results, transport='http' if args.url else 'test_client', url=args.url,
+                          flows=args.flows, concurrency=args.concurrency, doc_type=args.doc_type,
+                          distinct_docs=args.distinct_docs)
+    if args.json:
+        write_report(report, args.json)
+    else:
+        print_table(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Latency summaries and JSON reports shared by the benchmarks.
+
+A report is {'benchmark', 'meta', 'results'}; each result carries a name,
+sample count, p50/p95/p99/mean/max latency in milliseconds and throughput.
+Compare two reports with:
+
+    python -m benchmarks.report old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    """
+    Linearly interpolated percentile (q in 0..100) of already sorted samples.
+    """
+    if not sorted_samples:
+        return float('nan')
+    position = (len(sorted_samples) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * (position - lower)
+
+def summarize(name: str, latencies: List[float], elapsed: Optional[float] = None, **extra) -> dict:
+    """
+    Summarise per-call latencies (seconds). elapsed is the wall time the calls
+    took in total; it defaults to their sum, i.e. a sequential run.
+    """
+    samples = sorted(latencies)
+    elapsed = elapsed if elapsed is not None else sum(samples)
+    result = {
+        'name': name,
+        'count': len(samples),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'mean_ms': sum(samples) / len(samples) * 1000 if samples else float('nan'),
+        'max_ms': samples[-1] * 1000 if samples else float('nan'),
+        'throughput_per_s': len(samples) / elapsed if elapsed else float('nan'),
+    }
+    result.update(extra)
+    return result
+
+def peak_rss_mb(include_children: bool = False) -> float:
+    """
+    Peak resident set size of this process (plus reaped children), in MiB.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        usage += resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def build_report(benchmark: str, results: List[dict], **meta) -> dict:
+    return {
+        'benchmark': benchmark,
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'peak_rss_mb': peak_rss_mb(include_children=True),
+            **meta,
+        },
+        'results': results,
+    }
+
+def write_report(report: dict, path: Optional[str] = None):
+    """
+    Write the report as JSON to path, or to stdout if path is None or '-'.
+    """
+    text = json.dumps(report, indent=2, default=str)
+    if path and path != '-':
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+def print_table(report: dict):
+    print(f"{report['benchmark']}  (commit {report['meta'].get('git_commit')}, "
+          f"peak RSS {report['meta']['peak_rss_mb']:.0f} MiB)")
+    for r in report['results']:
+        if r.get('skipped'):
+            print(f"  {r['name']:<28} skipped: {r['skipped']}")
+            continue
+        print(f"  {r['name']:<28} n={r['count']:<6} p50={r['p50_ms']:>9.2f}ms  p95={r['p95_ms']:>9.2f}ms  "
+              f"p99={r['p99_ms']:>9.2f}ms  {r['throughput_per_s']:>9.1f}/s")
+
+def compare(old: dict, new: dict, metric: str = 'p50_ms') -> List[dict]:
+    """
+    Per-result change in metric between two reports of the same benchmark.
+    """
+    old_results = {r['name']: r for r in old['results'] if not r.get('skipped')}
+    rows = []
+    for r in new['results']:
+        before = old_results.get(r['name'])
+        if r.get('skipped') or before is None:
+            continue
+        rows.append({'name': r['name'], 'old': before[metric], 'new': r[metric],
+                     'change_pct': (r[metric] - before[metric]) / before[metric] * 100 if before[metric] else None})
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark reports')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='p50_ms')
+    args = parser.parse_args()
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    for row in compare(old, new, args.metric):
+        change = f"{row['change_pct']:+.1f}%" if row['change_pct'] is not None else 'n/a'
+        print(f"{row['name']:<28} {row['old']:>10.2f} -> {row['new']:>10.2f}  {change}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Per-stage micro-benchmarks over synthetic documents.
+
+Run from the backend directory:
+
+    python -m benchmarks.stages [--stages xml_parse pdf_find_dob ...] [--json report.json]
+
+Stages whose dependencies (tesseract, PyMuPDF, DeepFace, signxml, pyHanko, the
+test CA from utils/generate_test_ca.py) are missing are reported as skipped.
+"""
+import argparse
+import os
+import time
+from typing import Callable, Dict, List
+
+from benchmarks import synthetic
+from benchmarks.dob_extraction import make_ocr_text
+from benchmarks.report import build_report, print_table, summarize, write_report
+
+def measure(fn: Callable, min_time: float = 1.0, min_calls: int = 5) -> List[float]:
+    """
+    Call fn repeatedly for at least min_time seconds and min_calls calls;
+    returns each call's latency in seconds.
+    """
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < min_calls or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+def _test_trust_store():
+    from verification.signature_validation import TrustStore, load_certificate
+    with open(os.path.join(synthetic.TEST_CA_DIR, 'root.pem'), 'rb') as f:
+        return TrustStore([load_certificate(f.read())])
+
+def _require_test_ca():
+    if not synthetic.has_test_ca():
+        raise RuntimeError('no test CA, run utils/generate_test_ca.py')
+
+# Each setup function builds its inputs and returns the callable to time
+def stage_dob_extraction():
+    from verification.age_verification import extract_dob_from_text
+    text = make_ocr_text(20000)
+    return lambda: extract_dob_from_text(text)
+
+def stage_xml_parse():
+    from verification.aadhaar_xml import parse_aadhaar_xml
+    xml_data = synthetic.make_oky_xml()
+    return lambda: parse_aadhaar_xml(xml_data).photo.load()
+
+def stage_xml_signature():
+    _require_test_ca()
+    from verification.signature_validation import verify_xml
+    signed = synthetic.sign_xml(synthetic.make_oky_xml())
+    trust_store = _test_trust_store()
+    assert verify_xml(signed, trust_store), 'signed XML did not verify'
+    return lambda: verify_xml(signed, trust_store)
+
+def stage_pdf_find_dob():
+    from verification.pdf_document import PdfDocument
+    pdf_data = synthetic.make_pdf(pages=3)
+
+    def run():
+        with PdfDocument(pdf_data) as pdf:
+            pdf.find_dob()
+    return run
+
+def stage_pdf_extract_photo():
+    from verification.extract_photo import extract_photo_from_pdf
+    pdf_data = synthetic.make_pdf()
+    return lambda: extract_photo_from_pdf(pdf_data)
+
+def stage_pdf_signature():
+    _require_test_ca()
+    from verification.signature_validation import verify_pdf
+    signed = synthetic.sign_pdf(synthetic.make_pdf())
+    trust_store = _test_trust_store()
+    assert verify_pdf(signed, trust_store), 'signed PDF did not verify'
+    return lambda: verify_pdf(signed, trust_store)
+
+def stage_ocr_find_dob():
+    from verification.ocr import get_ocr_engine
+    card = synthetic.make_id_card()
+    engine = get_ocr_engine()
+    return lambda: engine.find_dob(card)
+
+def stage_selfie_decode():
+    from verification.image_ingest import decode_bgr
+    selfie = synthetic.make_selfie(size=4000)  # 12 MP
+    return lambda: decode_bgr(selfie)
+
+def stage_face_embedding():
+    from verification.face_match import get_face_embedding
+    from verification.image_ingest import to_bgr
+    photo = to_bgr(synthetic.make_face_photo())
+    get_face_embedding(photo)
+    return lambda: get_face_embedding(photo)
+
+def stage_face_match():
+    from verification.face_match import get_face_embedding, match_face_embedding
+    from verification.image_ingest import decode_bgr, to_bgr
+    doc_embedding = get_face_embedding(to_bgr(synthetic.make_face_photo()))
+    if doc_embedding is None:
+        raise RuntimeError('no face detected in the synthetic photo')
+    selfie = decode_bgr(synthetic.make_selfie())
+    return lambda: match_face_embedding(doc_embedding, selfie)
+
+def stage_process_document_xml():
+    from verification.pipeline import process_document
+    xml_data = synthetic.make_oky_xml()
+    # No digest, so the document result cache is bypassed
+    return lambda: process_document(xml_data, '.xml', 'benchmark')
+
+STAGES: Dict[str, Callable[[], Callable]] = {
+    'dob_extraction': stage_dob_extraction,
+    'xml_parse': stage_xml_parse,
+    'xml_signature': stage_xml_signature,
+    'pdf_find_dob': stage_pdf_find_dob,
+    'pdf_extract_photo': stage_pdf_extract_photo,
+    'pdf_signature': stage_pdf_signature,
+    'ocr_find_dob': stage_ocr_find_dob,
+    'selfie_decode': stage_selfie_decode,
+    'face_embedding': stage_face_embedding,
+    'face_match': stage_face_match,
+    'process_document_xml': stage_process_document_xml,
+}
+
+def run_stages(names: List[str], min_time: float, min_calls: int) -> List[dict]:
+    results = []
+    for name in names:
+        try:
+            fn = STAGES[name]()
+            fn()  # Warm-up call, also surfaces missing dependencies
+        except Exception as e:
+            results.append({'name': name, 'skipped': f'{type(e).__name__}: {e}'})
+            continue
+        latencies = measure(fn, min_time, min_calls)
+        results.append(summarize(name, latencies))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', nargs='+', choices=sorted(STAGES), default=list(STAGES))
+    parser.add_argument('--min-time', type=float, default=1.0, help='Seconds to run each stage for')
+    parser.add_argument('--min-calls', type=int, default=5)
+    parser.add_argument('--json', metavar='PATH', help="Write the JSON report here ('-' for stdout)")
+    args = parser.parse_args()
+
+    report = build_report('stages', run_stages(args.stages, args.min_time, args.min_calls),
+                          min_time=args.min_time, min_calls=args.min_calls)
+    if args.json:
+        write_report(report, args.json)
+    else:
+        print_table(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Synthetic inputs for the benchmarks: face photos, Aadhaar OKY XMLs with an
+embedded photo, (optionally signed) PDFs and rendered ID-card images, all with
+a known date of birth. Nothing here needs real identity documents.
+
+Signing uses the material written by utils/generate_test_ca.py.
+"""
+import base64
+import io
+import os
+import random
+from datetime import date
+from typing import Optional
+from xml.sax.saxutils import quoteattr
+
+from PIL import Image, ImageDraw
+
+from config import data_dir
+
+TEST_CA_DIR = os.path.join(data_dir, 'test_ca')
+
+def random_dob(seed: int = 0, min_age: int = 19, max_age: int = 70) -> date:
+    rng = random.Random(seed)
+    today = date.today()
+    return date(today.year - rng.randint(min_age, max_age), rng.randint(1, 12), rng.randint(1, 28))
+
+def make_face_photo(seed: int = 0, size: int = 200) -> Image.Image:
+    """
+    A cartoon face on a plain background: skin-toned oval, eyes, brows, nose
+    and mouth at plausible proportions, with per-seed variation.
+    """
+    rng = random.Random(seed)
+    background = tuple(rng.randint(200, 240) for _ in range(3))
+    skin = (rng.randint(150, 230), rng.randint(110, 180), rng.randint(80, 140))
+    image = Image.new('RGB', (size, int(size * 1.25)), background)
+    draw = ImageDraw.Draw(image)
+    w, h = image.size
+    cx, cy = w // 2, int(h * 0.45)
+    fw, fh = int(w * rng.uniform(0.30, 0.36)), int(h * rng.uniform(0.32, 0.38))
+    draw.ellipse((cx - fw, cy - fh, cx + fw, cy + fh), fill=skin)
+    eye_dx, eye_y = int(fw * 0.45), cy - int(fh * 0.15)
+    for ex in (cx - eye_dx, cx + eye_dx):
+        draw.ellipse((ex - 9, eye_y - 5, ex + 9, eye_y + 5), fill=(250, 250, 250))
+        draw.ellipse((ex - 4, eye_y - 4, ex + 4, eye_y + 4), fill=(40, 30, 20))
+        draw.line((ex - 11, eye_y - 12, ex + 11, eye_y - 14), fill=(50, 35, 25), width=3)
+    draw.line((cx, eye_y + 5, cx - 5, cy + int(fh * 0.25)), fill=(120, 80, 60), width=2)
+    mouth_y = cy + int(fh * 0.5)
+    draw.arc((cx - 18, mouth_y - 8, cx + 18, mouth_y + 8), 10, 170, fill=(150, 50, 50), width=3)
+    return image
+
+def image_bytes(image: Image.Image, fmt: str = 'JPEG', quality: int = 90) -> bytes:
+    out = io.BytesIO()
+    if fmt == 'JPEG':
+        image.convert('RGB').save(out, fmt, quality=quality)
+    else:
+        image.save(out, fmt)
+    return out.getvalue()
+
+def make_selfie(seed: int = 0, size: int = 640) -> bytes:
+    """
+    The seed's face enlarged onto a camera-sized frame, as JPEG.
+    """
+    face = make_face_photo(seed, size // 2)
+    frame = Image.new('RGB', (size, int(size * 0.75)), (90, 100, 110))
+    frame.paste(face, ((frame.width - face.width) // 2, (frame.height - face.height) // 2))
+    return image_bytes(frame)
+
+def make_oky_xml(dob: Optional[date] = None, seed: int = 0, name: str = 'Test Resident') -> bytes:
+    """
+    An Aadhaar OKY document: everything in attributes of <OKY>, the photo as
+    base64 JPEG in 'i'.
+    """
+    dob = dob or random_dob(seed)
+    photo = base64.b64encode(image_bytes(make_face_photo(seed), quality=80)).decode('ascii')
+    attributes = {
+        'v': '1', 'n': name, 'g': 'M', 'd': dob.strftime('%d-%m-%Y'),
+        'a': 'House 12, MG Road, Bengaluru, Karnataka 560001', 'r': f'{seed:012d}', 'i': photo,
+    }
+    attrs = ' '.join(f'{k}={quoteattr(v)}' for k, v in attributes.items())
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<OKY {attrs}/>'.encode('utf-8')
+
+def sign_xml(xml_data: bytes, ca_dir: str = TEST_CA_DIR) -> bytes:
+    """
+    Add an enveloped XML-DSig signature made with the test CA's signer.
+    """
+    from lxml import etree
+    from signxml import XMLSigner
+
+    key, cert, intermediate = (_read(os.path.join(ca_dir, name))
+                               for name in ('signer_key.pem', 'signer.pem', 'intermediate.pem'))
+    root = etree.fromstring(xml_data)
+    signed = XMLSigner().sign(root, key=key, cert=[cert.decode('ascii'), intermediate.decode('ascii')])
+    return etree.tostring(signed, xml_declaration=True, encoding='UTF-8')
+
+def make_id_card(dob: Optional[date] = None, seed: int = 0, width: int = 1012) -> Image.Image:
+    """
+    An ID-card layout: photo on the left, name and DOB to its right, header
+    and footer noise around them.
+    """
+    from PIL import ImageFont
+
+    dob = dob or random_dob(seed)
+    height = int(width * 0.63)
+    card = Image.new('RGB', (width, height), (250, 250, 245))
+    draw = ImageDraw.Draw(card)
+    font = ImageFont.load_default(size=max(12, width // 30))
+    draw.rectangle((0, 0, width, height // 8), fill=(240, 120, 40))
+    draw.text((width // 20, height // 40), 'GOVERNMENT OF INDIA', fill=(255, 255, 255), font=font)
+    photo = make_face_photo(seed, width // 4)
+    card.paste(photo, (width // 20, height // 5))
+    x = width // 20 + photo.width + width // 20
+    draw.text((x, int(height * 0.32)), 'Test Resident', fill=(0, 0, 0), font=font)
+    draw.text((x, int(height * 0.42)), f'DOB: {dob:%d/%m/%Y}', fill=(0, 0, 0), font=font)
+    draw.text((x, int(height * 0.52)), 'MALE', fill=(0, 0, 0), font=font)
+    draw.text((width // 4, int(height * 0.88)), f'{seed:04d} 5678 9012', fill=(0, 0, 0), font=font)
+    return card
+
+def make_id_card_image(dob: Optional[date] = None, seed: int = 0, fmt: str = 'JPEG') -> bytes:
+    return image_bytes(make_id_card(dob, seed), fmt)
+
+def make_pdf(dob: Optional[date] = None, seed: int = 0, pages: int = 1) -> bytes:
+    """
+    An e-Aadhaar-like PDF: the DOB as real text on the last page, the photo as
+    an embedded image, and optional filler pages in front.
+    """
+    import fitz  # PyMuPDF
+
+    dob = dob or random_dob(seed)
+    doc = fitz.open()
+    for number in range(pages - 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f'Enrolment information, page {number + 1}. Issue Date: 01/01/2020')
+    page = doc.new_page()
+    page.insert_text((72, 72), 'Unique Identification Authority of India', fontsize=14)
+    page.insert_image(fitz.Rect(72, 100, 232, 300), stream=image_bytes(make_face_photo(seed)))
+    page.insert_text((260, 140), 'Test Resident')
+    page.insert_text((260, 160), f'DOB: {dob:%d/%m/%Y}')
+    page.insert_text((260, 180), 'Gender: MALE')
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def sign_pdf(pdf_data: bytes, ca_dir: str = TEST_CA_DIR) -> bytes:
+    """
+    Sign a PDF with the test CA's signer through pyHanko.
+    """
+    from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+    from pyhanko.sign import signers
+
+    signer = signers.SimpleSigner.load(os.path.join(ca_dir, 'signer_key.pem'), os.path.join(ca_dir, 'signer.pem'),
+                                       ca_chain_files=(os.path.join(ca_dir, 'intermediate.pem'),))
+    writer = IncrementalPdfFileWriter(io.BytesIO(pdf_data))
+    out = signers.sign_pdf(writer, signers.PdfSignatureMetadata(field_name='Signature1'), signer=signer)
+    return out.getvalue()
+
+def has_test_ca(ca_dir: str = TEST_CA_DIR) -> bool:
+    return all(os.path.exists(os.path.join(ca_dir, name))
+               for name in ('signer_key.pem', 'signer.pem', 'intermediate.pem'))
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
@@ -4,6 +4,16 @@ import logging
 # JWT Configuration
 JWT_EXPIRATION_MINUTES = 15
 JWT_ISSUER = 'AltID'
+# Signing algorithm: RS256, ES256 or EdDSA. ES256/EdDSA sign much faster than
+# RSA-2048; generate a matching key pair with utils/generate_keys.py --alg
+JWT_ALGORITHM = os.environ.get('ALTID_JWT_ALGORITHM', 'RS256')
+key_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'keys')
+JWT_PRIVATE_KEY_PATH = os.environ.get('ALTID_JWT_PRIVATE_KEY', os.path.join(key_dir, 'private.pem'))
+JWT_PUBLIC_KEY_PATH = os.environ.get('ALTID_JWT_PUBLIC_KEY', os.path.join(key_dir, 'public.pem'))
+# Extra public keys still (or already) accepted during a key rotation, as an
+# os.pathsep-separated list of PEM files; they are published in the JWKS
+JWT_ADDITIONAL_PUBLIC_KEY_PATHS = [p for p in os.environ.get('ALTID_JWT_ADDITIONAL_PUBLIC_KEYS', '').split(os.pathsep) if p]
+JWKS_MAX_AGE_SECONDS = 300  # Cache-Control max-age for /.well-known/jwks.json and /public-key
 # Default claims that will be overridden during verification
 JWT_CLAIMS = {
     'age_verified': False  # This will be updated during verification
@@ -12,41 +22,218 @@ JWT_CLAIMS = {
 # Age Verification
 MINIMUM_AGE = 18  # Minimum required age in years
 
-# Logging Configuration
-LOG_FAILED_ATTEMPTS = True
-LOG_LEVEL = logging.INFO  # Set to DEBUG for more verbose logging
-LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# OCR (see verification/ocr.py)
+OCR_TARGET_WIDTH = 1600  # Document images are scaled to this width before OCR
+OCR_DPI = 300
+# Regions (left, top, right, bottom as fractions of the page) where ID cards
+# usually print the date of birth: right of the photo, middle band of the card.
+# They are OCR'd first; full-page OCR only runs if none yields a date labelled
+# as the date of birth.
+OCR_DOB_REGIONS = [
+    (0.25, 0.30, 1.00, 0.70),
+]
+# Characters recognised in those regions: dates and their separators, plus
+# letters so that the DOB label next to a date survives (an issue or print
+# date can sit in the same region)
+OCR_DOB_WHITELIST = '0123456789/-.:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
 
-# Ensure logs directory exists
-log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
-os.makedirs(log_dir, exist_ok=True)
-log_file = os.path.join(log_dir, 'app.log')
+# Document Signatures (see verification/signature_validation.py)
+# PEM/DER certificates trusted to sign Aadhaar XML and e-Aadhaar PDFs (the
+# UIDAI signing certificate and/or the CAs issuing it). Parsed once per process.
+# utils/generate_test_ca.py creates a local test CA for development.
+SIGNATURE_VERIFICATION = os.environ.get('ALTID_SIGNATURE_VERIFICATION', '1') == '1'
+SIGNATURE_TRUST_DIR = os.environ.get('ALTID_SIGNATURE_TRUST_DIR',
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'trust'))
+SIGNATURE_CERT_CACHE_SIZE = 256  # Parsed certificates / validated chains kept in each LRU
+SIGNATURE_MAX_CHAIN_DEPTH = 6
+SIGNATURE_ALLOW_SHA1 = True  # UIDAI offline XML is still signed with RSA-SHA1
+
+# Uploads (see utils/uploads.py)
+# File parts are streamed into memory and the request is aborted with 413 as
+# soon as the endpoint's limit is passed; the file type is sniffed from content
+UPLOAD_MAX_BYTES = 10 * 1024 * 1024  # Endpoints not listed below
+UPLOAD_LIMITS = {
+    'upload_doc': 10 * 1024 * 1024,  # e-Aadhaar PDFs and XMLs are well under this
+    'upload_selfie': 8 * 1024 * 1024,
+}
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024  # Allowance for the other form fields and multipart framing
+MAX_CONTENT_LENGTH = max(UPLOAD_MAX_BYTES, *UPLOAD_LIMITS.values()) + UPLOAD_FORM_OVERHEAD_BYTES
+
+# Image Ingest (see verification/image_ingest.py)
+# Uploads are decoded straight to the working resolution (JPEG DCT scaling)
+INGEST_MAX_PIXELS = 4_000_000  # Decoded working images are downscaled to at most this
+INGEST_MAX_SOURCE_PIXELS = 100_000_000  # Larger images are refused before decoding
+FACE_INGEST_MAX_SIDE = 1280  # Selfies and photos are decoded to this longest side for detection
+
+# PDF Documents
+PDF_MIN_PHOTO_SIDE = 64  # Embedded images smaller than this (px) are skipped as logos
+
+# Face Matching
+FACE_MODEL_NAME = 'Facenet'  # Good balance of speed and accuracy
+# Detectors are tried in order. A cheap tier decides the request only when it
+# finds exactly one face at or above its minimum confidence; otherwise the next
+# tier runs. The last tier always decides. RetinaFace is good at detecting faces
+# in various conditions but is by far the slowest stage on CPU.
+FACE_DETECTOR_CASCADE = ['yunet', 'retinaface']
+FACE_DETECTOR_MIN_CONFIDENCE = {
+    'yunet': 0.90,
+    'ssd': 0.90,
+    'mtcnn': 0.95,
+    'opencv': 0.0,  # Haar cascades report no meaningful score
+}
+FACE_MATCH_THRESHOLD = 0.40  # Max cosine distance for a match (DeepFace's Facenet default)
+# Embedding backend (see verification/face_embedding.py): 'deepface' runs
+# FACE_MODEL_NAME on TensorFlow; 'onnx' and 'onnx-int8' run the same weights,
+# converted by utils/convert_face_model.py, on ONNX Runtime. Check a converted
+# model with benchmarks/embedding_parity.py before switching.
+FACE_EMBEDDING_BACKEND = os.environ.get('ALTID_FACE_EMBEDDING_BACKEND', 'deepface')
+FACE_ONNX_DIR = os.environ.get('ALTID_FACE_ONNX_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'models'))
+# Intra-op threads per ONNX Runtime session. Admission already runs one
+# verification per core, so more threads per inference only oversubscribe.
+FACE_ONNX_THREADS = int(os.environ.get('ALTID_FACE_ONNX_THREADS', 1))
+
+# Sessions (see utils/session_store.py)
+# 'memory' keeps sessions in each worker process; 'sqlite' shares them between
+# all worker processes on a host so no sticky routing is needed
+SESSION_BACKEND = os.environ.get('ALTID_SESSION_BACKEND', 'memory')
+SESSION_TTL_SECONDS = 30 * 60
+SESSION_MAX_ENTRIES = 10000  # LRU-evicted beyond this (memory backend)
+SESSION_MAX_BYTES = 64 * 1024 * 1024  # Total pickled session size budget (memory backend)
+SESSION_SWEEP_INTERVAL_SECONDS = 60
+data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+SESSION_DB_PATH = os.environ.get('ALTID_SESSION_DB_PATH', os.path.join(data_dir, 'sessions.db'))
 
-# Configure root logger
-root_logger = logging.getLogger()
-root_logger.setLevel(LOG_LEVEL)
+# Document Result Cache (see utils/result_cache.py)
+# Extraction results keyed by the SHA-256 of the uploaded document, so a
+# re-upload of the same file skips signature, text, DOB and face stages.
+# 'memory' is per process; 'sqlite' is shared by all workers on the host;
+# 'none' disables the cache.
+DOC_CACHE_BACKEND = os.environ.get('ALTID_DOC_CACHE_BACKEND', 'memory')
+DOC_CACHE_TTL_SECONDS = 60 * 60
+DOC_CACHE_MAX_ENTRIES = 2000
+DOC_CACHE_MAX_BYTES = 16 * 1024 * 1024  # Memory backend only
+DOC_CACHE_DB_PATH = os.environ.get('ALTID_DOC_CACHE_DB_PATH', os.path.join(data_dir, 'doc_cache.db'))
 
-# Clear any existing handlers
-for handler in root_logger.handlers[:]:
-    root_logger.removeHandler(handler)
+# Token Verification (see utils/token_verifier.py)
+# /verify-token and relying parties using TokenVerifier remember verified
+# tokens until they expire. Revoked token ids (jti), one per line in
+# JWT_REVOKED_JTIS_PATH, are published as a Bloom filter at /revocations.
+TOKEN_CACHE_SIZE = 10_000
+JWT_REVOKED_JTIS_PATH = os.environ.get('ALTID_JWT_REVOKED_JTIS', os.path.join(data_dir, 'revoked_jtis.txt'))
+REVOCATION_RELOAD_SECONDS = 5  # How often the revocation file is checked for changes
+REVOCATION_BLOOM_CAPACITY = 10_000  # Revoked jtis the filter is sized for (grown if exceeded)
+REVOCATION_BLOOM_ERROR_RATE = 1e-4  # False positive rate at capacity (~2.4 bytes per jti)
 
-# Create file handler which logs even debug messages
-file_handler = logging.FileHandler(log_file)
-file_handler.setLevel(LOG_LEVEL)
+# Face Index (see verification/face_index.py)
+# Verified selfie embeddings are kept in a memory-mapped matrix shared by every
+# process on the host. Each new selfie is searched against it, and a face that
+# matches sessions for other documents is flagged for review. Run
+# `python -m verification.face_index compact` periodically (e.g. hourly from
+# cron) to drop expired entries and rebuild the IVF clustering.
+FACE_INDEX_ENABLED = os.environ.get('ALTID_FACE_INDEX', '1') == '1'
+FACE_INDEX_DIR = os.environ.get('ALTID_FACE_INDEX_DIR', os.path.join(data_dir, 'face_index'))
+FACE_INDEX_DTYPE = 'float16'  # Half the pages of float32; similarities are computed in float32
+FACE_INDEX_TTL_SECONDS = 90 * 24 * 60 * 60
+FACE_INDEX_REUSE_THRESHOLD = 0.30  # Max cosine distance to flag, stricter than FACE_MATCH_THRESHOLD
+FACE_INDEX_TOP_K = 10
+FACE_INDEX_IVF_MIN_ROWS = 100_000  # Smaller indexes are searched exhaustively
+FACE_INDEX_IVF_NPROBE = 8  # Clusters searched per query
 
-# Create console handler with a higher log level
-console_handler = logging.StreamHandler()
-console_handler.setLevel(LOG_LEVEL)
+# Async Jobs (see utils/jobs.py)
+# With ALTID_ASYNC_JOBS=1 /upload-doc and /upload-selfie return 202 with a job
+# id and the verification runs in a process pool; poll /status/<job_id>
+ASYNC_JOBS = os.environ.get('ALTID_ASYNC_JOBS', '0') == '1'
+JOB_WORKERS = int(os.environ.get('ALTID_JOB_WORKERS', os.cpu_count() or 1))
+JOB_MAX_PENDING = 64  # Queued + running jobs per web process before rejecting with 503
+JOB_TTL_SECONDS = 10 * 60  # How long finished job results can be fetched
+JOB_MAX_WAIT_SECONDS = 30  # Upper bound for long-polling /status/<job_id>?wait=
+JOB_POLL_INTERVAL_SECONDS = 0.1  # How often a long-poll checks the job record
+JOB_RETRY_AFTER_SECONDS = 5  # Retry-After sent when the job queue is full
 
-# Create formatter and add it to the handlers
-formatter = logging.Formatter(LOG_FORMAT)
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+# Admission Control (see utils/admission.py)
+# At most ADMISSION_MAX_IN_FLIGHT document/selfie verifications run at once per
+# web process; up to ADMISSION_MAX_QUEUE more wait up to ADMISSION_MAX_WAIT_SECONDS
+# and the rest are shed with 503 and Retry-After. Give the server more threads
+# than in-flight + queue so /start, /status and /metrics are never starved.
+# ALTID_ADMISSION_HOST_SLOTS > 0 additionally caps verifications across all
+# worker processes on the host (e.g. to the number of cores).
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ALTID_ADMISSION_MAX_IN_FLIGHT', os.cpu_count() or 1))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ALTID_ADMISSION_MAX_QUEUE', 16))
+ADMISSION_MAX_WAIT_SECONDS = 10
+ADMISSION_HOST_SLOTS = int(os.environ.get('ALTID_ADMISSION_HOST_SLOTS', 0))
+ADMISSION_LOCK_DIR = os.environ.get('ALTID_ADMISSION_LOCK_DIR', os.path.join(data_dir, 'admission'))
+ADMISSION_RETRY_AFTER_MAX_SECONDS = 30
 
-# Add the handlers to the root logger
-root_logger.addHandler(file_handler)
-root_logger.addHandler(console_handler)
+# Serving (see asgi.py and gunicorn.conf.py)
+# Under ASGI, each web worker runs light endpoints and verifications on
+# separate thread pools, so /start, /status and /public-key never wait for a
+# verification thread. The verification pool matches the admission limits.
+ASGI_LIGHT_THREADS = int(os.environ.get('ALTID_ASGI_LIGHT_THREADS', 8))
+ASGI_HEAVY_THREADS = ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE
+# 'inline' runs the verification stages in the request thread; 'process' runs
+# them in a pool of PIPELINE_PROCESS_WORKERS processes per web worker, so OCR
+# and face inference do not hold the web process's GIL
+PIPELINE_EXECUTOR = os.environ.get('ALTID_PIPELINE_EXECUTOR', 'inline')
+PIPELINE_PROCESS_WORKERS = int(os.environ.get('ALTID_PIPELINE_PROCESS_WORKERS', ADMISSION_MAX_IN_FLIGHT))
 
-logger = logging.getLogger(__name__)
-logger.info(f"Logging initialized. Log file: {log_file}")
-LOG_FILE = 'verification_failures.log'
\ No newline at end of file
+# Batch Re-verification (see verification/batch.py)
+# python -m verification.batch re-runs the document checks over a directory or
+# manifest of archived documents, streaming results to a JSONL file it can
+# resume. POST /batch starts the same run in a background process; it is
+# disabled unless ALTID_BATCH_TOKEN is set and only reads and writes under
+# BATCH_ROOT.
+BATCH_TOKEN = os.environ.get('ALTID_BATCH_TOKEN')
+BATCH_ROOT = os.environ.get('ALTID_BATCH_ROOT', os.path.join(data_dir, 'batch'))
+BATCH_WORKERS = int(os.environ.get('ALTID_BATCH_WORKERS', max(1, (os.cpu_count() or 1) // 2)))
+BATCH_CHUNK_SIZE = 8  # Documents per task sent to a worker process
+BATCH_NICENESS = 10  # Batch workers yield the CPU to live verifications
+
+# Startup
+# With ALTID_FAST_START=1 the app serves the lightweight endpoints immediately
+# and imports/warms the verification models in a background thread (see /ready).
+# Otherwise warm-up completes before the app starts accepting requests. When
+# the pipeline runs in a process pool (async jobs or ALTID_PIPELINE_EXECUTOR=process)
+# only the pool's workers load the models, and readiness waits for them.
+FAST_START = os.environ.get('ALTID_FAST_START', '0') == '1'
+
+# Face Inference Service (see verification/inference_server.py)
+# Set ALTID_FACE_INFERENCE_ADDRESS to a unix socket path or host:port to have
+# web workers delegate detection and embedding to a shared inference process.
+# Requests are pickled, so only authenticated peers may connect. A unix socket
+# (created 0600) is the supported transport; without ALTID_FACE_INFERENCE_AUTHKEY
+# the service writes a random key next to it for its clients to read. A TCP
+# address requires ALTID_FACE_INFERENCE_AUTHKEY to be a secret of at least
+# FACE_INFERENCE_MIN_AUTHKEY_BYTES bytes.
+FACE_INFERENCE_ADDRESS = os.environ.get('ALTID_FACE_INFERENCE_ADDRESS')
+FACE_INFERENCE_AUTHKEY = os.environ.get('ALTID_FACE_INFERENCE_AUTHKEY', '').encode() or None
+FACE_INFERENCE_MIN_AUTHKEY_BYTES = 16
+FACE_BATCH_MAX_SIZE = 16  # Max faces per embedding forward pass
+FACE_BATCH_MAX_WAIT_MS = 5  # Max time a job waits for others to join its batch
+
+# Metrics (see utils/metrics.py)
+# Stage timings go into per-process histograms, flushed to METRICS_DIR and
+# summed across processes by /metrics; responses carry a Server-Timing header
+METRICS_ENABLED = os.environ.get('ALTID_METRICS', '1') == '1'
+METRICS_DIR = os.environ.get('ALTID_METRICS_DIR', os.path.join(data_dir, 'metrics'))
+METRICS_FLUSH_INTERVAL_SECONDS = 5
+# Histogram bucket upper bounds, in seconds
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SERVER_TIMING = True  # Send stage timings in a Server-Timing response header
+
+# Logging Configuration (handlers are installed by utils.logging_utils.configure_logging)
+LOG_FAILED_ATTEMPTS = True
+LOG_LEVEL = logging.INFO  # Set to DEBUG for more verbose logging
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_QUEUE_SIZE = 10000  # Records beyond this are dropped rather than blocking requests
+# Fraction of records kept per level; levels not listed are always kept
+LOG_SAMPLE_RATES = {
+    logging.DEBUG: 1.0,
+    logging.INFO: 1.0,
+}
+
+# Ensure logs directory exists
+log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
+os.makedirs(log_dir, exist_ok=True)
+log_file = os.path.join(log_dir, 'app.log')
+LOG_FILE = 'verification_failures.log'  # JSON lines, written next to app.log
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+Production launcher config:
+
+    cd backend && gunicorn -c gunicorn.conf.py
+
+Runs asgi:application in uvicorn workers. Each worker imports the app and
+warms up its own models before serving; the app is not preloaded in the
+master, as the job and pipeline process pools must be created in the worker
+that uses them. Verifications run in worker threads (or pipeline processes),
+so the event loop keeps answering heartbeats and light endpoints while they
+run.
+"""
+import os
+
+bind = os.environ.get('ALTID_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('ALTID_WEB_WORKERS', 2))
+worker_class = 'uvicorn.workers.UvicornWorker'
+wsgi_app = 'asgi:application'
+preload_app = False
+timeout = 120  # Covers model warm-up when a worker starts
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound memory growth in the native libraries
+max_requests = int(os.environ.get('ALTID_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+def on_starting(server):
+    # Snapshots of the previous deployment's workers would be summed into /metrics
+    from utils.metrics import clear_metrics_dir
+    clear_metrics_dir()
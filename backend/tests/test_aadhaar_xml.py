@@ -0,0 +1,69 @@
+import base64
+import io
+import xml.etree.ElementTree as ET
+from datetime import date
+
+import pytest
+from PIL import Image
+
+from verification.aadhaar_xml import parse_aadhaar_xml
+
+def png_base64() -> str:
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color=(200, 150, 120)).save(buffer, 'PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+def test_oky_format_reads_attributes():
+    xml = (f'<OKY v="1" n="Asha Rao" d="15-08-1990" i="{png_base64()}" s="c2lnbmF0dXJl"/>').encode()
+    document = parse_aadhaar_xml(xml)
+    assert document.root_tag == 'OKY'
+    assert document.dob == date(1990, 8, 15)
+    assert document.photo.size == (8, 8)
+    # Blobs are never treated as text
+    assert 'Asha Rao' in document.text
+    assert 'c2lnbmF0dXJl' not in document.text
+
+def test_offline_paperless_kyc_format():
+    xml = f'''<OfflinePaperlessKyc referenceId="1234">
+      <UidData>
+        <Poi dob="01-02-1985" gender="F" name="Asha Rao"/>
+        <Poa dist="Pune" state="Maharashtra"/>
+        <Pht>{png_base64()}</Pht>
+      </UidData>
+      <Signature xmlns="http://www.w3.org/2000/09/xmldsig#">
+        <SignedInfo><Reference URI="">01-01-2015</Reference></SignedInfo>
+        <SignatureValue>abc</SignatureValue>
+      </Signature>
+    </OfflinePaperlessKyc>'''.encode()
+    document = parse_aadhaar_xml(xml)
+    assert document.dob == date(1985, 2, 1)
+    assert document.photo is not None
+    assert 'Pune' in document.text
+    # Nothing inside the signature is read
+    assert '01-01-2015' not in document.text
+
+def test_dob_falls_back_to_text_fields():
+    document = parse_aadhaar_xml(b'<Record><Note>DOB: 03/04/1970</Note></Record>')
+    assert document.dob_field is None
+    assert document.dob == date(1970, 4, 3)
+
+def test_missing_photo():
+    document = parse_aadhaar_xml(b'<OKY d="15-08-1990"/>')
+    assert document.photo is None
+
+def test_malformed_xml_raises():
+    with pytest.raises(ET.ParseError):
+        parse_aadhaar_xml(b'<OKY d="15-08-1990">')
+
+def test_reading_a_parsed_tree_matches_the_streaming_parse():
+    from verification.aadhaar_xml import read_aadhaar_element
+
+    xml = f'''<OfflinePaperlessKyc><UidData>
+        <Poi dob="01-02-1985" name="Asha Rao"/><Pht>{png_base64()}</Pht>
+      </UidData>
+      <Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignatureValue>01-01-2015</SignatureValue></Signature>
+    </OfflinePaperlessKyc>'''.encode()
+    streamed = parse_aadhaar_xml(xml)
+    read = read_aadhaar_element(ET.fromstring(xml))
+    assert (read.root_tag, read.dob_field, read.photo_data, read.text_fields) == \
+        (streamed.root_tag, streamed.dob_field, streamed.photo_data, streamed.text_fields)
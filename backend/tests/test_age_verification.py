@@ -0,0 +1,50 @@
+from datetime import date
+
+from verification.age_verification import extract_dob_from_text
+
+def test_region_text_without_a_dob_label_is_not_trusted():
+    # An issue date in the DOB region must fall through to the full page
+    assert extract_dob_from_text('Issue Date: 12/05/2019', require_label=True) is None
+    assert extract_dob_from_text('12/05/2019', require_label=True) is None
+
+def test_region_text_with_a_dob_label_is_trusted():
+    text = 'Print Date: 12/05/2019\nDOB: 01/02/1990'
+    assert extract_dob_from_text(text, require_label=True) == date(1990, 2, 1)
+    assert extract_dob_from_text('Year of Birth: 1985', require_label=True) == date(1985, 12, 31)
+
+def test_labelled_dob_beats_earlier_unlabelled_date():
+    text = 'Government of India 05/06/2001\nAsha Rao\nDOB: 14/03/1992\nMale'
+    assert extract_dob_from_text(text) == date(1992, 3, 14)
+
+def test_issue_and_download_dates_are_never_returned():
+    assert extract_dob_from_text('Issue Date: 01/01/2020\nDownload Date: 02/02/2021') is None
+    assert extract_dob_from_text('Issue Date: 01/01/2020 DOB 09.10.1980') == date(1980, 10, 9)
+
+def test_unlabelled_date_is_accepted_when_nothing_is_labelled():
+    assert extract_dob_from_text('Asha Rao\n21-07-1975') == date(1975, 7, 21)
+
+def test_supported_layouts():
+    assert extract_dob_from_text('DOB: 1990-12-25') == date(1990, 12, 25)
+    assert extract_dob_from_text('Date of Birth: 07 Sep 1988') == date(1988, 9, 7)
+    assert extract_dob_from_text('Date of Birth: 07 September 1988') == date(1988, 9, 7)
+    assert extract_dob_from_text('जन्म तिथि / DOB : 11/11/1961') == date(1961, 11, 11)
+
+def test_label_only_applies_up_to_the_next_date():
+    # The DOB label belongs to the first date, not to the issue date after it
+    text = 'DOB: 02/03/1999 Issued 04/05/2010'
+    assert extract_dob_from_text(text) == date(1999, 3, 2)
+
+def test_invalid_and_implausible_dates_are_skipped():
+    # Only the labelled year is usable, so the latest possible birthday is taken
+    assert extract_dob_from_text('DOB: 31/02/1990') == date(1990, 12, 31)
+    assert extract_dob_from_text('Issued 31/02/1990') is None
+    assert extract_dob_from_text(f'DOB: 01/01/{date.today().year + 1}') is None
+
+def test_year_of_birth_is_conservative():
+    assert extract_dob_from_text('Year of Birth : 1990') == date(1990, 12, 31)
+    # A bare year without a label is not a DOB
+    assert extract_dob_from_text('Printed in 1990') is None
+
+def test_empty_text():
+    assert extract_dob_from_text('') is None
+    assert extract_dob_from_text(None) is None
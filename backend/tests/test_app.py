@@ -0,0 +1,53 @@
+import pytest
+
+import app as app_module
+from verification import batch
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+@pytest.fixture
+def batch_auth(tmp_path, monkeypatch):
+    for module in (app_module, batch):
+        monkeypatch.setattr(module, 'BATCH_TOKEN', 'secret')
+    monkeypatch.setattr(batch, 'BATCH_ROOT', str(tmp_path))
+    return {'Authorization': 'Bearer secret'}
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    'archive',
+    {'batch_id': ['b1'], 'source': 'docs'},
+    {'batch_id': 'b1', 'source': ['docs']},
+    {'batch_id': 'b1', 'source': 'docs', 'selfie_dir': {'path': 'selfies'}},
+    {'batch_id': '../b1', 'source': 'docs'},
+])
+def test_start_batch_rejects_malformed_bodies(client, batch_auth, body):
+    assert client.post('/batch', json=body, headers=batch_auth).status_code == 400
+
+def test_start_batch_rejects_paths_outside_the_root(client, batch_auth):
+    response = client.post('/batch', json={'batch_id': 'b1', 'source': '../..'}, headers=batch_auth)
+    assert response.status_code == 400
+
+def test_start_batch_answers_409_while_running(client, batch_auth, tmp_path, monkeypatch):
+    (tmp_path / 'docs').mkdir()
+
+    def already_running(batch_id, source, selfie_dir=None):
+        raise batch.BatchRunning(batch_id)
+
+    monkeypatch.setattr(batch, 'start_batch', already_running)
+    response = client.post('/batch', json={'batch_id': 'b1', 'source': 'docs'}, headers=batch_auth)
+    assert response.status_code == 409
+
+@pytest.mark.parametrize('body', [[1, 2], 'token', {'token': {'a': 1}}, {'token': ['a']}, {'token': 42}])
+def test_verify_token_rejects_malformed_bodies(client, body):
+    assert client.post('/verify-token', json=body).status_code == 400
+
+def test_verify_token_reports_invalid_tokens_as_inactive(client):
+    response = client.post('/verify-token', data={'token': 'not.a.token'})
+    assert response.status_code == 200 and response.get_json() == {'active': False}
+
+@pytest.mark.parametrize('method, path', [('POST', '/batch'), ('GET', '/batch/b1')])
+def test_batch_rejects_non_ascii_authorization(client, batch_auth, method, path):
+    response = client.open(path, method=method, json={}, headers={'Authorization': 'Bearer sécret'})
+    assert response.status_code == 401
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+from config import UPLOAD_FORM_OVERHEAD_BYTES, UPLOAD_LIMITS
+from asgi import WsgiAdapter, endpoint_body_limit
+
+def _scope(path, method='POST', query=b'', headers=()):
+    return {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'http_version': '1.1',
+            'headers': list(headers)}
+
+def _echo_app(calls):
+    def app(environ, start_response):
+        calls.append({'query': environ['QUERY_STRING'], 'body': environ['wsgi.input'].read(),
+                      'thread': threading.current_thread().name})
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+    return app
+
+async def _call(adapter, scope, chunks=(b'',)):
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await adapter(scope, receive, send)
+    return sent[0]['status'], sent[1]['body']
+
+def test_body_limit_follows_the_endpoint():
+    assert endpoint_body_limit('POST', '/upload-selfie') == UPLOAD_LIMITS['upload_selfie'] + UPLOAD_FORM_OVERHEAD_BYTES
+    assert endpoint_body_limit('POST', '/upload-doc') == UPLOAD_LIMITS['upload_doc'] + UPLOAD_FORM_OVERHEAD_BYTES
+
+def test_streamed_body_over_the_endpoint_limit_is_refused():
+    calls = []
+    limits = {'/upload-selfie': 8, '/upload-doc': 16}
+    adapter = WsgiAdapter(_echo_app(calls), body_limit=lambda method, path: limits[path])
+    assert asyncio.run(_call(adapter, _scope('/upload-selfie'), [b'12345', b'6789'])) == (413, b'{"error": "Upload too large"}')
+    assert asyncio.run(_call(adapter, _scope('/upload-doc'), [b'12345', b'6789'])) == (200, b'ok')
+    declared = _scope('/upload-selfie', headers=[(b'content-length', b'9')])
+    assert asyncio.run(_call(adapter, declared, [b'1']))[0] == 413
+    assert [call['body'] for call in calls] == [b'123456789']
+    assert adapter.heavy_in_flight == 0
+
+def test_heavy_slot_is_taken_before_the_body_arrives():
+    adapter = WsgiAdapter(_echo_app([]), heavy_threads=1)
+
+    async def run():
+        body_arrives = asyncio.Event()
+
+        async def slow_receive():
+            await body_arrives.wait()
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        first = asyncio.ensure_future(adapter(_scope('/upload-doc'), slow_receive, send))
+        await asyncio.sleep(0)
+        assert adapter.heavy_in_flight == 1
+        shed = await _call(adapter, _scope('/upload-selfie'))
+        body_arrives.set()
+        await first
+        return shed, sent[0]['status']
+
+    (shed_status, _), first_status = asyncio.run(run())
+    assert (shed_status, first_status) == (503, 200)
+    assert adapter.heavy_in_flight == 0
+
+class _Jobs:
+    def __init__(self, polls_until_done):
+        self.polls = 0
+        self.polls_until_done = polls_until_done
+
+    def get(self, job_id):
+        self.polls += 1
+        return {'status': 'done' if self.polls >= self.polls_until_done else 'pending'}
+
+def test_long_poll_waits_on_the_event_loop():
+    calls = []
+    jobs = _Jobs(polls_until_done=3)
+    adapter = WsgiAdapter(_echo_app(calls), light_threads=1, jobs=jobs)
+    status, _ = asyncio.run(_call(adapter, _scope('/status/job1', method='GET', query=b'wait=5&x=1')))
+    assert status == 200
+    assert jobs.polls == 3
+    # The app sees the request without 'wait', so it answers straight away
+    assert calls[0]['query'] == 'x=1'
+
+def test_long_poll_gives_up_at_the_deadline():
+    calls = []
+    jobs = _Jobs(polls_until_done=10 ** 6)
+    adapter = WsgiAdapter(_echo_app(calls), jobs=jobs)
+    asyncio.run(_call(adapter, _scope('/status/job1', method='GET', query=b'wait=0.3')))
+    assert 1 < jobs.polls < 10
+    assert calls[0]['query'] == ''
@@ -0,0 +1,59 @@
+import fcntl
+import json
+
+import pytest
+
+from verification import batch
+
+@pytest.fixture
+def batch_root(tmp_path, monkeypatch):
+    root = tmp_path / 'batch'
+    (root / 'docs').mkdir(parents=True)
+    monkeypatch.setattr(batch, 'BATCH_ROOT', str(root))
+    return root
+
+def _manifest(path, rows):
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+    return str(path)
+
+def test_manifest_paths_outside_the_root_are_errors(batch_root, tmp_path):
+    (batch_root / 'docs' / 'a.pdf').write_bytes(b'%PDF-1.4\n')
+    (tmp_path / 'secret.pdf').write_bytes(b'%PDF-1.4\n')
+    manifest = _manifest(batch_root / 'docs' / 'manifest.jsonl', [
+        {'id': 'ok', 'document': 'a.pdf'},
+        {'id': 'up', 'document': '../../secret.pdf'},
+        {'id': 'absolute', 'document': str(tmp_path / 'secret.pdf')},
+        {'id': 'selfie', 'document': 'a.pdf', 'selfie': '/etc/passwd'},
+    ])
+    items = {item['id']: item for item in batch.iter_items(manifest, root=str(batch_root))}
+    assert items['ok']['document'] == str((batch_root / 'docs' / 'a.pdf').resolve())
+    assert 'error' not in items['ok']
+    for item_id in ('up', 'absolute', 'selfie'):
+        assert items[item_id]['error'].startswith('Not found under the batch root')
+
+def test_manifest_paths_are_not_confined_without_a_root(tmp_path):
+    manifest = _manifest(tmp_path / 'manifest.jsonl', [{'id': 'up', 'document': '../x.pdf'}])
+    item, = batch.iter_items(manifest)
+    assert item['document'] == str(tmp_path / '../x.pdf') and 'error' not in item
+
+def test_error_items_are_recorded_without_being_read():
+    record = batch.verify_item({'id': 'up', 'document': '/etc/passwd', 'error': 'Not found under the batch root'})
+    assert record['status'] == 'error' and 'sha256' not in record
+
+def test_running_state_follows_the_lock(batch_root):
+    paths = batch._batch_paths('b1')
+    (batch_root / 'results').mkdir()
+    open(paths['log'], 'w').close()
+    with open(paths['lock'], 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # As held by a running batch process
+        assert batch.batch_status('b1')['status'] == 'running'
+        with pytest.raises(batch.BatchRunning):
+            batch.start_batch('b1', str(batch_root / 'docs'))
+    # The process died without writing a summary
+    assert batch.batch_status('b1')['status'] == 'interrupted'
+
+def test_started_batch_runs_to_completion(batch_root):
+    process = batch.start_batch('b2', str(batch_root / 'docs'))
+    assert process.wait(timeout=60) == 0
+    status = batch.batch_status('b2')
+    assert status['status'] == 'done' and status['processed'] == 0
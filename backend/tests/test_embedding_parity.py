@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from verification.face_embedding import EmbeddingBackend
+
+# Largest change in any pairwise cosine distance and smallest share of match
+# decisions at FACE_MATCH_THRESHOLD that must agree with the Keras model
+PARITY_BOUNDS = {
+    'onnx': (0.02, 1.0),
+    'onnx-int8': (0.05, 0.95),
+}
+
+def test_embedding_backend_is_abstract():
+    with pytest.raises(TypeError):
+        EmbeddingBackend()
+
+@pytest.fixture(scope='module')
+def reference():
+    pytest.importorskip('cv2')
+    pytest.importorskip('deepface')
+    from benchmarks.embedding_parity import REFERENCE_BACKEND, embed_all, synthetic_crops
+
+    crops = synthetic_crops()
+    return crops, embed_all(REFERENCE_BACKEND, crops)['embeddings']
+
+@pytest.mark.parametrize('backend', sorted(PARITY_BOUNDS))
+def test_converted_backend_matches_keras_model(reference, backend):
+    pytest.importorskip('onnxruntime')
+    from benchmarks.embedding_parity import embed_all, parity
+
+    crops, reference_embeddings = reference
+    try:
+        candidate = embed_all(backend, crops)['embeddings']
+    except FileNotFoundError as e:
+        pytest.skip(str(e))
+    max_drift, min_agreement = PARITY_BOUNDS[backend]
+    result = parity(reference_embeddings, candidate)
+    assert result['max_distance_drift'] <= max_drift
+    assert result['decision_agreement'] >= min_agreement
+    assert np.allclose(np.linalg.norm(candidate, axis=1), 1.0, atol=1e-4)
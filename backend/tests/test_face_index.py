@@ -0,0 +1,130 @@
+import fcntl
+import hashlib
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pytest
+
+from verification import face_index
+from verification.face_index import FaceIndex, check_face_reuse, document_key
+
+DIM = 16
+
+def _unit(rng, n=1):
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+@pytest.fixture
+def index(tmp_path):
+    return FaceIndex(path=str(tmp_path / 'face_index'), ttl_seconds=3600)
+
+def test_search_returns_nearest_first(index, rng):
+    vectors = _unit(rng, 20)
+    for i, vector in enumerate(vectors):
+        index.add(vector, f's{i}', doc_key=i)
+    results = index.search(vectors[3], k=3)
+    assert [r['session_id'] for r in results][0] == 's3'
+    assert results[0]['distance'] < 1e-2 and results[0]['doc_key'] == 3
+    assert [r['distance'] for r in results] == sorted(r['distance'] for r in results)
+    assert 's3' not in [r['session_id'] for r in index.search(vectors[3], k=3, exclude_session='s3')]
+
+def test_empty_index_and_dimension_checks(index, rng):
+    assert index.search(_unit(rng)[0]) == []
+    index.add(_unit(rng)[0], 's0')
+    with pytest.raises(ValueError):
+        index.add(np.ones(DIM + 1, dtype=np.float32), 's1')
+    with pytest.raises(ValueError):
+        FaceIndex(path=index.path, dtype='float32')
+
+def test_index_grows_past_its_capacity(index, rng, monkeypatch):
+    monkeypatch.setattr(face_index, 'INITIAL_CAPACITY', 4)
+    vectors = _unit(rng, 11)
+    for i, vector in enumerate(vectors):
+        index.add(vector, f's{i}')
+    assert len(index) == 11
+    assert index.search(vectors[10], k=1)[0]['session_id'] == 's10'
+
+def test_expired_entries_are_skipped_and_compacted_away(index, rng):
+    old, new = _unit(rng, 2)
+    index.add(old, 'old', created=time.time() - 7200)
+    index.add(new, 'new')
+    assert [r['session_id'] for r in index.search(old, k=5)] == ['new']
+    assert index.compact() == {'rows': 1, 'dropped': 1, 'clusters': 0}
+    assert len(index) == 1
+    assert index.search(new, k=1)[0]['session_id'] == 'new'
+
+def test_clustered_index_finds_every_row(index, rng, monkeypatch):
+    monkeypatch.setattr(face_index, 'FACE_INDEX_IVF_MIN_ROWS', 100)
+    vectors = _unit(rng, 300)
+    for i, vector in enumerate(vectors):
+        index.add(vector, f's{i}')
+    stats = index.compact(nlist=8)
+    assert stats == {'rows': 300, 'dropped': 0, 'clusters': 8}
+    appended = _unit(rng)[0]
+    index.add(appended, 'appended')
+    for i in (0, 150, 299):
+        assert index.search(vectors[i], k=1, nprobe=8)[0]['session_id'] == f's{i}'
+    # Rows appended since the compaction are always scanned
+    assert index.search(appended, k=1, nprobe=1)[0]['session_id'] == 'appended'
+
+def _add_rows(index, worker, vectors):
+    for i, vector in enumerate(vectors):
+        index.add(vector, f'w{worker}-{i}')
+
+def test_processes_share_the_index(index, rng):
+    vectors = _unit(rng, 40)
+    index.add(vectors[0], 'parent')  # The children inherit an open handle
+    chunks = np.split(vectors[1:], 3)
+    processes = [multiprocessing.Process(target=_add_rows, args=(index, worker, chunk))
+                 for worker, chunk in enumerate(chunks)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(index) == 40
+    other = FaceIndex(path=index.path, ttl_seconds=3600)
+    expected = {'parent'} | {f'w{worker}-{i}' for worker in range(3) for i in range(13)}
+    assert {r['session_id'] for r in other.search(vectors[0], k=40)} == expected
+
+def _digest(name):
+    return hashlib.sha256(name.encode()).hexdigest()
+
+@pytest.fixture
+def shared_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_index, '_index', FaceIndex(path=str(tmp_path / 'face_index'), ttl_seconds=3600))
+
+def test_reuse_is_flagged_for_a_different_document(shared_index, rng):
+    selfie = _unit(rng)[0]
+    assert check_face_reuse(selfie, 's1', _digest('doc-a')) == []
+    matches = check_face_reuse(selfie, 's2', _digest('doc-b'))
+    assert [m['session_id'] for m in matches] == ['s1']
+    assert matches[0]['doc_key'] == document_key(_digest('doc-a'))
+
+def test_same_document_in_another_session_is_not_reuse(shared_index, rng):
+    # The document's face embedding differs between sessions (backend, detector
+    # tier, batch), so only the upload digest identifies the document
+    selfie = _unit(rng)[0]
+    perturbed = selfie + 0.01 * _unit(rng)[0]
+    assert check_face_reuse(selfie, 's1', _digest('doc-a')) == []
+    assert check_face_reuse(perturbed / np.linalg.norm(perturbed), 's2', _digest('doc-a')) == []
+
+def test_reuse_is_not_checked_without_a_document_digest(shared_index, rng):
+    selfie = _unit(rng)[0]
+    check_face_reuse(selfie, 's1', _digest('doc-a'))
+    assert check_face_reuse(selfie, 's2', None) == []
+    assert len(face_index._index) == 1
+
+def test_concurrent_compaction_is_refused(index, rng):
+    for i, vector in enumerate(_unit(rng, 5)):
+        index.add(vector, f's{i}')
+    with open(os.path.join(index.path, 'compact.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # As held by a compaction in another process
+        with pytest.raises(RuntimeError):
+            index.compact()
+    assert index.compact()['rows'] == 5
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from utils import metrics
+from verification import face_match
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, '_registry', metrics._Registry())
+    monkeypatch.setattr(metrics, '_dir', None)
+
+def _tier_counts():
+    return {dict(labels)['tier']: value for (name, labels), value in metrics.collect()['counters'].items()
+            if name == face_match.DETECTOR_TIER_COUNTER}
+
+def _fake_detectors(monkeypatch, results):
+    def run_detector(image, detector_backend):
+        return results[detector_backend]
+    monkeypatch.setattr(face_match, '_run_detector', run_detector)
+
+def _face(confidence):
+    return {'face': np.zeros((4, 4, 3)), 'confidence': confidence}
+
+def test_escalates_to_next_tier_on_low_confidence(registry, monkeypatch):
+    monkeypatch.setattr(face_match, 'FACE_DETECTOR_MIN_CONFIDENCE', {'cheap': 0.9})
+    _fake_detectors(monkeypatch, {'cheap': [_face(0.5)], 'strong': [_face(0.99)]})
+    faces, tier = face_match.detect_faces_with_tier('image.jpg', cascade=['cheap', 'strong'])
+    assert tier == 'strong' and len(faces) == 1
+    assert _tier_counts() == {'strong': 1}
+
+def test_uncounted_runs_leave_the_counter_alone(registry, monkeypatch):
+    _fake_detectors(monkeypatch, {'cheap': []})
+    assert face_match.detect_faces_with_tier('image.jpg', cascade=['cheap'], count=False) == ([], 'cheap')
+    assert _tier_counts() == {}
+
+def test_inference_service_tier_is_counted_by_the_client(registry, monkeypatch):
+    from verification import inference_server
+
+    class FakeClient(inference_server.InferenceClient):
+        def request(self, request):
+            return {'embeddings': np.ones((1, 4), dtype=np.float32), 'distances': None, 'detector': 'strong'}
+
+    monkeypatch.setattr(face_match, 'FACE_INFERENCE_ADDRESS', '/tmp/altid-face.sock')
+    monkeypatch.setattr(inference_server, 'get_client', lambda: FakeClient('/tmp/altid-face.sock'))
+    embeddings = face_match.get_face_embeddings('image.jpg')
+    assert embeddings.shape == (1, 4)
+    assert _tier_counts() == {'strong': 1}
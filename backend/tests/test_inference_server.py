@@ -0,0 +1,48 @@
+import os
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError
+
+import pytest
+
+from verification.inference_server import (InferenceClient, InferenceServer, authkey_path, parse_address,
+                                           server_authkey)
+
+class EchoServer(InferenceServer):
+    def handle_request(self, request):
+        return {'embeddings': request['image'], 'distances': None, 'detector': 'test'}
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for _ in range(100):
+        if os.path.exists(server.address):
+            return
+        time.sleep(0.01)
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_unix_socket_gets_a_private_generated_key(tmp_path):
+    address = str(tmp_path / 'face.sock')
+    server = EchoServer(address, authkey=None, batcher=object())
+    _serve(server)
+    assert _mode(address) == 0o600
+    assert _mode(authkey_path(address)) == 0o600
+    with open(authkey_path(address), 'rb') as f:
+        assert f.read() == server.authkey and len(server.authkey) == 32
+    assert InferenceClient(address, authkey=None).embed('image') == ('image', 'test')
+
+def test_wrong_key_is_refused(tmp_path):
+    address = str(tmp_path / 'face.sock')
+    _serve(EchoServer(address, authkey=None, batcher=object()))
+    with pytest.raises(AuthenticationError):
+        InferenceClient(address, authkey=b'x' * 32).embed('image')
+
+@pytest.mark.parametrize('authkey', [None, b'altid-local', b'short'])
+def test_tcp_requires_a_configured_secret(authkey):
+    with pytest.raises(ValueError):
+        server_authkey(parse_address('127.0.0.1:7001'), authkey)
+
+def test_tcp_accepts_a_long_secret():
+    assert server_authkey(('127.0.0.1', 7001), b's' * 32) == b's' * 32
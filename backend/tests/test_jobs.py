@@ -0,0 +1,29 @@
+import logging
+import uuid
+
+from utils.jobs import PipelinePool
+
+def _log_failure_and_read_back(marker):
+    from utils import logging_utils
+
+    logging_utils.log_failure('Pool worker failure', {'marker': marker})
+    # Stopping the listeners drains their queues into the file handlers
+    logging_utils._stop_listeners()
+    handler, = logging_utils._queue_handlers[1][1]
+    with open(handler.baseFilename) as f:
+        written = marker in f.read()
+    return {
+        'written': written,
+        'root_handlers': len(logging.getLogger().handlers),
+        'info_enabled': logging_utils.failure_logger.isEnabledFor(logging.INFO),
+    }, 200, None
+
+def test_spawned_pool_worker_logs_failures():
+    # The worker's __mp_main__ is pytest, as it is gunicorn's script in
+    # production, so app.py's logging setup never runs there
+    pool = PipelinePool(max_workers=1)
+    try:
+        (state, _, _), _ = pool.run(_log_failure_and_read_back, uuid.uuid4().hex)
+    finally:
+        pool._executor.shutdown()
+    assert state == {'written': True, 'root_handlers': 1, 'info_enabled': True}
@@ -0,0 +1,60 @@
+import json
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+from utils.jwt_utils import KeyRing, PublicKey, issue_token, verify_token
+from utils.token_verifier import TokenVerifier
+
+def pem_pair(private_key):
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_pem, public_pem
+
+@pytest.fixture(scope='module')
+def rsa_pair():
+    return pem_pair(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+
+@pytest.mark.parametrize('private_key, alg', [
+    (ec.generate_private_key(ec.SECP256R1()), 'ES256'),
+    (ed25519.Ed25519PrivateKey.generate(), 'EdDSA'),
+])
+def test_key_ring_algorithms(private_key, alg):
+    key_ring = KeyRing(*pem_pair(private_key))
+    assert key_ring.alg == alg
+    token = jwt.encode({'sub': 'x'}, key_ring.private_key, algorithm=alg, headers={'kid': key_ring.kid})
+    verifier = TokenVerifier.keys_from_jwks(json.loads(key_ring.jwks_body))
+    public_key, verified_alg = verifier[key_ring.kid]
+    assert jwt.decode(token, public_key, algorithms=[verified_alg])['sub'] == 'x'
+
+def test_mismatched_key_pair_is_rejected(rsa_pair):
+    _, other_public = pem_pair(ec.generate_private_key(ec.SECP256R1()))
+    with pytest.raises(ValueError):
+        KeyRing(rsa_pair[0], other_public)
+
+def test_kid_is_stable_and_etags_follow_content(rsa_pair):
+    first, second = KeyRing(*rsa_pair), KeyRing(*rsa_pair)
+    assert first.kid == second.kid == PublicKey(rsa_pair[1]).kid
+    assert first.jwks_etag == second.jwks_etag
+    assert first.public_pem_etag == second.public_pem_etag
+
+    _, next_public = pem_pair(ec.generate_private_key(ec.SECP256R1()))
+    rotating = KeyRing(*rsa_pair, [next_public])
+    assert [key['kid'] for key in json.loads(rotating.jwks_body)['keys']][0] == first.kid
+    assert len(rotating.public_keys) == 2
+    # Publishing another key changes the JWKS, not the signing key's PEM
+    assert rotating.jwks_etag != first.jwks_etag
+    assert rotating.public_pem_etag == first.public_pem_etag
+
+def test_duplicate_additional_key_is_listed_once(rsa_pair):
+    assert len(KeyRing(*rsa_pair, [rsa_pair[1]]).public_keys) == 1
+
+def test_issued_token_verifies():
+    token = issue_token({'sub': 'session', 'age_verified': True})
+    claims = verify_token(token)
+    assert claims['sub'] == 'session' and claims['age_verified'] is True and claims['jti']
+    assert verify_token(token[:-4] + 'AAAA') is None
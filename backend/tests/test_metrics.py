@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from utils import metrics
+
+COUNTER = 'altid_test_total'
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    # Point this process at a fresh directory without starting the flush thread
+    monkeypatch.setattr(metrics, '_registry', metrics._Registry())
+    monkeypatch.setattr(metrics, '_dir', str(tmp_path))
+    monkeypatch.setattr(metrics, '_snapshot_name', None)
+    metrics._name_snapshot()
+    return tmp_path
+
+def _write_snapshot(directory, name, count, gauge=None):
+    snapshot = {
+        'buckets': list(metrics._registry.buckets),
+        'histograms': {},
+        'counters': [[COUNTER, {}, count]],
+        'gauges': [['altid_test_gauge', {}, gauge]] if gauge is not None else [],
+    }
+    (directory / name).write_text(json.dumps(snapshot))
+
+def _counter(totals):
+    return totals['counters'].get((COUNTER, ()), 0)
+
+def test_snapshot_name_has_pid_and_start_time(metrics_dir):
+    metrics.flush()
+    name, = os.listdir(metrics_dir)
+    assert name.startswith(f'{os.getpid()}-')
+    assert metrics._snapshot_is_live(name)
+
+def test_dead_snapshots_are_folded_into_the_aggregate(metrics_dir):
+    metrics.increment(COUNTER)
+    _write_snapshot(metrics_dir, '999999999-123.json', 5, gauge=7)
+    totals = metrics.collect()
+    assert _counter(totals) == 6
+    assert totals['gauges'] == {}  # An exited process's gauges are dropped
+    assert not (metrics_dir / '999999999-123.json').exists()
+    assert (metrics_dir / metrics.RETIRED_SNAPSHOT).exists()
+    # Counted once, not again on the next scrape
+    assert _counter(metrics.collect()) == 6
+
+def test_reused_pid_does_not_count_as_alive(metrics_dir):
+    # Same pid as this process, different start time: an earlier process's file
+    stale = f'{os.getpid()}-1.json'
+    _write_snapshot(metrics_dir, stale, 3)
+    assert not metrics._snapshot_is_live(stale)
+    metrics.increment(COUNTER)
+    assert _counter(metrics.collect()) == 4
+    assert not (metrics_dir / stale).exists()
+
+def test_live_processes_keep_their_snapshots(metrics_dir):
+    child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    try:
+        name = f'{child.pid}-{metrics._process_start(child.pid)}.json'
+        _write_snapshot(metrics_dir, name, 2, gauge=1)
+        totals = metrics.collect()
+        assert _counter(totals) == 2
+        assert totals['gauges'] == {('altid_test_gauge', ()): 1}
+        assert (metrics_dir / name).exists()
+    finally:
+        child.kill()
+        child.wait()
+    assert _counter(metrics.collect()) == 2
+
+def test_file_already_folded_is_not_counted_twice(metrics_dir):
+    # A scrape that folded a file but died before removing it
+    _write_snapshot(metrics_dir, '999999999-123.json', 5)
+    metrics.collect()
+    _write_snapshot(metrics_dir, '999999999-123.json', 5)
+    assert _counter(metrics.collect()) == 5
+
+def test_collect_without_init_counts_this_process(monkeypatch):
+    monkeypatch.setattr(metrics, '_registry', metrics._Registry())
+    monkeypatch.setattr(metrics, '_dir', None)
+    metrics.increment(COUNTER, value=2)
+    assert _counter(metrics.collect()) == 2
+
+def test_clear_metrics_dir_removes_the_aggregate(metrics_dir):
+    _write_snapshot(metrics_dir, '999999999-123.json', 5)
+    metrics.collect()
+    metrics.clear_metrics_dir(str(metrics_dir))
+    assert not any(name.endswith('.json') for name in os.listdir(metrics_dir))
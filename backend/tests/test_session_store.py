@@ -0,0 +1,88 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from utils import result_cache
+from utils.session_store import EntryTooLarge, MemorySessionStore, SessionStore, SQLiteSessionStore
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemorySessionStore(ttl_seconds=60)
+    return SQLiteSessionStore(path=str(tmp_path / 'sessions.db'), ttl_seconds=60)
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+def test_create_get_update_delete(store):
+    session_id = store.create({'callback_url': 'https://rp.example/cb'})
+    assert session_id in store
+    assert store.update(session_id, {'age': 30}) == {'callback_url': 'https://rp.example/cb', 'age': 30}
+    assert store.get(session_id)['age'] == 30
+    store.delete(session_id)
+    assert store.get(session_id) is None
+    assert store.update(session_id, {'age': 31}) is None
+
+def test_expired_entries_are_invisible(store):
+    store.ttl_seconds = 0.01
+    store.set('key', {'a': 1})
+    time.sleep(0.05)
+    assert store.get('key') is None
+    assert store.update('key', {'b': 2}) is None
+    assert store.purge_expired() <= 1
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_entries=2, ttl_seconds=60)
+    store.set('a', {})
+    store.set('b', {})
+    store.get('a')
+    store.set('c', {})
+    assert 'a' in store and 'c' in store and 'b' not in store
+
+def test_memory_store_rejects_entry_over_budget():
+    store = MemorySessionStore(max_bytes=1024, ttl_seconds=60)
+    store.set('small', {'a': 1})
+    with pytest.raises(EntryTooLarge):
+        store.set('big', {'blob': b'x' * 2048})
+    # The entries already stored are not evicted to make room
+    assert store.get('small') == {'a': 1}
+    with pytest.raises(EntryTooLarge):
+        store.update('small', {'blob': b'x' * 2048})
+    assert store.get('small') == {'a': 1}
+
+def _update_many(path, worker, count):
+    store = SQLiteSessionStore(path=path, ttl_seconds=60)
+    for i in range(count):
+        store.update('shared', {f'{worker}-{i}': i})
+
+def test_sqlite_updates_from_several_processes_are_not_lost(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    SQLiteSessionStore(path=path, ttl_seconds=60).set('shared', {})
+    processes = [multiprocessing.Process(target=_update_many, args=(path, worker, 50)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(SQLiteSessionStore(path=path, ttl_seconds=60).get('shared')) == 200
+
+def test_concurrent_first_uses_share_one_document_cache(monkeypatch):
+    built = []
+
+    def slow_create():
+        time.sleep(0.05)  # Long enough for every thread to find no cache
+        built.append(result_cache.DocumentResultCache(MemorySessionStore(ttl_seconds=60)))
+        return built[-1]
+
+    monkeypatch.setattr(result_cache, '_cache', None)
+    monkeypatch.setattr(result_cache, 'DOC_CACHE_BACKEND', 'memory')
+    monkeypatch.setattr(result_cache, 'create_document_cache', slow_create)
+    caches = []
+    threads = [threading.Thread(target=lambda: caches.append(result_cache.get_document_cache())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1 and all(cache is built[0] for cache in caches)
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+from datetime import date
+
+import pytest
+
+pytest.importorskip('lxml')
+pytest.importorskip('signxml')
+
+from benchmarks import synthetic
+from verification.aadhaar_xml import read_aadhaar_element
+from verification.signature_validation import TrustStore, load_certificate, verify_pdf, verify_xml
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='module')
+def ca_dir(tmp_path_factory):
+    out = str(tmp_path_factory.mktemp('test_ca'))
+    subprocess.run([sys.executable, os.path.join(BACKEND, 'utils', 'generate_test_ca.py'), '--out', out],
+                   check=True, cwd=BACKEND)
+    return out
+
+@pytest.fixture(scope='module')
+def trust_store(ca_dir):
+    with open(os.path.join(ca_dir, 'root.pem'), 'rb') as f:
+        return TrustStore([load_certificate(f.read())])
+
+def test_signed_xml_fields_come_from_the_verified_element(ca_dir, trust_store):
+    dob = date(1980, 5, 17)
+    signed = synthetic.sign_xml(synthetic.make_oky_xml(dob), ca_dir)
+    result = verify_xml(signed, trust_store)
+    assert result, result.reason
+    document = read_aadhaar_element(result.signed_xml)
+    assert document.dob == dob
+    assert document.photo is not None
+
+def test_altered_xml_fails(ca_dir, trust_store):
+    signed = synthetic.sign_xml(synthetic.make_oky_xml(date(1980, 5, 17)), ca_dir)
+    result = verify_xml(signed.replace(b'17-05-1980', b'17-05-1970'), trust_store)
+    assert not result and result.signed_xml is None
+
+def test_untrusted_signer_fails(ca_dir, tmp_path):
+    signed = synthetic.sign_xml(synthetic.make_oky_xml(), ca_dir)
+    assert not verify_xml(signed, TrustStore([]))
+
+def test_pdf_signature_reader_is_opened_once(ca_dir, trust_store):
+    pytest.importorskip('fitz')
+    pytest.importorskip('pyhanko')
+    from verification.pdf_document import PdfDocument
+
+    signed = synthetic.sign_pdf(synthetic.make_pdf(), ca_dir)
+    with PdfDocument(signed) as pdf:
+        assert verify_pdf(pdf, trust_store)
+        reader = pdf.signature_reader
+        assert verify_pdf(pdf, trust_store)
+        assert pdf.signature_reader is reader
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from utils import jwt_utils
+from utils.jwt_utils import KeyRing, RevocationList
+from utils.token_verifier import BloomFilter, TokenVerifier
+
+ISSUER = 'altid-test'
+
+STANDALONE = '''
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location('token_verifier', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+assert 'config' not in sys.modules, 'token_verifier imported config'
+'''
+
+@pytest.fixture(scope='module')
+def key_ring():
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    return KeyRing(private_pem, public_pem)
+
+def _token(key_ring, jti, exp_in=300):
+    claims = {'sub': 'session', 'iss': ISSUER, 'exp': int(time.time()) + exp_in, 'jti': jti}
+    return jwt.encode(claims, key_ring.private_key, algorithm=key_ring.alg, headers={'kid': key_ring.kid})
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    items = [f'jti-{i}' for i in range(1000)]
+    bloom = BloomFilter.of(items, capacity=1000, error_rate=0.01)
+    assert all(item in bloom for item in items)
+    false_positives = sum(f'other-{i}' in bloom for i in range(10_000))
+    assert false_positives < 300  # 1% expected at capacity
+
+def test_bloom_filter_round_trips_through_bytes():
+    bloom = BloomFilter.of(['a', 'b'], capacity=100)
+    copy = BloomFilter.from_bytes(bloom.to_bytes())
+    assert (copy.size, copy.hashes, copy.bits) == (bloom.size, bloom.hashes, bloom.bits)
+    assert 'a' in copy and 'b' in copy
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(bloom.to_bytes()[:-1])
+
+def test_revoked_token_is_rejected_even_once_cached(key_ring):
+    verifier = TokenVerifier.from_key_ring(key_ring, issuer=ISSUER)
+    token = _token(key_ring, 'jti-1')
+    assert verifier.verify(token)['jti'] == 'jti-1'
+    verifier.set_revoked(BloomFilter.of(['jti-1'], capacity=10))
+    assert verifier.verify(token) is None
+    assert verifier.verify(_token(key_ring, 'jti-2'))['jti'] == 'jti-2'
+
+def test_exact_list_overrides_a_false_positive(key_ring):
+    # A filter that reports every jti, as an overfull one might
+    everything = BloomFilter(size=8, hashes=1, bits=bytearray(b'\xff'))
+    verifier = TokenVerifier.from_key_ring(key_ring, issuer=ISSUER, revoked=everything,
+                                           confirm_revoked={'jti-1'}.__contains__)
+    assert verifier.verify(_token(key_ring, 'jti-1')) is None
+    assert verifier.verify(_token(key_ring, 'jti-2'))['jti'] == 'jti-2'
+
+@pytest.mark.parametrize('token', [None, 42, b'abc', ['a'], {'token': 'a'}])
+def test_non_string_tokens_are_invalid(key_ring, token):
+    assert TokenVerifier.from_key_ring(key_ring, issuer=ISSUER).verify(token) is None
+
+def test_revocation_list_reloads_when_the_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(jwt_utils, 'REVOCATION_RELOAD_SECONDS', 0)
+    path = tmp_path / 'revoked_jtis.txt'
+    revocations = RevocationList(str(path))
+    assert revocations.jtis == frozenset()
+    empty_etag = revocations.etag
+    path.write_text('jti-1\n\njti-2\n')
+    assert revocations.reload_if_changed()
+    assert revocations.jtis == {'jti-1', 'jti-2'} and 'jti-1' in revocations.bloom
+    assert revocations.etag != empty_etag
+    assert BloomFilter.from_bytes(revocations.body).bits == revocations.bloom.bits
+    assert not revocations.reload_if_changed()
+
+def test_token_verifier_imports_without_the_service(tmp_path):
+    # Relying parties copy the module into their own code, without config.py
+    path = os.path.join(os.path.dirname(__file__), os.pardir, 'utils', 'token_verifier.py')
+    result = subprocess.run([sys.executable, '-c', STANDALONE, os.path.abspath(path)], cwd=tmp_path,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def test_issuer_is_required(key_ring):
+    with pytest.raises(TypeError):
+        TokenVerifier.from_key_ring(key_ring)
@@ -0,0 +1,63 @@
+import io
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from utils.uploads import (IMAGE_TYPES, HashingBuffer, UploadRejected, admit_upload, read_upload,
+                           sniff_type)
+
+def _image(fmt, size=(8, 8)):
+    out = io.BytesIO()
+    Image.new('RGB', size, (200, 100, 50)).save(out, fmt)
+    return out.getvalue()
+
+@pytest.mark.parametrize('fmt, expected', [
+    ('JPEG', '.jpg'), ('PNG', '.png'), ('WEBP', '.webp'), ('TIFF', '.tiff'), ('BMP', '.bmp'),
+])
+def test_sniffs_images(fmt, expected):
+    assert sniff_type(_image(fmt)) == expected
+
+def test_sniffs_pdf_and_xml():
+    assert sniff_type(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n') == '.pdf'
+    assert sniff_type(b'\xef\xbb\xbf<?xml version="1.0"?><OKY/>') == '.xml'
+    assert sniff_type(b'\n  <OKY n="Test"/>') == '.xml'
+
+def test_pdf_header_after_leading_junk():
+    assert sniff_type(b'\x00' * 100 + b'%PDF-1.4\n') == '.pdf'
+    assert sniff_type(b'\x00' * 2000 + b'%PDF-1.4\n') is None
+
+def test_pdf_marker_inside_an_image_or_xml_is_not_a_pdf():
+    png = _image('PNG')
+    assert sniff_type(png[:16] + b'%PDF-' + png[16:]) == '.png'
+    assert sniff_type(b'<?xml version="1.0"?><OKY n="%PDF-1.4"/>') == '.xml'
+
+def test_unknown_content():
+    assert sniff_type(b'MZ\x90\x00') is None
+    assert sniff_type(b'') is None
+
+def test_admit_upload_checks_allowed_types_and_image_header():
+    assert admit_upload(_image('PNG')) == '.png'
+    with pytest.raises(UploadRejected) as e:
+        admit_upload(b'%PDF-1.4\n', IMAGE_TYPES)
+    assert e.value.status == 415
+    with pytest.raises(UploadRejected) as e:
+        admit_upload(b'\x89PNG\r\n\x1a\n' + b'\x00' * 16)
+    assert e.value.status == 400
+
+def test_hashing_buffer_refuses_to_grow_past_its_limit():
+    buffer = HashingBuffer(limit=4)
+    buffer.write(b'abcd')
+    with pytest.raises(RequestEntityTooLarge):
+        buffer.write(b'e')
+
+def test_read_upload_hashes_and_limits_plain_streams():
+    import hashlib
+    data, digest = read_upload(FileStorage(io.BytesIO(b'abc')), limit=3)
+    assert (data, digest) == (b'abc', hashlib.sha256(b'abc').hexdigest())
+    with pytest.raises(UploadRejected) as e:
+        read_upload(FileStorage(io.BytesIO(b'abcd')), limit=3, chunk_size=2)
+    assert e.value.status == 413
+    with pytest.raises(UploadRejected):
+        read_upload(FileStorage(io.BytesIO(b'')))
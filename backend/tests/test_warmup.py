@@ -0,0 +1,35 @@
+from concurrent.futures import Future
+
+import pytest
+
+from verification import warmup
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    saved = dict(warmup._state)
+    warmup._state.update(status='pending', error=None, started_at=None, finished_at=None)
+    yield
+    warmup._state.update(saved)
+
+def resolved(value=None, error=None):
+    future = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
+    return future
+
+def test_ready_when_every_worker_is_ready():
+    warmup.warm_up_workers([resolved({'status': 'ready', 'error': None})] * 3)
+    assert warmup.is_ready()
+
+def test_failed_worker_fails_readiness():
+    warmup.warm_up_workers([resolved({'status': 'ready', 'error': None}),
+                            resolved({'status': 'failed', 'error': 'No module named cv2'})])
+    state = warmup.readiness()
+    assert state['status'] == 'failed'
+    assert state['error'] == 'No module named cv2'
+
+def test_worker_that_never_started_fails_readiness():
+    warmup.warm_up_workers([resolved(error=RuntimeError('pool broken'))])
+    assert warmup.readiness()['status'] == 'failed'
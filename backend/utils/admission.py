@@ -0,0 +1,185 @@
+"""
+Admission control for the CPU-heavy verification stages.
+
+An AdmissionController lets at most max_in_flight requests run a heavy stage
+in this process, and optionally at most host_slots across every process on
+the host (flock'd slot files, released by the kernel if a process dies).
+Requests beyond that wait in a bounded queue until their deadline; when the
+queue is full, or the deadline passes, the request is shed with 503 and a
+Retry-After estimated from recent service times. Light endpoints never pass
+through a controller.
+
+In-flight and queued counts are exported as gauges and shed requests as
+counters on /metrics.
+"""
+import fcntl
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from config import (ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_SECONDS,
+                    ADMISSION_HOST_SLOTS, ADMISSION_LOCK_DIR, ADMISSION_RETRY_AFTER_MAX_SECONDS)
+from utils.metrics import increment, record_timing, register_gauge
+
+logger = logging.getLogger(__name__)
+
+HOST_SLOT_POLL_SECONDS = 0.01
+
+class AdmissionRejected(Exception):
+    """
+    A request shed by admission control; retry_after is in whole seconds.
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class HostSlots:
+    """
+    A host-wide counting semaphore made of slot files locked with flock.
+    """
+
+    def __init__(self, name: str, slots: int, lock_dir: str = ADMISSION_LOCK_DIR):
+        os.makedirs(lock_dir, exist_ok=True)
+        self.paths = [os.path.join(lock_dir, f'{name}.{i}.lock') for i in range(slots)]
+        self._lock = threading.Lock()
+        self._fds = None
+        self._pid = None
+        self._held = set()
+
+    def _ensure_open(self):
+        # flock belongs to the open file description, which a forked child
+        # shares with its parent; each process opens its own
+        if self._pid != os.getpid():
+            self._fds = [os.open(path, os.O_RDWR | os.O_CREAT, 0o644) for path in self.paths]
+            self._pid = os.getpid()
+            self._held = set()
+
+    def try_acquire(self) -> Optional[int]:
+        """
+        Lock a free slot without blocking. Returns its index, or None.
+        """
+        with self._lock:
+            self._ensure_open()
+            for index, fd in enumerate(self._fds):
+                # Threads of this process share the descriptors, so flock
+                # would not stop them taking a slot this process already holds
+                if index in self._held:
+                    continue
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._held.add(index)
+                return index
+        return None
+
+    def release(self, index: int):
+        with self._lock:
+            fcntl.flock(self._fds[index], fcntl.LOCK_UN)
+            self._held.discard(index)
+
+class AdmissionController:
+    """
+    Bounded concurrency with a bounded, deadline-limited wait queue.
+    """
+
+    def __init__(self, name: str, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 max_queue: int = ADMISSION_MAX_QUEUE, max_wait_seconds: float = ADMISSION_MAX_WAIT_SECONDS,
+                 host_slots: int = ADMISSION_HOST_SLOTS):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.host_slots = HostSlots(name, host_slots) if host_slots else None
+        self.in_flight = 0
+        self.waiting = 0
+        self._service_time = 1.0  # EWMA of seconds a slot is held, for Retry-After
+        self._cond = threading.Condition()
+        register_gauge('altid_admission_in_flight', lambda: self.in_flight, controller=name)
+        register_gauge('altid_admission_queue_depth', lambda: self.waiting, controller=name)
+
+    def retry_after(self) -> int:
+        estimate = self._service_time * (self.waiting + 1) / self.max_in_flight
+        return max(1, min(ADMISSION_RETRY_AFTER_MAX_SECONDS, math.ceil(estimate)))
+
+    def check(self, endpoint: str = ''):
+        """
+        Shed a request that would find the queue full, so callers can refuse
+        it before reading the request body.
+
+        Raises:
+            AdmissionRejected: If the controller is saturated
+        """
+        if self.in_flight >= self.max_in_flight and self.waiting >= self.max_queue:
+            self._shed('saturated', endpoint)
+
+    def _shed(self, reason: str, endpoint: str):
+        increment('altid_admission_shed_total', controller=self.name, endpoint=endpoint, reason=reason)
+        raise AdmissionRejected(reason, self.retry_after())
+
+    def acquire(self, endpoint: str = '') -> Optional[int]:
+        """
+        Wait for a slot. Returns the host slot index (None without host slots).
+
+        Raises:
+            AdmissionRejected: If the queue is full or the deadline passes
+        """
+        start = time.monotonic()
+        deadline = start + self.max_wait_seconds
+        with self._cond:
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.max_queue:
+                    self._shed('queue_full', endpoint)
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed('timeout', endpoint)
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+
+        host_slot = None
+        if self.host_slots is not None:
+            while (host_slot := self.host_slots.try_acquire()) is None:
+                if time.monotonic() >= deadline:
+                    self._release_local()
+                    self._shed('host_timeout', endpoint)
+                time.sleep(HOST_SLOT_POLL_SECONDS)
+        record_timing(f'admission_wait_{self.name}', time.monotonic() - start)
+        return host_slot
+
+    def release(self, host_slot: Optional[int], held_seconds: float):
+        if host_slot is not None:
+            self.host_slots.release(host_slot)
+        with self._cond:
+            self._service_time = 0.8 * self._service_time + 0.2 * held_seconds
+        self._release_local()
+
+    def _release_local(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self, endpoint: str = ''):
+        """
+        Hold a slot for the duration of the block.
+
+        Raises:
+            AdmissionRejected: If the request is shed
+        """
+        host_slot = self.acquire(endpoint)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(host_slot, time.monotonic() - start)
@@ -0,0 +1,78 @@
+"""
+Convert DeepFace's face recognition model to ONNX for the 'onnx' and
+'onnx-int8' embedding backends (see verification/face_embedding.py).
+
+Writes <model>.onnx (fp32) and <model>.int8.onnx to the model directory. By
+default weights are quantized dynamically; with --calibration-dir the faces
+found in those images calibrate static int8 quantization of the activations
+too. Requires deepface, tf2onnx and onnxruntime. Check the result with
+benchmarks/embedding_parity.py.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import FACE_MODEL_NAME, FACE_ONNX_DIR
+
+def calibration_batches(image_dir, input_shape, limit=200):
+    """
+    Face crops from the images in image_dir, one per batch, as the
+    embedding backends receive them.
+    """
+    from verification.face_match import _resize_face, detect_faces
+    from verification.image_ingest import decode_bgr
+
+    count = 0
+    for name in sorted(os.listdir(image_dir)):
+        with open(os.path.join(image_dir, name), 'rb') as f:
+            image = decode_bgr(f.read())
+        if image is None:
+            continue
+        for face in detect_faces(image)[:1]:
+            yield _resize_face(face, input_shape)[np.newaxis].astype(np.float32)
+            count += 1
+        if count >= limit:
+            return
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--model', default=FACE_MODEL_NAME, help='DeepFace model name')
+parser.add_argument('--out', default=FACE_ONNX_DIR, help='Directory for the .onnx files')
+parser.add_argument('--opset', type=int, default=13)
+parser.add_argument('--calibration-dir', help='Face images for static int8 quantization')
+args = parser.parse_args()
+
+import tensorflow as tf
+import tf2onnx
+from deepface import DeepFace
+from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_dynamic, quantize_static
+
+from verification.face_embedding import onnx_model_path
+
+os.makedirs(args.out, exist_ok=True)
+fp32_path = onnx_model_path(args.model, quantized=False, model_dir=args.out)
+int8_path = onnx_model_path(args.model, quantized=True, model_dir=args.out)
+
+model = DeepFace.build_model(args.model)
+height, width = model.input_shape
+input_name = 'input'
+signature = (tf.TensorSpec((None, height, width, 3), tf.float32, name=input_name),)
+tf2onnx.convert.from_keras(model.model, input_signature=signature, opset=args.opset, output_path=fp32_path)
+print(f'fp32 model written to {fp32_path}')
+
+if args.calibration_dir:
+    class FaceReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = calibration_batches(args.calibration_dir, (height, width))
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {input_name: batch}
+
+    quantize_static(fp32_path, int8_path, FaceReader(), activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8, per_channel=True)
+else:
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8, per_channel=True)
+print(f'int8 model written to {int8_path}')
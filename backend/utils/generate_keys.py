@@ -1,30 +1,41 @@
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
 from cryptography.hazmat.primitives import serialization
+import argparse
 import os
+import sys
 
-KEY_DIR = os.path.join(os.path.dirname(__file__), '..', 'static', 'keys')
-PRIVATE_KEY_PATH = os.path.join(KEY_DIR, 'private.pem')
-PUBLIC_KEY_PATH = os.path.join(KEY_DIR, 'public.pem')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import JWT_ALGORITHM, JWT_PRIVATE_KEY_PATH, JWT_PUBLIC_KEY_PATH
 
-os.makedirs(KEY_DIR, exist_ok=True)
+KEY_GENERATORS = {
+    'RS256': lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048),
+    'ES256': lambda: ec.generate_private_key(ec.SECP256R1()),
+    'EdDSA': ed25519.Ed25519PrivateKey.generate,
+}
 
-if not os.path.exists(PRIVATE_KEY_PATH) or not os.path.exists(PUBLIC_KEY_PATH):
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048
-    )
-    with open(PRIVATE_KEY_PATH, 'wb') as f:
+parser = argparse.ArgumentParser(description='Generate the JWT signing key pair')
+parser.add_argument('--alg', choices=sorted(KEY_GENERATORS), default=JWT_ALGORITHM)
+parser.add_argument('--private-key', default=JWT_PRIVATE_KEY_PATH)
+parser.add_argument('--public-key', default=JWT_PUBLIC_KEY_PATH)
+args = parser.parse_args()
+
+os.makedirs(os.path.dirname(os.path.abspath(args.private_key)), exist_ok=True)
+os.makedirs(os.path.dirname(os.path.abspath(args.public_key)), exist_ok=True)
+
+if not os.path.exists(args.private_key) or not os.path.exists(args.public_key):
+    private_key = KEY_GENERATORS[args.alg]()
+    with open(args.private_key, 'wb') as f:
         f.write(private_key.private_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PrivateFormat.PKCS8,
             encryption_algorithm=serialization.NoEncryption()
         ))
     public_key = private_key.public_key()
-    with open(PUBLIC_KEY_PATH, 'wb') as f:
+    with open(args.public_key, 'wb') as f:
         f.write(public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo
         ))
-    print('Keys generated.')
+    print(f'{args.alg} keys generated.')
 else:
-    print('Keys already exist.') 
\ No newline at end of file
+    print('Keys already exist.')
@@ -0,0 +1,68 @@
+"""
+Generate local test CA material for document signature verification:
+a root CA, an intermediate CA and a signing certificate + key issued by it.
+The root certificate is copied into the trust directory.
+"""
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from datetime import datetime, timedelta, timezone
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import SIGNATURE_TRUST_DIR, data_dir
+
+def make_certificate(common_name, key, issuer_cert=None, issuer_key=None, ca=False, days=365):
+    subject = x509.Name([x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'AltID Test'),
+                         x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.now(timezone.utc)
+    builder = (x509.CertificateBuilder()
+               .subject_name(subject)
+               .issuer_name(issuer_cert.subject if issuer_cert else subject)
+               .public_key(key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(now - timedelta(minutes=5))
+               .not_valid_after(now + timedelta(days=days))
+               .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+               .add_extension(x509.KeyUsage(digital_signature=not ca, content_commitment=not ca,
+                                            key_encipherment=False, data_encipherment=False, key_agreement=False,
+                                            key_cert_sign=ca, crl_sign=ca, encipher_only=False,
+                                            decipher_only=False), critical=True))
+    return builder.sign(issuer_key or key, hashes.SHA256())
+
+def write_pem(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--out', default=os.path.join(data_dir, 'test_ca'), help='Directory for the generated files')
+parser.add_argument('--trust-dir', default=SIGNATURE_TRUST_DIR, help='Directory the root certificate is copied to')
+parser.add_argument('--days', type=int, default=365)
+args = parser.parse_args()
+
+os.makedirs(args.out, exist_ok=True)
+os.makedirs(args.trust_dir, exist_ok=True)
+
+root_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+root_cert = make_certificate('AltID Test Root CA', root_key, ca=True, days=args.days)
+intermediate_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+intermediate_cert = make_certificate('AltID Test Intermediate CA', intermediate_key, root_cert, root_key,
+                                     ca=True, days=args.days)
+signer_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+signer_cert = make_certificate('AltID Test Document Signer', signer_key, intermediate_cert, intermediate_key,
+                               days=args.days)
+
+pem = serialization.Encoding.PEM
+write_pem(os.path.join(args.out, 'root.pem'), root_cert.public_bytes(pem))
+write_pem(os.path.join(args.out, 'intermediate.pem'), intermediate_cert.public_bytes(pem))
+write_pem(os.path.join(args.out, 'signer.pem'), signer_cert.public_bytes(pem))
+write_pem(os.path.join(args.out, 'signer_key.pem'), signer_key.private_bytes(
+    encoding=pem,
+    format=serialization.PrivateFormat.PKCS8,
+    encryption_algorithm=serialization.NoEncryption()
+))
+write_pem(os.path.join(args.trust_dir, 'altid_test_root.pem'), root_cert.public_bytes(pem))
+print(f'Test CA written to {args.out}; root certificate trusted via {args.trust_dir}.')
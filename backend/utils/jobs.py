@@ -0,0 +1,153 @@
+"""
+Asynchronous verification jobs.
+
+In async mode the upload endpoints hand the pipeline functions from
+verification/pipeline.py to a bounded process pool and return a job id
+straight away. Job records live in a session store, so with the 'sqlite'
+backend any worker process on the host can answer /status/<job_id>.
+
+PipelinePool runs them in a process pool too, but waits for the result, so
+the endpoints still answer in one request.
+"""
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import BoundedSemaphore
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import (JOB_WORKERS, JOB_MAX_PENDING, JOB_TTL_SECONDS, JOB_POLL_INTERVAL_SECONDS,
+                    PIPELINE_PROCESS_WORKERS)
+from utils import metrics
+from utils.logging_utils import configure_logging
+from utils.metrics import call_with_timings
+from utils.session_store import SessionStore, create_session_store, new_session_id
+
+logger = logging.getLogger(__name__)
+
+class JobQueueFull(Exception):
+    pass
+
+def _init_worker(initializer: Optional[Callable]):
+    # Spawned workers start with fresh module state: under gunicorn or uvicorn
+    # their __mp_main__ is the server's script, not app.py, so logging and
+    # metrics are only set up here
+    configure_logging()
+    metrics.init()
+    if initializer is not None:
+        initializer()
+
+def _process_pool(max_workers: int, initializer: Optional[Callable]) -> ProcessPoolExecutor:
+    # Workers are spawned, not forked: the web process is multi-threaded, and
+    # a forked child would also inherit its imported modules and warm-up state
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(initializer,),
+                               mp_context=multiprocessing.get_context('spawn'))
+
+def _start_workers(executor: ProcessPoolExecutor, max_workers: int) -> List[Future]:
+    from verification.warmup import readiness
+    # Each submission finds no idle worker and starts one, which runs the
+    # initializer before reporting its readiness
+    return [executor.submit(readiness) for _ in range(max_workers)]
+
+class JobManager:
+    """
+    Runs pipeline functions in a process pool and records their outcome.
+
+    A job record is {'status': 'pending' | 'done' | 'failed'}, plus the
+    pipeline's 'result' body, 'http_status' and stage 'timings' once it has
+    finished.
+    """
+
+    def __init__(self, sessions: SessionStore, max_workers: int = JOB_WORKERS,
+                 max_pending: int = JOB_MAX_PENDING, store: Optional[SessionStore] = None,
+                 initializer: Optional[Callable] = None):
+        self.sessions = sessions
+        self.store = store or create_session_store(name='jobs', ttl_seconds=JOB_TTL_SECONDS)
+        self.max_workers = max_workers
+        self._executor = _process_pool(max_workers, initializer)
+        self._slots = BoundedSemaphore(max_pending)
+
+    def start_workers(self) -> List[Future]:
+        """
+        Start every worker now rather than on first use.
+
+        Returns:
+            List[Future]: Each worker's verification.warmup.readiness() once its initializer has run
+        """
+        return _start_workers(self._executor, self.max_workers)
+
+    def submit(self, session_id: str, fn: Callable, *args) -> str:
+        """
+        Queue fn(*args) and return the job id. The session updates it returns
+        are applied to session_id when it finishes.
+
+        Raises:
+            JobQueueFull: If max_pending jobs are already queued or running
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull()
+        job_id = new_session_id()
+        self.store.set(job_id, {'status': 'pending', 'session_id': session_id, 'submitted_at': time.time()})
+        try:
+            future = self._executor.submit(call_with_timings, fn, *args)
+        except Exception:
+            self._slots.release()
+            self.store.delete(job_id)
+            raise
+        future.add_done_callback(lambda f: self._finish(job_id, session_id, f))
+        return job_id
+
+    def _finish(self, job_id, session_id, future):
+        try:
+            (body, status, session_updates), timings = future.result()
+            if session_updates:
+                self.sessions.update(session_id, session_updates)
+            record = {'status': 'done', 'result': body, 'http_status': status, 'timings': timings}
+        except Exception as e:
+            logger.error("Job %s failed: %s", job_id, e)
+            record = {'status': 'failed', 'result': {'error': 'Verification failed'}, 'http_status': 500}
+        finally:
+            self._slots.release()
+        record['session_id'] = session_id
+        self.store.set(job_id, record)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def wait(self, job_id: str, timeout: float, poll_interval: float = JOB_POLL_INTERVAL_SECONDS) -> Optional[dict]:
+        """
+        Long-poll a job until it finishes or timeout seconds pass.
+        Returns the latest job record, or None if the job is unknown.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] != 'pending' or time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+class PipelinePool:
+    """
+    Runs pipeline functions in a process pool and waits for them, keeping the
+    CPU-bound stages off the calling process's GIL. Callers bound how many run
+    at once (see utils/admission.py).
+    """
+
+    def __init__(self, max_workers: int = PIPELINE_PROCESS_WORKERS, initializer: Optional[Callable] = None):
+        self.max_workers = max_workers
+        self._executor = _process_pool(max_workers, initializer)
+
+    def start_workers(self) -> List[Future]:
+        """
+        Start every worker now rather than on first use (see JobManager.start_workers).
+        """
+        return _start_workers(self._executor, self.max_workers)
+
+    def run(self, fn: Callable, *args) -> Tuple[tuple, Dict[str, float]]:
+        """
+        Run fn(*args) in a worker process.
+
+        Returns:
+            Tuple[tuple, Dict[str, float]]: fn's (body, status, session_updates) and its stage timings
+        """
+        return self._executor.submit(call_with_timings, fn, *args).result()
@@ -1,25 +1,202 @@
 import jwt
+import json
+import base64
+import hashlib
+import logging
 import os
-from datetime import datetime, timedelta
+import secrets
+import time
 
-KEY_DIR = os.path.join(os.path.dirname(__file__), '..', 'static', 'keys')
-PRIVATE_KEY_PATH = os.path.join(KEY_DIR, 'private.pem')
-PUBLIC_KEY_PATH = os.path.join(KEY_DIR, 'public.pem')
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
 
-with open(PRIVATE_KEY_PATH, 'rb') as f:
-    PRIVATE_KEY = f.read()
-with open(PUBLIC_KEY_PATH, 'rb') as f:
-    PUBLIC_KEY = f.read()
+from config import (JWT_ALGORITHM, JWT_PRIVATE_KEY_PATH, JWT_PUBLIC_KEY_PATH,
+                    JWT_ADDITIONAL_PUBLIC_KEY_PATHS, JWT_EXPIRATION_MINUTES, JWT_ISSUER,
+                    JWT_REVOKED_JTIS_PATH, REVOCATION_RELOAD_SECONDS, REVOCATION_BLOOM_CAPACITY,
+                    REVOCATION_BLOOM_ERROR_RATE, TOKEN_CACHE_SIZE)
+from utils.metrics import increment, timed
+from utils.token_verifier import BloomFilter, TokenVerifier
 
+logger = logging.getLogger(__name__)
+
+# Key type each supported algorithm signs with
+ALGORITHM_KEY_TYPES = {
+    'RS256': rsa.RSAPublicKey,
+    'ES256': ec.EllipticCurvePublicKey,
+    'EdDSA': ed25519.Ed25519PublicKey,
+}
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64url_uint(value: int) -> str:
+    return _b64url(value.to_bytes((value.bit_length() + 7) // 8 or 1, 'big'))
+
+def algorithm_for_key(public_key) -> str:
+    for alg, key_type in ALGORITHM_KEY_TYPES.items():
+        if isinstance(public_key, key_type):
+            if alg == 'ES256' and not isinstance(public_key.curve, ec.SECP256R1):
+                raise ValueError(f'ES256 requires a P-256 key, got {public_key.curve.name}')
+            return alg
+    raise ValueError(f'Unsupported key type {type(public_key).__name__}')
+
+def public_jwk(public_key) -> dict:
+    """
+    JWK members for a public key, without kid/alg/use.
+    """
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        return {'kty': 'RSA', 'n': _b64url_uint(numbers.n), 'e': _b64url_uint(numbers.e)}
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        numbers = public_key.public_numbers()
+        size = (public_key.curve.key_size + 7) // 8
+        return {'kty': 'EC', 'crv': 'P-256',
+                'x': _b64url(numbers.x.to_bytes(size, 'big')), 'y': _b64url(numbers.y.to_bytes(size, 'big'))}
+    raw = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return {'kty': 'OKP', 'crv': 'Ed25519', 'x': _b64url(raw)}
+
+def jwk_thumbprint(jwk: dict) -> str:
+    """
+    RFC 7638 thumbprint, used as the key id.
+    """
+    required = {'RSA': ('e', 'kty', 'n'), 'EC': ('crv', 'kty', 'x', 'y'), 'OKP': ('crv', 'kty', 'x')}[jwk['kty']]
+    canonical = json.dumps({k: jwk[k] for k in required}, separators=(',', ':'), sort_keys=True)
+    return _b64url(hashlib.sha256(canonical.encode('ascii')).digest())
+
+class PublicKey:
+    """
+    A parsed public key with its PEM, JWK and key id.
+    """
+
+    def __init__(self, pem: bytes):
+        self.pem = pem
+        self.key = serialization.load_pem_public_key(pem)
+        self.alg = algorithm_for_key(self.key)
+        jwk = public_jwk(self.key)
+        self.kid = jwk_thumbprint(jwk)
+        self.jwk = {**jwk, 'kid': self.kid, 'alg': self.alg, 'use': 'sig'}
+
+class KeyRing:
+    """
+    The active signing key plus every public key relying parties should accept.
+
+    Keys are parsed once. During a rotation the previous (or next) public keys
+    are listed in JWT_ADDITIONAL_PUBLIC_KEY_PATHS so tokens signed with them
+    keep verifying and the JWKS already advertises them.
+    """
+
+    def __init__(self, private_pem: bytes, public_pem: bytes, additional_public_pems=()):
+        self.private_key = serialization.load_pem_private_key(private_pem, password=None)
+        self.signing_key = PublicKey(public_pem)
+        if _spki(self.private_key.public_key()) != _spki(self.signing_key.key):
+            raise ValueError('JWT public key does not match the private key')
+        self.public_keys = {self.signing_key.kid: self.signing_key}
+        for pem in additional_public_pems:
+            key = PublicKey(pem)
+            self.public_keys.setdefault(key.kid, key)
+
+        self.jwks_body = json.dumps({'keys': [k.jwk for k in self.public_keys.values()]},
+                                    separators=(',', ':')).encode('utf-8')
+        self.jwks_etag = hashlib.sha256(self.jwks_body).hexdigest()[:32]
+        self.public_pem_etag = hashlib.sha256(self.signing_key.pem).hexdigest()[:32]
+
+    @property
+    def alg(self) -> str:
+        return self.signing_key.alg
+
+    @property
+    def kid(self) -> str:
+        return self.signing_key.kid
+
+def _spki(public_key) -> bytes:
+    return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+def load_key_ring() -> KeyRing:
+    key_ring = KeyRing(_read(JWT_PRIVATE_KEY_PATH), _read(JWT_PUBLIC_KEY_PATH),
+                       [_read(path) for path in JWT_ADDITIONAL_PUBLIC_KEY_PATHS])
+    if key_ring.alg != JWT_ALGORITHM:
+        raise ValueError(f'JWT_ALGORITHM is {JWT_ALGORITHM} but the signing key is a {key_ring.alg} key')
+    return key_ring
+
+class RevocationList:
+    """
+    Revoked token ids from a file (one jti per line) and their Bloom filter,
+    reloaded when the file changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.jtis = frozenset()
+        self.bloom = BloomFilter(REVOCATION_BLOOM_CAPACITY, REVOCATION_BLOOM_ERROR_RATE)
+        self.body = self.bloom.to_bytes()
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self._mtime = None
+        self._checked_at = float('-inf')
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reread the file if it changed, checking at most every
+        REVOCATION_RELOAD_SECONDS. Returns True if the list was reloaded.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < REVOCATION_RELOAD_SECONDS:
+            return False
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        jtis = frozenset()
+        if mtime is not None:
+            with open(self.path) as f:
+                jtis = frozenset(line.strip() for line in f if line.strip())
+        self.jtis = jtis
+        self.bloom = BloomFilter.of(jtis, capacity=max(REVOCATION_BLOOM_CAPACITY, len(jtis)),
+                                    error_rate=REVOCATION_BLOOM_ERROR_RATE)
+        self.body = self.bloom.to_bytes()
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        logger.info("Loaded %d revoked token ids", len(jtis))
+        return True
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self.jtis
+
+KEY_RING = load_key_ring()
+REVOCATIONS = RevocationList(JWT_REVOKED_JTIS_PATH)
+# The exact list confirms the filter's positives, so no valid token is rejected
+TOKEN_VERIFIER = TokenVerifier.from_key_ring(KEY_RING, JWT_ISSUER, revoked=REVOCATIONS.bloom,
+                                             confirm_revoked=REVOCATIONS.__contains__, cache_size=TOKEN_CACHE_SIZE)
+
+@timed('jwt_sign')
 def issue_token(payload):
-    payload['iss'] = 'AltID'
-    payload['iat'] = int(datetime.utcnow().timestamp())
-    payload['exp'] = int((datetime.utcnow() + timedelta(minutes=15)).timestamp())
-    return jwt.encode(payload, PRIVATE_KEY, algorithm='RS256')
+    now = int(time.time())
+    payload['iss'] = JWT_ISSUER
+    payload['iat'] = now
+    payload['exp'] = now + JWT_EXPIRATION_MINUTES * 60
+    payload['jti'] = secrets.token_urlsafe(12)  # Lets a single token be revoked
+    return jwt.encode(payload, KEY_RING.private_key, algorithm=KEY_RING.alg, headers={'kid': KEY_RING.kid})
+
+def get_token_verifier() -> TokenVerifier:
+    """
+    The key ring's verifier, with the current revocation list.
+    """
+    if REVOCATIONS.reload_if_changed():
+        TOKEN_VERIFIER.set_revoked(REVOCATIONS.bloom)
+    return TOKEN_VERIFIER
 
+@timed('jwt_verify')
 def verify_token(token):
-    try:
-        return jwt.decode(token, PUBLIC_KEY, algorithms=['RS256'], issuer='AltID')
-    except Exception as e:
-        print(f"JWT verification error: {e}")
-        return None 
\ No newline at end of file
+    """
+    Claims of a valid, unexpired and unrevoked token issued here, else None.
+    """
+    claims = get_token_verifier().verify(token)
+    increment('altid_token_verifications_total', result='valid' if claims is not None else 'invalid')
+    return claims
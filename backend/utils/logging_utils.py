@@ -1,15 +1,151 @@
+"""
+Non-blocking logging setup.
+
+Request threads only put records on a bounded queue (QueueHandler); a
+background QueueListener formats them and does the file and console writes.
+Verification failures go to their own logger and are written as one JSON
+object per line. Records below WARNING can be sampled per level.
+"""
+import atexit
+import json
 import logging
+import logging.handlers
 import os
-from config import LOG_FILE
+import queue
+import random
+import threading
+import time
+
+from config import (LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES,
+                    LOG_FAILED_ATTEMPTS, log_file)
+
+FAILURE_LOGGER_NAME = 'altid.failures'
+
+failure_logger = logging.getLogger(FAILURE_LOGGER_NAME)
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a random fraction of records per level. Levels missing from rates
+    (WARNING and above by default) are always kept.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records instead of blocking when the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, including the record's 'details' dict.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'reason': record.getMessage(),
+            'pid': record.process,
+        }
+        details = getattr(record, 'details', None)
+        if details:
+            entry['details'] = details
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
 
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s'
-)
+_lock = threading.Lock()
+_queue_handlers = []
+_listeners = []
+
+def _start_listener(queue_handler, handlers):
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+def _attach_queue(logger, handlers, sample_rates=None):
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    logger.addHandler(queue_handler)
+    _queue_handlers.append((queue_handler, handlers))
+    _start_listener(queue_handler, handlers)
+
+def _restart_listeners_after_fork():
+    # Listener threads do not survive fork; give the child its own queues and
+    # listeners writing to the inherited handlers
+    _listeners.clear()
+    for queue_handler, handlers in _queue_handlers:
+        queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        _start_listener(queue_handler, handlers)
+
+def _stop_listeners():
+    for listener in _listeners:
+        listener.stop()
+
+def configure_logging():
+    """
+    Install the queue-based handlers on the root and failure loggers.
+    Safe to call more than once; only the first call has an effect.
+    """
+    with _lock:
+        if _queue_handlers:
+            return
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        file_handler = logging.FileHandler(log_file)
+        console_handler = logging.StreamHandler()
+        for handler in (file_handler, console_handler):
+            handler.setLevel(LOG_LEVEL)
+            handler.setFormatter(formatter)
+
+        root_logger = logging.getLogger()
+        root_logger.setLevel(LOG_LEVEL)
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+        _attach_queue(root_logger, [file_handler, console_handler], LOG_SAMPLE_RATES)
+
+        failure_handler = logging.FileHandler(os.path.join(os.path.dirname(log_file), LOG_FILE))
+        failure_handler.setFormatter(JsonFormatter())
+        failure_logger.setLevel(logging.INFO)
+        failure_logger.propagate = False
+        _attach_queue(failure_logger, [failure_handler])
+
+        os.register_at_fork(after_in_child=_restart_listeners_after_fork)
+        atexit.register(_stop_listeners)
+
+    logging.getLogger(__name__).info("Logging initialized. Log file: %s", log_file)
+
+def dropped_records() -> int:
+    """
+    Number of records dropped because a log queue was full.
+    """
+    return sum(queue_handler.dropped for queue_handler, _ in _queue_handlers)
 
 def log_failure(reason, details=None):
-    msg = f"Failure: {reason}"
-    if details:
-        msg += f" | Details: {details}"
-    logging.info(msg) 
\ No newline at end of file
+    """
+    Record a failed verification step as a structured JSON line.
+
+    Args:
+        reason: Short, constant description of the failure
+        details: Optional dict of context (session id, error text, ...)
+    """
+    if LOG_FAILED_ATTEMPTS:
+        failure_logger.info(reason, extra={'details': details})
@@ -0,0 +1,417 @@
+"""
+Lightweight stage timing and metrics.
+
+timed('stage') is a context manager and decorator. Each use records the
+duration in a per-process histogram and, inside a request (or a job, see
+utils/jobs.py), adds it to that request's timings, which the app sends back as
+a Server-Timing header. Counters are kept the same way; gauges are read from
+registered callbacks whenever a snapshot is taken.
+
+Every process that calls init() (web workers, pipeline and job workers, the
+inference service) writes a snapshot of its own metrics to
+METRICS_DIR/<pid>-<start time>.json every few seconds. /metrics sums the
+snapshots of all processes, so worker processes behind a pre-fork server and
+job pool workers are all counted. The start time tells a reused pid from the
+process that wrote a snapshot. When a process has exited, its counters and
+histograms are folded into a persisted aggregate (_retired.json) and its file
+is removed, so totals never go backwards and only live processes have files.
+Clear the directory when the service is (re)deployed.
+"""
+import atexit
+import bisect
+import contextvars
+import fcntl
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from config import METRICS_ENABLED, METRICS_DIR, METRICS_FLUSH_INTERVAL_SECONDS, METRICS_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+STAGE_HISTOGRAM = 'altid_stage_duration_seconds'
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+class _Registry:
+    """
+    This process's histograms (by stage), counters and gauge callbacks (by
+    name and labels).
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS, gauges=None):
+        self.buckets = tuple(buckets)
+        self.histograms: Dict[str, _Histogram] = {}
+        self.counters: Dict[tuple, float] = {}
+        self.gauges: Dict[tuple, Callable[[], float]] = dict(gauges or {})
+        self.lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = _Histogram(self.buckets)
+            histogram.counts[index] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def increment(self, name: str, labels: tuple, value: float):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        gauges = []
+        for (name, labels), callback in list(self.gauges.items()):
+            try:
+                gauges.append([name, dict(labels), float(callback())])
+            except Exception as e:
+                logger.error("Gauge %s failed: %s", name, e)
+        with self.lock:
+            return {
+                'buckets': list(self.buckets),
+                'histograms': {stage: {'counts': list(h.counts), 'sum': h.sum, 'count': h.count}
+                               for stage, h in self.histograms.items()},
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'gauges': gauges,
+            }
+
+_registry = _Registry()
+
+class timed:
+    """
+    Time a stage, as a context manager or a decorator:
+
+        with timed('ocr'):
+            ...
+
+        @timed('face_embedding')
+        def embed_faces(...):
+    """
+    __slots__ = ('stage', '_start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_timing(self.stage, time.perf_counter() - self._start)
+
+    def __call__(self, fn):
+        stage = self.stage
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_timing(stage, time.perf_counter() - start)
+        return wrapper
+
+def record_timing(stage: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    _registry.observe(stage, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+def increment(name: str, value: float = 1, **labels):
+    """
+    Add value to the counter name{labels}.
+    """
+    if METRICS_ENABLED:
+        _registry.increment(name, tuple(sorted(labels.items())), value)
+
+def register_gauge(name: str, callback: Callable[[], float], **labels):
+    """
+    Report callback() as the gauge name{labels}. Values are summed across the
+    live processes.
+    """
+    _registry.gauges[(name, tuple(sorted(labels.items())))] = callback
+
+def start_request_timings() -> contextvars.Token:
+    """
+    Start collecting stage timings for the current request or job.
+    """
+    return _request_timings.set({})
+
+def finish_request_timings(token: Optional[contextvars.Token] = None) -> Dict[str, float]:
+    """
+    Stop collecting and return {stage: seconds} for the current request or job.
+    """
+    timings = _request_timings.get() or {}
+    if token is not None:
+        _request_timings.reset(token)
+    else:
+        _request_timings.set(None)
+    return timings
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items())
+
+def call_with_timings(fn, *args):
+    """
+    Run fn(*args) collecting stage timings; returns (result, timings). Used to
+    carry timings back from worker processes.
+    """
+    token = start_request_timings()
+    try:
+        return fn(*args), finish_request_timings(token)
+    except BaseException:
+        finish_request_timings(token)
+        raise
+
+# Per-process snapshot files
+
+RETIRED_SNAPSHOT = '_retired.json'
+
+_dir = None  # Set by init()
+_snapshot_name = None
+
+def init(directory: str = METRICS_DIR):
+    """
+    Start writing this process's snapshots to directory. Call once in each
+    process that should be counted by /metrics; children forked afterwards
+    are set up automatically. Safe to call repeatedly.
+    """
+    global _dir
+    if not METRICS_ENABLED or _dir is not None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _dir = directory
+    _name_snapshot()
+    _start_flusher()
+    os.register_at_fork(after_in_child=_reset_after_fork)
+    atexit.register(flush)
+
+def _process_start(pid: int) -> Optional[str]:
+    """
+    The process's start time in clock ticks since boot, or None without /proc.
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            # Fields after the parenthesised command name; starttime is field 22
+            return f.read().rsplit(b')', 1)[1].split()[19].decode('ascii')
+    except (OSError, IndexError):
+        return None
+
+def _name_snapshot():
+    global _snapshot_name
+    pid = os.getpid()
+    # Without /proc a random id keeps names unique, but a reused pid then
+    # looks alive until that process exits too
+    _snapshot_name = f'{pid}-{_process_start(pid) or uuid.uuid4().hex}.json'
+
+def _snapshot_is_live(name: str) -> bool:
+    pid, _, start = name[:-len('.json')].partition('-')
+    if not pid.isdigit():
+        return False
+    current_start = _process_start(int(pid)) if start.isdigit() else None
+    if current_start is not None:
+        return current_start == start
+    if start.isdigit() and os.path.isdir('/proc'):
+        return False  # No such process any more
+    return _is_alive(int(pid))
+
+def flush():
+    """
+    Write this process's snapshot to the metrics directory (if init() was called).
+    """
+    if _dir is None:
+        return
+    path = os.path.join(_dir, _snapshot_name)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL_SECONDS)
+        try:
+            flush()
+        except Exception as e:
+            logger.error("Metrics flush failed: %s", e)
+
+def _start_flusher():
+    threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True).start()
+
+def _reset_after_fork():
+    # A forked child starts with the parent's counts; start from zero so they
+    # are not counted twice, and give the child its own snapshot and flush thread
+    global _registry
+    _registry = _Registry(_registry.buckets, _registry.gauges)
+    _name_snapshot()
+    _start_flusher()
+
+def clear_metrics_dir(directory: str = METRICS_DIR):
+    """
+    Remove every snapshot file and the aggregate of exited processes, e.g.
+    before a fresh deployment starts workers.
+    """
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(directory, name))
+
+def _read_snapshot(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # Being replaced or removed right now
+
+def _add_snapshot(totals: dict, snapshot: dict, include_gauges: bool):
+    """
+    Add a snapshot's histograms and counters (and gauges) into totals.
+    """
+    for stage, h in snapshot['histograms'].items():
+        total = totals['histograms'].setdefault(stage, {'counts': [0] * len(h['counts']), 'sum': 0.0, 'count': 0})
+        total['counts'] = [a + b for a, b in zip(total['counts'], h['counts'])]
+        total['sum'] += h['sum']
+        total['count'] += h['count']
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(sorted(labels.items())))
+        totals['counters'][key] = totals['counters'].get(key, 0) + value
+    if include_gauges:
+        for name, labels, value in snapshot.get('gauges', ()):
+            key = (name, tuple(sorted(labels.items())))
+            totals['gauges'][key] = totals['gauges'].get(key, 0) + value
+
+def _empty_totals(buckets) -> dict:
+    return {'buckets': list(buckets), 'histograms': {}, 'counters': {}, 'gauges': {}}
+
+def _retire_dead_snapshots(directory: str, buckets: list):
+    """
+    Fold the snapshots of exited processes into the aggregate and remove them.
+
+    The aggregate lists the files it last folded, so a file whose removal was
+    interrupted is removed later rather than counted twice.
+    """
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+        retired = _read_snapshot(retired_path) or {'buckets': buckets, 'histograms': {}, 'counters': [],
+                                                   'folded': []}
+        already_folded = set(retired.get('folded', ()))
+        dead = [name for name in os.listdir(directory)
+                if name.endswith('.json') and not name.startswith('_') and not _snapshot_is_live(name)]
+        if not dead:
+            return
+        totals = _empty_totals(buckets)
+        _add_snapshot(totals, retired, include_gauges=False)
+        folded = []
+        for name in dead:
+            if name in already_folded:
+                continue
+            snapshot = _read_snapshot(os.path.join(directory, name))
+            if snapshot is None or snapshot['buckets'] != buckets:
+                continue
+            _add_snapshot(totals, snapshot, include_gauges=False)
+            folded.append(name)
+        retired = {
+            'buckets': buckets,
+            'histograms': totals['histograms'],
+            'counters': [[name, dict(labels), value] for (name, labels), value in totals['counters'].items()],
+            'folded': folded,
+        }
+        tmp_path = f'{retired_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(retired, f)
+        os.replace(tmp_path, retired_path)
+        for name in dead:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+def collect() -> dict:
+    """
+    Sum the snapshots of all processes, this one included, and the aggregate
+    of exited ones. Without init() only this process is counted.
+    """
+    buckets = list(_registry.buckets)
+    totals = _empty_totals(buckets)
+    if _dir is None:
+        _add_snapshot(totals, _registry.snapshot(), include_gauges=True)
+        return totals
+    flush()
+    _retire_dead_snapshots(_dir, buckets)
+    for name in os.listdir(_dir):
+        if not name.endswith('.json'):
+            continue
+        snapshot = _read_snapshot(os.path.join(_dir, name))
+        if snapshot is None:
+            continue
+        if snapshot['buckets'] != buckets:
+            logger.warning("Skipping metrics snapshot %s with different buckets", name)
+            continue
+        _add_snapshot(totals, snapshot, include_gauges=name != RETIRED_SNAPSHOT)
+    return totals
+
+def _is_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+def render_prometheus() -> str:
+    """
+    All processes' metrics in the Prometheus text exposition format.
+    """
+    data = collect()
+    lines = [f'# HELP {STAGE_HISTOGRAM} Time spent in each verification stage.',
+             f'# TYPE {STAGE_HISTOGRAM} histogram']
+    bounds = [repr(float(b)) for b in data['buckets']] + ['+Inf']
+    for stage, h in sorted(data['histograms'].items()):
+        cumulative = 0
+        for bound, count in zip(bounds, h['counts']):
+            cumulative += count
+            lines.append(f'{STAGE_HISTOGRAM}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{STAGE_HISTOGRAM}_sum{{stage="{stage}"}} {h["sum"]}')
+        lines.append(f'{STAGE_HISTOGRAM}_count{{stage="{stage}"}} {h["count"]}')
+
+    seen = set()
+    for (name, labels), value in sorted(data['counters'].items()):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    seen = set()
+    for (name, labels), value in sorted(data['gauges'].items()):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
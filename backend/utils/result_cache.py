@@ -0,0 +1,74 @@
+"""
+Document extraction cache.
+
+Re-uploading the same document (after a failed selfie or a dropped
+connection) would otherwise repeat signature validation, text extraction, DOB
+parsing and face embedding. Extraction results are stored under the SHA-256
+of the uploaded bytes in a session store, so the same LRU/TTL eviction and the
+'memory' and 'sqlite' backends apply. Only facts about the document itself are
+cached; the age policy is re-applied on every hit.
+"""
+import logging
+import threading
+from typing import Optional
+
+from config import (DOC_CACHE_BACKEND, DOC_CACHE_TTL_SECONDS, DOC_CACHE_MAX_ENTRIES,
+                    DOC_CACHE_MAX_BYTES, DOC_CACHE_DB_PATH)
+from utils.metrics import increment
+from utils.session_store import EntryTooLarge, SessionStore, create_session_store
+
+logger = logging.getLogger(__name__)
+
+class DocumentResultCache:
+    """
+    Extraction results keyed by document digest, with hit/miss counters.
+    """
+
+    def __init__(self, store: SessionStore):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> Optional[dict]:
+        extraction = self.store.get(digest)
+        if extraction is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        increment('altid_doc_cache_requests_total', result='miss' if extraction is None else 'hit')
+        return extraction
+
+    def put(self, digest: str, extraction: dict):
+        try:
+            self.store.set(digest, extraction)
+        except EntryTooLarge:
+            pass  # Logged by the store; the document is just not cached
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def create_document_cache(backend: str = DOC_CACHE_BACKEND) -> Optional[DocumentResultCache]:
+    """
+    Build the cache configured by DOC_CACHE_BACKEND, or None if it is disabled.
+    """
+    if backend == 'none':
+        return None
+    kwargs = {'name': 'doc_cache', 'ttl_seconds': DOC_CACHE_TTL_SECONDS, 'max_entries': DOC_CACHE_MAX_ENTRIES}
+    if backend == 'memory':
+        kwargs['max_bytes'] = DOC_CACHE_MAX_BYTES
+    elif backend == 'sqlite':
+        kwargs['path'] = DOC_CACHE_DB_PATH
+    return DocumentResultCache(create_session_store(backend, **kwargs))
+
+def get_document_cache() -> Optional[DocumentResultCache]:
+    """
+    The process-wide document cache, created on first use. Worker processes
+    each build their own, which share entries only with the 'sqlite' backend.
+    """
+    global _cache
+    if _cache is None and DOC_CACHE_BACKEND != 'none':
+        with _cache_lock:
+            # Concurrent first requests must not each build a store
+            if _cache is None:
+                _cache = create_document_cache()
+    return _cache
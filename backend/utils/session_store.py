@@ -0,0 +1,261 @@
+"""
+Pluggable verification session store.
+
+MemorySessionStore keeps sessions in this process with LRU + TTL eviction and
+a total-bytes budget. SQLiteSessionStore keeps them in a local SQLite database
+in WAL mode so that several worker processes on the same box can share them
+without sticky routing. Both expire entries in the background.
+
+Session values are plain dicts; they are pickled, so numpy arrays and dates
+round-trip unchanged.
+"""
+import logging
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from config import (SESSION_BACKEND, SESSION_TTL_SECONDS, SESSION_MAX_ENTRIES,
+                    SESSION_MAX_BYTES, SESSION_DB_PATH, SESSION_SWEEP_INTERVAL_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(24)
+
+class EntryTooLarge(ValueError):
+    pass
+
+class SessionStore(ABC):
+    """
+    Interface shared by the session backends.
+    """
+
+    def __init__(self, name: str = 'sessions', ttl_seconds: float = SESSION_TTL_SECONDS,
+                 sweep_interval_seconds: float = SESSION_SWEEP_INTERVAL_SECONDS):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self._sweeper = threading.Thread(target=self._sweep_forever, args=(sweep_interval_seconds,),
+                                         name=f'{name}-expiry', daemon=True)
+        self._sweeper.start()
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: dict):
+        pass
+
+    @abstractmethod
+    def update(self, key: str, changes: dict) -> Optional[dict]:
+        """
+        Merge changes into an existing session, atomically with respect to
+        other updates of it (from any process sharing the store). Returns the
+        updated session, or None if it does not exist (or has expired).
+        """
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        pass
+
+    def create(self, value: dict) -> str:
+        session_id = new_session_id()
+        self.set(session_id, value)
+        return session_id
+
+    def __contains__(self, key) -> bool:
+        return key is not None and self.get(key) is not None
+
+    def _sweep_forever(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                removed = self.purge_expired()
+                if removed:
+                    logger.debug("Expired %d entries from %s", removed, self.name)
+            except Exception as e:
+                logger.error("Session expiry sweep failed: %s", e)
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process store with LRU eviction once either max_entries or max_bytes
+    (the pickled size of all sessions) is exceeded. A single value larger
+    than max_bytes is rejected with EntryTooLarge.
+    """
+
+    def __init__(self, max_entries: int = SESSION_MAX_ENTRIES, max_bytes: int = SESSION_MAX_BYTES, **kwargs):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, pickled value)
+        self._lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live_entry(key)
+            return pickle.loads(entry[2]) if entry else None
+
+    def set(self, key, value):
+        blob = self._pickle(key, value)
+        with self._lock:
+            self._put(key, blob)
+
+    def update(self, key, changes):
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                return None
+            value = pickle.loads(entry[2])
+            value.update(changes)
+            self._put(key, self._pickle(key, value))
+            return value
+
+    def _pickle(self, key, value) -> bytes:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            # Storing it would evict every other entry and then itself
+            logger.warning("Rejected %d-byte entry for %s (budget %d bytes)", len(blob), self.name, self.max_bytes)
+            raise EntryTooLarge(f'{self.name} entry of {len(blob)} bytes exceeds the {self.max_bytes}-byte budget')
+        return blob
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, blob):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time() + self.ttl_seconds, len(blob), blob)
+        self.total_bytes += len(blob)
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry[0] < now]
+            for key in expired:
+                self._remove(key)
+        return len(expired)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        self.total_bytes -= self._entries.pop(key)[1]
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store shared by all worker processes on a host, backed by a SQLite file in
+    WAL mode. Lookups go through the primary key index. Stores with different
+    names use separate tables in the same file.
+
+    With max_entries set, the expiry sweep also trims the table down to that
+    many rows, dropping the entries closest to expiry (the oldest writes) first.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, name: str = 'sessions',
+                 max_entries: Optional[int] = None, **kwargs):
+        if not name.isidentifier():
+            raise ValueError(f"Invalid store name '{name}'")
+        self.path = path
+        self.max_entries = max_entries
+        self._table = name
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {name} ('
+                     'key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value BLOB NOT NULL)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name}_expires_at ON {name} (expires_at)')
+        super().__init__(name=name, **kwargs)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            f'SELECT value FROM {self._table} WHERE key = ? AND expires_at >= ?', (key, time.time())).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._connection().execute(
+            f'INSERT OR REPLACE INTO {self._table} (key, expires_at, value) VALUES (?, ?, ?)',
+            (key, time.time() + self.ttl_seconds, blob))
+
+    def update(self, key, changes):
+        conn = self._connection()
+        # The write lock is taken up front, so concurrent updates from other
+        # processes are serialised rather than overwriting each other
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(f'SELECT value FROM {self._table} WHERE key = ? AND expires_at >= ?',
+                               (key, time.time())).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            value = pickle.loads(row[0])
+            value.update(changes)
+            conn.execute(f'UPDATE {self._table} SET expires_at = ?, value = ? WHERE key = ?',
+                         (time.time() + self.ttl_seconds, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), key))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def delete(self, key):
+        self._connection().execute(f'DELETE FROM {self._table} WHERE key = ?', (key,))
+
+    def purge_expired(self):
+        conn = self._connection()
+        removed = conn.execute(f'DELETE FROM {self._table} WHERE expires_at < ?', (time.time(),)).rowcount
+        if self.max_entries is not None:
+            removed += conn.execute(
+                f'DELETE FROM {self._table} WHERE key IN (SELECT key FROM {self._table} '
+                'ORDER BY expires_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,)).rowcount
+        return removed
+
+    def __len__(self):
+        return self._connection().execute(f'SELECT COUNT(*) FROM {self._table}').fetchone()[0]
+
+SESSION_BACKENDS = {
+    'memory': MemorySessionStore,
+    'sqlite': SQLiteSessionStore,
+}
+
+def create_session_store(backend: str = SESSION_BACKEND, **kwargs) -> SessionStore:
+    try:
+        store_cls = SESSION_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown session backend '{backend}', expected one of {sorted(SESSION_BACKENDS)}")
+    return store_cls(**kwargs)
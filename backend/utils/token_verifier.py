@@ -0,0 +1,220 @@
+"""
+Token verification for AltID tokens, for /verify-token and for relying parties.
+
+A TokenVerifier holds the parsed public keys (from the key ring, or from
+/.well-known/jwks.json) and remembers recently verified tokens until they
+expire, so checking a token a relying party has already seen is a dictionary
+lookup rather than a signature verification. Revoked tokens are rejected by
+jti against a Bloom filter, which /revocations publishes in a few bytes per
+entry; a positive can optionally be confirmed against an exact list, since a
+Bloom filter has false positives but never false negatives.
+
+Relying parties use it like this:
+
+    verifier = TokenVerifier.from_url('https://altid.example', issuer='AltID')
+    claims = verifier.verify(token)  # None if invalid, expired or revoked
+
+This module only needs PyJWT and cryptography; it does not import the
+service's config, so it can be copied into a relying party's code as is.
+"""
+import hashlib
+import json
+import logging
+import math
+import struct
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+JWKS_REFRESH_MIN_SECONDS = 60  # Unknown key ids trigger a JWKS refetch at most this often
+DEFAULT_CACHE_SIZE = 10_000  # Verified tokens remembered
+DEFAULT_BLOOM_CAPACITY = 10_000
+DEFAULT_BLOOM_ERROR_RATE = 1e-4
+
+class BloomFilter:
+    """
+    Bloom filter over strings, serialisable to bytes.
+    """
+    _HEADER = struct.Struct('>IB')  # Bits, hash count
+
+    def __init__(self, capacity: int = DEFAULT_BLOOM_CAPACITY, error_rate: float = DEFAULT_BLOOM_ERROR_RATE,
+                 size: Optional[int] = None, hashes: Optional[int] = None, bits: Optional[bytearray] = None):
+        self.size = size or max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def to_bytes(self) -> bytes:
+        return self._HEADER.pack(self.size, self.hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        size, hashes = cls._HEADER.unpack_from(data)
+        bits = bytearray(data[cls._HEADER.size:])
+        if len(bits) != (size + 7) // 8:
+            raise ValueError('Truncated Bloom filter')
+        return cls(size=size, hashes=hashes, bits=bits)
+
+    @classmethod
+    def of(cls, items: Iterable[str], **kwargs) -> 'BloomFilter':
+        bloom = cls(**kwargs)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+def _fetch(url: str, timeout: float = 5.0) -> bytes:
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+class TokenVerifier:
+    """
+    Verifies AltID tokens against parsed public keys, with a result cache
+    and a jti revocation filter.
+    """
+
+    def __init__(self, public_keys: Dict[str, Tuple[object, str]], issuer: str,
+                 revoked: Optional[BloomFilter] = None, confirm_revoked: Optional[Callable[[str], bool]] = None,
+                 cache_size: int = DEFAULT_CACHE_SIZE, leeway: float = 0,
+                 fetch_keys: Optional[Callable[[], Dict[str, Tuple[object, str]]]] = None):
+        """
+        Args:
+            public_keys: {kid: (parsed public key, algorithm)}
+            issuer: Required 'iss' claim
+            revoked: Bloom filter of revoked jtis
+            confirm_revoked: Called for jtis the filter reports, to rule out
+                false positives; without it every reported jti is rejected
+            cache_size: Verified tokens remembered until their exp
+            leeway: Seconds of clock skew tolerated on exp
+            fetch_keys: Reloads public_keys when a token names an unknown kid
+        """
+        self.public_keys = dict(public_keys)
+        self.issuer = issuer
+        self.revoked = revoked
+        self.confirm_revoked = confirm_revoked
+        self.cache_size = cache_size
+        self.leeway = leeway
+        self.fetch_keys = fetch_keys
+        self.base_url = None  # Set by from_url
+        self._cache: 'OrderedDict[str, dict]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._keys_fetched_at = time.monotonic()
+
+    @classmethod
+    def from_key_ring(cls, key_ring, issuer: str, **kwargs) -> 'TokenVerifier':
+        """
+        Verifier for the keys of a utils.jwt_utils.KeyRing.
+        """
+        return cls({kid: (key.key, key.alg) for kid, key in key_ring.public_keys.items()}, issuer, **kwargs)
+
+    @staticmethod
+    def keys_from_jwks(jwks: dict) -> Dict[str, Tuple[object, str]]:
+        keys = {}
+        for jwk in jwks['keys']:
+            key = jwt.PyJWK(jwk)
+            keys[key.key_id] = (key.key, key.algorithm_name)
+        return keys
+
+    @classmethod
+    def from_url(cls, base_url: str, issuer: str, **kwargs) -> 'TokenVerifier':
+        """
+        Verifier for a running AltID service: its JWKS (refetched on unknown
+        key ids) and its published revocation filter.
+        """
+        base_url = base_url.rstrip('/')
+
+        def fetch_keys():
+            return cls.keys_from_jwks(json.loads(_fetch(f'{base_url}/.well-known/jwks.json')))
+
+        verifier = cls(fetch_keys(), issuer, fetch_keys=fetch_keys, **kwargs)
+        verifier.base_url = base_url
+        verifier.refresh_revocations()
+        return verifier
+
+    def refresh_revocations(self):
+        """
+        Refetch the revocation filter of the service given to from_url. Call
+        periodically, e.g. every JWKS_MAX_AGE_SECONDS.
+        """
+        self.set_revoked(BloomFilter.from_bytes(_fetch(f'{self.base_url}/revocations')))
+
+    def set_revoked(self, revoked: Optional[BloomFilter]):
+        self.revoked = revoked
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        if jti is None or self.revoked is None or jti not in self.revoked:
+            return False
+        return self.confirm_revoked(jti) if self.confirm_revoked else True
+
+    def _key(self, token: str) -> Optional[Tuple[object, str]]:
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None and len(self.public_keys) == 1:
+            return next(iter(self.public_keys.values()))
+        key = self.public_keys.get(kid)
+        if key is None and self.fetch_keys and time.monotonic() - self._keys_fetched_at > JWKS_REFRESH_MIN_SECONDS:
+            self._keys_fetched_at = time.monotonic()
+            self.public_keys = self.fetch_keys()
+            key = self.public_keys.get(kid)
+        return key
+
+    def verify(self, token: str) -> Optional[dict]:
+        """
+        Verify a token's signature, issuer, expiry and revocation.
+
+        Returns:
+            Optional[dict]: The token's claims, or None if it is not valid
+            (including anything that is not a str)
+        """
+        if not isinstance(token, str):
+            return None
+        now = time.time()
+        with self._lock:
+            claims = self._cache.get(token)
+            if claims is not None:
+                self._cache.move_to_end(token)
+        if claims is not None:
+            if claims['exp'] + self.leeway <= now:
+                with self._lock:
+                    self._cache.pop(token, None)
+                return None
+            # Revocations can arrive after a token was cached
+            return None if self.is_revoked(claims.get('jti')) else dict(claims)
+
+        try:
+            key = self._key(token)
+            if key is None:
+                logger.debug("Token signed with an unknown key")
+                return None
+            public_key, alg = key
+            claims = jwt.decode(token, public_key, algorithms=[alg], issuer=self.issuer, leeway=self.leeway,
+                                options={'require': ['exp', 'iss']})
+        except jwt.InvalidTokenError as e:
+            logger.debug("Token rejected: %s", e)
+            return None
+        if self.is_revoked(claims.get('jti')):
+            logger.debug("Token %s is revoked", claims.get('jti'))
+            return None
+
+        with self._lock:
+            self._cache[token] = claims
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dict(claims)
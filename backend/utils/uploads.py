@@ -0,0 +1,173 @@
+"""
+Streaming upload handling.
+
+UploadRequest replaces Werkzeug's file stream factory, so multipart file parts
+are written into an in-memory HashingBuffer as they are parsed rather than
+spooled to a temporary file. The buffer hashes each chunk and aborts the
+request with 413 as soon as the endpoint's size limit is passed, so an
+oversized upload is never fully read. The file type is then sniffed from its
+magic bytes rather than taken from the client's filename, and junk is
+rejected before any verification stage runs.
+"""
+import hashlib
+import io
+from typing import Optional, Tuple
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from config import UPLOAD_MAX_BYTES, UPLOAD_LIMITS, UPLOAD_FORM_OVERHEAD_BYTES, INGEST_MAX_SOURCE_PIXELS
+from utils.metrics import timed
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+PDF_HEADER_SEARCH_BYTES = 1024
+
+IMAGE_TYPES = {'.jpg', '.png', '.webp', '.bmp', '.tiff'}
+DOCUMENT_TYPES = {'.pdf', '.xml'} | IMAGE_TYPES
+
+class UploadRejected(Exception):
+    """
+    An upload that cannot be verified; carries the HTTP status to answer with.
+    """
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+class HashingBuffer(io.BytesIO):
+    """
+    In-memory file part that hashes what is written to it and refuses to grow
+    beyond limit bytes.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        if self.tell() + len(data) > self.limit:
+            raise RequestEntityTooLarge(f'Upload exceeds {self.limit} bytes')
+        self.sha256.update(data)
+        return super().write(data)
+
+class UploadRequest(Request):
+    """
+    Request whose file uploads stream into size-limited HashingBuffers. The
+    limit comes from UPLOAD_LIMITS by endpoint name.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = upload_limit(self.endpoint)
+        # Refuse on the declared lengths before reading the file part at all
+        if (content_length is not None and content_length > limit) or \
+                (total_content_length is not None and total_content_length > limit + UPLOAD_FORM_OVERHEAD_BYTES):
+            raise RequestEntityTooLarge(f'Upload exceeds {limit} bytes')
+        return HashingBuffer(limit)
+
+def upload_limit(endpoint: Optional[str]) -> int:
+    return UPLOAD_LIMITS.get(endpoint, UPLOAD_MAX_BYTES)
+
+@timed('upload_read')
+def read_upload(file_storage, limit: int = UPLOAD_MAX_BYTES, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Tuple[bytes, str]:
+    """
+    Return an uploaded file's contents and SHA-256 hex digest.
+
+    Files parsed by UploadRequest were hashed while streaming and are returned
+    as they are; other streams are read in chunks, hashed and size-checked.
+
+    Args:
+        file_storage: werkzeug FileStorage from request.files
+        limit: Maximum size in bytes, for streams that were not limited while parsing
+        chunk_size: Bytes read per chunk
+
+    Returns:
+        Tuple[bytes, str]: File contents and their SHA-256 hex digest
+
+    Raises:
+        UploadRejected: If the file is empty or larger than limit
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashingBuffer):
+        data, digest = stream.getvalue(), stream.sha256.hexdigest()
+    else:
+        sha256 = hashlib.sha256()
+        chunks = []
+        size = 0
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise UploadRejected(f'Upload exceeds {limit} bytes', 413)
+            sha256.update(chunk)
+            chunks.append(chunk)
+        data, digest = b''.join(chunks), sha256.hexdigest()
+    if not data:
+        raise UploadRejected('Empty upload')
+    return data, digest
+
+def sniff_type(data: bytes) -> Optional[str]:
+    """
+    Identify an upload from its magic bytes.
+
+    The anchored signatures are tested first, so an image or XML document
+    whose first kilobyte happens to contain '%PDF-' is not taken for a PDF.
+
+    Returns:
+        Optional[str]: '.pdf', '.xml' or one of IMAGE_TYPES, or None if unrecognised
+    """
+    head = data[:PDF_HEADER_SEARCH_BYTES]
+    if head.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return '.tiff'
+    if head[:2] == b'BM':
+        return '.bmp'
+    if head.startswith(b'%PDF-'):
+        return '.pdf'
+    # XML declaration or root element, after an optional BOM and whitespace
+    if head.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'<'):
+        return '.xml'
+    # Readers accept a PDF header after some leading junk, within the first kilobyte
+    if b'%PDF-' in head:
+        return '.pdf'
+    return None
+
+def check_image_header(data: bytes):
+    """
+    Read only the image header and refuse images that cannot be decoded or
+    are too large to decode.
+
+    Raises:
+        UploadRejected: If the header is invalid or the image is too large
+    """
+    from PIL import Image
+    try:
+        width, height = Image.open(io.BytesIO(data)).size
+    except Exception:
+        raise UploadRejected('Unreadable image')
+    if width * height > INGEST_MAX_SOURCE_PIXELS:
+        raise UploadRejected(f'Image too large: {width}x{height}', 413)
+
+def admit_upload(data: bytes, allowed_types=DOCUMENT_TYPES) -> str:
+    """
+    Sniff an upload's type and run the cheap checks for it.
+
+    Returns:
+        str: The sniffed type, used in place of the filename's extension
+
+    Raises:
+        UploadRejected: With 415 for unsupported types, or as raised by the checks
+    """
+    file_type = sniff_type(data)
+    if file_type not in allowed_types:
+        raise UploadRejected('Unsupported file type', 415)
+    if file_type in IMAGE_TYPES:
+        check_image_header(data)
+    return file_type
@@ -0,0 +1,166 @@
+"""
+Single-pass reader for Aadhaar offline e-KYC XML.
+
+Handles both the OKY format (everything in attributes of the root <OKY>
+element: 'd' for the date of birth, 'i' for the base64 photo) and the
+OfflinePaperlessKyc format (<Poi dob="..."> and a <Pht> element). The document
+is parsed once with iterparse; the DOB is read from its structured field and
+the photo is decoded in the same pass. Regex DOB extraction only falls back to
+the genuine text fields, never to the base64 photo or signature blobs.
+
+When the signature is verified, the document has already been parsed for it;
+read_aadhaar_element reads the same fields from the element the signature
+covers instead of parsing the bytes again.
+"""
+import base64
+import io
+import logging
+import xml.etree.ElementTree as ET
+from datetime import date
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from utils.metrics import timed
+from verification.age_verification import extract_dob_from_text
+
+logger = logging.getLogger(__name__)
+
+# Structured DOB fields, as (element, attribute)
+DOB_ATTRIBUTES = {('OKY', 'd'), ('Poi', 'dob')}
+# Attributes and elements holding binary blobs rather than text
+# ('s' is the OKY signature)
+PHOTO_ATTRIBUTES = {('OKY', 'i')}
+PHOTO_ELEMENTS = {'Pht'}
+SIGNATURE_ELEMENTS = {'Signature', 'SignatureValue', 'DigestValue', 'X509Certificate'}
+BLOB_ATTRIBUTES = PHOTO_ATTRIBUTES | {('OKY', 's')}
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+class AadhaarXml:
+    """
+    Fields read from an Aadhaar offline XML document.
+    """
+
+    def __init__(self):
+        self.root_tag = None
+        self.dob_field = None  # Raw value of the structured DOB field
+        self.photo_data = None  # Decoded photo bytes
+        self.text_fields: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return '\n'.join(self.text_fields)
+
+    @property
+    def dob(self) -> Optional[date]:
+        """
+        DOB from the structured field, falling back to the text fields.
+        """
+        if self.dob_field:
+            dob = extract_dob_from_text(self.dob_field)
+            if dob:
+                return dob
+            logger.warning("Unparseable structured DOB field: %r", self.dob_field)
+        return extract_dob_from_text(self.text)
+
+    @property
+    def photo(self) -> Optional[Image.Image]:
+        if not self.photo_data:
+            return None
+        try:
+            return Image.open(io.BytesIO(self.photo_data))
+        except Exception as e:
+            logger.error("Error decoding Aadhaar photo: %s", e)
+            return None
+
+def _decode_photo(value: str) -> Optional[bytes]:
+    try:
+        return base64.b64decode(value)
+    except Exception as e:
+        logger.error("Invalid base64 photo in XML: %s", e)
+        return None
+
+def _read_events(events: Iterable[Tuple[str, object]], clear: bool) -> AadhaarXml:
+    """
+    Collect the fields from ('start' | 'end', element) events.
+    """
+    result = AadhaarXml()
+    signature_depth = 0
+    for event, elem in events:
+        tag = _local_name(elem.tag)
+        if event == 'start':
+            if result.root_tag is None:
+                result.root_tag = tag
+            if tag == 'Signature':
+                signature_depth += 1
+            if signature_depth:
+                continue
+            for name, value in elem.attrib.items():
+                key = (tag, _local_name(name))
+                if key in DOB_ATTRIBUTES and result.dob_field is None:
+                    result.dob_field = value
+                elif key in PHOTO_ATTRIBUTES and result.photo_data is None:
+                    result.photo_data = _decode_photo(value)
+                elif key not in BLOB_ATTRIBUTES:
+                    result.text_fields.append(value)
+            continue
+
+        if tag == 'Signature':
+            signature_depth -= 1
+        elif not signature_depth and tag not in SIGNATURE_ELEMENTS:
+            text = (elem.text or '').strip()
+            if tag in PHOTO_ELEMENTS:
+                if text and result.photo_data is None:
+                    result.photo_data = _decode_photo(text)
+            elif text:
+                result.text_fields.append(text)
+        if clear:
+            # Drop the element's content once it has been read
+            elem.clear()
+    return result
+
+@timed('xml_parse')
+def parse_aadhaar_xml(xml_data: bytes) -> AadhaarXml:
+    """
+    Read the DOB, photo and text fields from an Aadhaar XML in one pass.
+
+    Args:
+        xml_data: Raw XML bytes
+
+    Returns:
+        AadhaarXml: The extracted fields
+
+    Raises:
+        xml.etree.ElementTree.ParseError: If the document is not well-formed
+    """
+    return _read_events(ET.iterparse(io.BytesIO(xml_data), events=('start', 'end')), clear=True)
+
+def _tree_events(root) -> Iterator[Tuple[str, object]]:
+    # The events iterparse would produce for an element tree, without recursion
+    stack = [(root, False)]
+    while stack:
+        elem, done = stack.pop()
+        if not isinstance(elem.tag, str):
+            continue  # lxml comments and processing instructions
+        if done:
+            yield 'end', elem
+            continue
+        yield 'start', elem
+        stack.append((elem, True))
+        stack.extend((child, False) for child in reversed(list(elem)))
+
+@timed('xml_read')
+def read_aadhaar_element(root) -> AadhaarXml:
+    """
+    Read the DOB, photo and text fields from an already parsed element, e.g.
+    the signed element returned by signature verification.
+
+    Args:
+        root: lxml or xml.etree element
+
+    Returns:
+        AadhaarXml: The extracted fields
+    """
+    return _read_events(_tree_events(root), clear=False)
@@ -1,4 +1,4 @@
-from datetime import datetime, date
+from datetime import date
 import re
 from typing import Optional, Tuple
 from config import MINIMUM_AGE
@@ -33,59 +33,114 @@ def is_age_valid(dob: date) -> Tuple[bool, int]:
     age = calculate_age(dob)
     return age >= MINIMUM_AGE, age
 
-def extract_dob_from_text(text: str) -> Optional[date]:
+_MONTHS = {m: i for i, m in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), start=1)}
+
+# All supported date layouts in one alternation, so the text is scanned once.
+# Patterns run on lower-cased text; the leading lookahead lets the scanner
+# skip non-digits cheaply.
+_DATE_PATTERN = re.compile(
+    r'(?=\d)(?:'
+    # DD/MM/YYYY, DD-MM-YYYY or DD.MM.YYYY
+    r'\b(?P<dmy_d>0[1-9]|[12][0-9]|3[01])[/.-](?P<dmy_m>0[1-9]|1[0-2])[/.-](?P<dmy_y>(?:19|20)\d{2})\b'
+    # YYYY/MM/DD or YYYY-MM-DD
+    r'|\b(?P<ymd_y>(?:19|20)\d{2})[/-](?P<ymd_m>0[1-9]|1[0-2])[/-](?P<ymd_d>0[1-9]|[12][0-9]|3[01])\b'
+    # DD Month YYYY (e.g., 01 Jan 1990)
+    r'|\b(?P<dmony_d>0[1-9]|[12][0-9]|3[01])\s+(?P<dmony_m>jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
+    r'\s+(?P<dmony_y>(?:19|20)\d{2})\b'
+    r')')
+
+# A year on its own, only accepted right after a DOB/YoB label,
+# e.g. "Year of Birth : 1990"
+_YEAR_PATTERN = re.compile(r'(?=\d)\b(?P<year>(?:19|20)\d{2})\b(?![/.-]\d)')
+
+# Labels that say which date a value is. Only the nearest label in the
+# _LABEL_WINDOW characters before a date counts, and only if no other date
+# sits between the two. Labels are only searched for in those windows.
+_LABEL_PATTERN = re.compile(
+    r'(?P<dob>\bd\.?\s?o\.?\s?b\b|date\s+of\s+birth|birth\s*date|जन्म\s*तिथि|जन्म\s*तारीख)'
+    r'|(?P<yob>\by\.?o\.?b\b|year\s+of\s+birth|जन्म\s*वर्ष)'
+    r'|(?P<other>issue|expir|valid|download|generat|print|जारी)')
+_LABEL_WINDOW = 40
+
+_LABEL_SCORES = {'dob': 2, 'yob': 2, 'other': -1}
+
+def _nearest_label(text: str, position: int, not_before: int = 0) -> Optional[str]:
     """
-    Extract date of birth from text using common patterns.
-    
+    Kind of the last label in the window before position, if any.
+    """
+    kind = None
+    for label in _LABEL_PATTERN.finditer(text, max(not_before, position - _LABEL_WINDOW), position):
+        kind = label.lastgroup
+    return kind
+
+def _match_to_date(match) -> Optional[date]:
+    # lastgroup is e.g. 'dmy_y'; its prefix names the layout that matched
+    kind = match.lastgroup.split('_')[0]
+    groups = match.groupdict()
+    year = int(groups[f'{kind}_y'])
+    month = groups[f'{kind}_m']
+    month = _MONTHS[month[:3]] if kind == 'dmony' else int(month)
+    try:
+        return date(year, month, int(groups[f'{kind}_d']))
+    except ValueError:  # e.g. 31/02
+        return None
+
+def _is_plausible_dob(dob: date, today: date) -> bool:
+    return dob.year >= 1900 and dob <= today
+
+def extract_dob_from_text(text: str, require_label: bool = False) -> Optional[date]:
+    """
+    Extract date of birth from text.
+
+    All date-like candidates are found in a single scan and ranked by the
+    nearest preceding label: dates labelled as a date of birth win, unlabelled
+    dates come next, and dates labelled as issue/expiry/download dates are
+    never returned. Ties go to the earliest date in the text. If there is no
+    usable full date, a labelled year of birth is accepted and returned as
+    31 December of that year, the latest possible birthday, so that the age
+    check stays conservative.
+
     Args:
         text: Text to search for date of birth
-        
+        require_label: Only return a date labelled as the date (or year) of
+            birth, e.g. for a crop of the page that may hold other dates
+
     Returns:
         Optional[date]: Date of birth if found, None otherwise
     """
-    logger.info(f"Starting date extraction from text. Text length: {len(text)}")
-    
-    # Common date patterns in various formats
-    date_patterns = [
-        # DD/MM/YYYY or DD-MM-YYYY
-        (r'\b(0[1-9]|[12][0-9]|3[01])[/-](0[1-9]|1[0-2])[/-](19|20)\d{2}\b', 
-         ['%d/%m/%Y', '%d-%m-%Y']),
-        # YYYY/MM/DD or YYYY-MM-DD
-        (r'\b(19|20)\d{2}[-/](0[1-9]|1[0-2])[-/](0[1-9]|[12][0-9]|3[01])\b',
-         ['%Y/%m/%d', '%Y-%m-%d']),
-        # DD Month YYYY (e.g., 01 Jan 1990)
-        (r'\b(0[1-9]|[12][0-9]|3[01])\s+(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+(19|20)\d{2}\b',
-         ['%d %b %Y', '%d %B %Y'])
-    ]
-    
-    for pattern, formats in date_patterns:
-        matches = list(re.finditer(pattern, text, re.IGNORECASE))
-        logger.info(f"Pattern '{pattern}' found {len(matches)} matches")
-        
-        for match in matches:
-            date_str = match.group(0)
-            logger.info(f"Trying to parse date string: {date_str}")
-            
-            for fmt in formats:
-                try:
-                    parsed_date = datetime.strptime(date_str, fmt).date()
-                    logger.info(f"Successfully parsed date: {parsed_date} using format: {fmt}")
-                    
-                    # Basic validation: date should be in the past and not too old
-                    today = date.today()
-                    if parsed_date > today:
-                        logger.warning(f"Future date detected: {parsed_date}")
-                        continue
-                    if parsed_date.year < 1900:
-                        logger.warning(f"Date too old: {parsed_date}")
-                        continue
-                        
-                    return parsed_date
-                except ValueError as e:
-                    logger.debug(f"Failed to parse '{date_str}' with format '{fmt}': {e}")
-                    continue
-    
-    logger.warning(f"No valid date found in text. Text sample: {text[:200]}...")
+    if not text:
+        return None
+    text = text.lower()
+    today = date.today()
+
+    best, best_score = None, None
+    previous_end = 0
+    for match in _DATE_PATTERN.finditer(text):
+        not_before, previous_end = previous_end, match.end()
+        score = _LABEL_SCORES.get(_nearest_label(text, match.start(), not_before), 0)
+        if require_label and score < _LABEL_SCORES['dob']:
+            continue
+        # Only parse candidates that would beat the current best
+        if score < 0 or (best_score is not None and score <= best_score):
+            continue
+        parsed = _match_to_date(match)
+        if parsed is None or not _is_plausible_dob(parsed, today):
+            continue
+        best, best_score = parsed, score
+        if score == _LABEL_SCORES['dob']:
+            break
+    if best is not None:
+        return best
+
+    # Year-of-birth fallback
+    for match in _YEAR_PATTERN.finditer(text):
+        if _nearest_label(text, match.start()) in ('dob', 'yob'):
+            dob = date(int(match.group('year')), 12, 31)
+            if _is_plausible_dob(dob, today):
+                return dob
+
+    logger.debug("No valid date found in text of length %d", len(text))
     return None
 
 def verify_age(dob: date) -> Tuple[bool, int, bool]:
@@ -98,7 +153,7 @@ def verify_age(dob: date) -> Tuple[bool, int, bool]:
     Returns:
         Tuple[bool, int, bool]: (is_valid, age, is_minor)
     """
-    logger.info(f"Verifying age for DOB: {dob}")
+    logger.debug("Verifying age for DOB: %s", dob)
     
     # Calculate age
     today = date.today()
@@ -106,12 +161,12 @@ def verify_age(dob: date) -> Tuple[bool, int, bool]:
     is_valid = age >= MINIMUM_AGE
     is_minor = age < MINIMUM_AGE
     
-    logger.info(f"Age calculation: {age} years old. Minimum age: {MINIMUM_AGE}. Valid: {is_valid}")
+    logger.info("Age calculation: %d years old. Minimum age: %d. Valid: %s", age, MINIMUM_AGE, is_valid)
     
     # Additional logging for debugging
     if age < 0:
-        logger.error(f"Negative age calculated. This suggests a date in the future: {dob}")
+        logger.error("Negative age calculated. This suggests a date in the future: %s", dob)
     elif age > 120:
-        logger.warning(f"Unusually old age detected: {age} years. DOB: {dob}")
+        logger.warning("Unusually old age detected: %d years. DOB: %s", age, dob)
     
     return is_valid, age, is_minor
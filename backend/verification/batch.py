@@ -0,0 +1,339 @@
+"""
+Bulk re-verification of archived documents.
+
+Re-runs the document pipeline (DOB extraction, age policy, signature
+validation, photo extraction and embedding) over a directory or manifest of
+documents, optionally matching each against a selfie, without going through
+the session flow:
+
+    cd backend && python -m verification.batch archive/ --output results.jsonl [--selfie-dir selfies/]
+    cd backend && python -m verification.batch manifest.jsonl --output results.jsonl
+
+A manifest is JSONL ({"id", "document", "selfie"?}) or CSV with those
+columns; relative paths are resolved against the manifest's directory. With
+--root (as for runs started through the API), rows whose paths lead outside
+that directory are recorded as errors and never opened. In a directory, a
+selfie in --selfie-dir with the same stem as a document is paired with it.
+
+Documents are handed to a process pool in chunks, with a bounded number of
+chunks in flight, and each result is appended to the output as one JSON line
+as soon as its chunk finishes, so memory stays flat however large the batch.
+Items already in the output are skipped, so an interrupted run resumes by
+running it again. The document result cache is bypassed: a re-verification
+must apply the current policy and trust store.
+"""
+import argparse
+import csv
+import fcntl
+import hashlib
+import hmac
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterable, Iterator, List, Optional
+
+from config import BATCH_TOKEN, BATCH_ROOT, BATCH_WORKERS, BATCH_CHUNK_SIZE, BATCH_NICENESS, FACE_MATCH_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+class BatchRunning(Exception):
+    pass
+
+def iter_items(source: str, selfie_dir: Optional[str] = None, root: Optional[str] = None) -> Iterator[dict]:
+    """
+    Yield {'id', 'document', 'selfie'} for each document in a directory or
+    manifest, without loading the whole list.
+
+    Args:
+        root: If given, manifest rows with a path outside it get an 'error'
+            instead, and are recorded as errors without being read
+    """
+    if os.path.isdir(source):
+        selfies = {}
+        if selfie_dir:
+            selfies = {os.path.splitext(name)[0]: os.path.join(selfie_dir, name) for name in os.listdir(selfie_dir)}
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path):
+                stem = os.path.splitext(name)[0]
+                yield {'id': name, 'document': path, 'selfie': selfies.get(stem)}
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline='') as f:
+        rows = csv.DictReader(f) if source.endswith('.csv') else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            item = {'id': row.get('id') or row['document'], 'document': os.path.join(base, row['document']),
+                    'selfie': os.path.join(base, row['selfie']) if row.get('selfie') else None}
+            if root is not None:
+                try:
+                    item['document'] = resolve_batch_path(row['document'], base, root)
+                    if item['selfie']:
+                        item['selfie'] = resolve_batch_path(row['selfie'], base, root)
+                except ValueError as e:
+                    item['error'] = str(e)
+            yield item
+
+def load_done(output: str) -> set:
+    """
+    Ids already recorded in an output file. A line cut short by an
+    interruption is truncated so that appending continues cleanly.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    good_size = 0
+    with open(output, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                done.add(json.loads(line)['id'])
+            except (ValueError, KeyError):
+                break
+            good_size += len(line)
+    if good_size != os.path.getsize(output):
+        logger.warning("Truncating incomplete result at byte %d of %s", good_size, output)
+        with open(output, 'r+b') as f:
+            f.truncate(good_size)
+    return done
+
+def _match_selfie(doc_embedding, selfie_path: str) -> dict:
+    from verification.face_match import cosine_distances, get_face_embeddings
+    from verification.image_ingest import decode_bgr
+
+    with open(selfie_path, 'rb') as f:
+        selfie = decode_bgr(f.read())
+    embeddings = get_face_embeddings(selfie) if selfie is not None else None
+    if embeddings is None:
+        return {'face_match': False, 'face_error': 'No face found in selfie'}
+    distance = float(cosine_distances(doc_embedding, embeddings).min())
+    return {'face_match': distance <= FACE_MATCH_THRESHOLD, 'face_distance': round(distance, 4)}
+
+def verify_item(item: dict) -> dict:
+    """
+    Re-verify one document (and its selfie, if any).
+
+    Returns:
+        dict: Result record; 'status' is 'verified', 'underage', 'rejected'
+        (the document failed a check) or 'error' (it could not be processed)
+    """
+    from utils.uploads import UploadRejected, admit_upload
+    from verification.pipeline import process_document
+
+    record = {'id': item['id'], 'document': item['document']}
+    if item.get('error'):
+        record.update(status='error', error=item['error'], seconds=0.0)
+        return record
+    start = time.perf_counter()
+    try:
+        with open(item['document'], 'rb') as f:
+            doc_data = f.read()
+        record['sha256'] = hashlib.sha256(doc_data).hexdigest()
+        ext = admit_upload(doc_data)
+        record['document_type'] = ext
+        # No digest, so the document result cache is not consulted
+        body, status, session_updates = process_document(doc_data, ext, f'batch:{item["id"]}')
+        record['http_status'] = status
+        if 'date_of_birth' in session_updates:
+            record['date_of_birth'] = session_updates['date_of_birth'].isoformat()
+            record['age'] = session_updates['age']
+        if status == 200:
+            record['status'] = 'verified'
+        elif status == 403:
+            record.update(status='underage', age=body.get('age'))
+        else:
+            record.update(status='rejected', error=body.get('error'))
+        if item.get('selfie') and 'doc_embedding' in session_updates:
+            record.update(_match_selfie(session_updates['doc_embedding'], item['selfie']))
+    except (OSError, UploadRejected) as e:
+        record.update(status='error', error=str(e))
+    except Exception as e:
+        logger.exception("Batch item %s failed", item['id'])
+        record.update(status='error', error=f'{type(e).__name__}: {e}')
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+def _verify_chunk(items: List[dict]) -> List[dict]:
+    return [verify_item(item) for item in items]
+
+def _init_worker():
+    os.nice(BATCH_NICENESS)
+    from utils import metrics
+    from verification import warmup
+    metrics.init()
+    warmup.warm_up()
+
+def _chunks(items: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def run_batch(source: str, output: str, selfie_dir: Optional[str] = None, workers: int = BATCH_WORKERS,
+              chunk_size: int = BATCH_CHUNK_SIZE, root: Optional[str] = None) -> dict:
+    """
+    Re-verify every document of source not yet in output, appending results.
+    Manifest paths outside root, if given, are recorded as errors (see iter_items).
+
+    Returns:
+        dict: Counts by status for this run, plus 'skipped' (already done) and 'seconds'
+    """
+    done = load_done(output)
+    summary = {'skipped': 0}
+    start = time.monotonic()
+
+    def todo():
+        for item in iter_items(source, selfie_dir, root):
+            if item['id'] in done:
+                summary['skipped'] += 1
+            else:
+                yield item
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor, \
+            open(output, 'a') as out:
+        pending = set()
+
+        def write(futures):
+            for future in futures:
+                for record in future.result():
+                    out.write(json.dumps(record, default=str) + '\n')
+                    summary[record['status']] = summary.get(record['status'], 0) + 1
+            out.flush()
+
+        for chunk in _chunks(todo(), chunk_size):
+            pending.add(executor.submit(_verify_chunk, chunk))
+            # Two chunks per worker keep them busy without reading ahead
+            if len(pending) >= workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(finished)
+        write(wait(pending).done)
+    summary['seconds'] = round(time.monotonic() - start, 1)
+    return summary
+
+# Background runs started through the API
+
+def _batch_paths(batch_id: str) -> dict:
+    base = os.path.join(BATCH_ROOT, 'results', batch_id)
+    return {'output': f'{base}.jsonl', 'summary': f'{base}.summary.json', 'log': f'{base}.log',
+            'lock': f'{base}.lock'}
+
+def resolve_batch_path(path: str, base: Optional[str] = None, root: Optional[str] = None) -> str:
+    """
+    Resolve a path given to the API, or found in a manifest, under root.
+
+    Args:
+        path: Absolute path, or relative to base
+        base: Directory relative paths start from; root by default
+        root: Directory the path must stay in, symlinks resolved; BATCH_ROOT by default
+
+    Raises:
+        ValueError: If the path leads outside root or does not exist
+    """
+    root = os.path.realpath(root or BATCH_ROOT)
+    resolved = os.path.realpath(os.path.join(base or root, path))
+    if os.path.commonpath([root, resolved]) != root or not os.path.exists(resolved):
+        raise ValueError(f'Not found under the batch root: {path}')
+    return resolved
+
+def is_authorized(authorization: Optional[str]) -> bool:
+    # compare_digest only takes ASCII str, so headers are compared as bytes
+    return bool(BATCH_TOKEN) and hmac.compare_digest((authorization or '').encode('utf-8'),
+                                                     f'Bearer {BATCH_TOKEN}'.encode('utf-8'))
+
+def start_batch(batch_id: str, source: str, selfie_dir: Optional[str] = None) -> subprocess.Popen:
+    """
+    Run (or resume) a batch in a separate process group, so it survives the
+    web worker that started it and never shares its memory.
+
+    The batch's lock file is locked here and the lock handed to the process,
+    which holds it until it exits, however it exits.
+
+    Raises:
+        BatchRunning: If the batch is already running
+    """
+    paths = _batch_paths(batch_id)
+    os.makedirs(os.path.dirname(paths['output']), exist_ok=True)
+    with open(paths['lock'], 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BatchRunning(batch_id)
+        if os.path.exists(paths['summary']):
+            os.remove(paths['summary'])
+        command = [sys.executable, '-m', 'verification.batch', source, '--output', paths['output'],
+                   '--summary', paths['summary'], '--root', BATCH_ROOT]
+        if selfie_dir:
+            command += ['--selfie-dir', selfie_dir]
+        with open(paths['log'], 'a') as log:
+            return subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+                                    pass_fds=(lock.fileno(),))
+
+def _is_running(lock_path: str) -> bool:
+    try:
+        with open(lock_path) as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    except FileNotFoundError:
+        return False
+    return False
+
+def batch_status(batch_id: str) -> Optional[dict]:
+    """
+    Progress of a batch started through the API, or None if it is unknown.
+    """
+    paths = _batch_paths(batch_id)
+    if not os.path.exists(paths['log']):
+        return None
+    processed = 0
+    if os.path.exists(paths['output']):
+        with open(paths['output'], 'rb') as f:
+            processed = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+    # A failed or interrupted run is resumed by starting it again
+    status = {'batch_id': batch_id, 'processed': processed, 'status': 'running'}
+    if _is_running(paths['lock']):
+        return status
+    if os.path.exists(paths['summary']):
+        with open(paths['summary']) as f:
+            summary = json.load(f)
+        status.update(status='aborted' if 'aborted' in summary else 'done', summary=summary)
+    else:
+        status['status'] = 'interrupted'  # Killed before it could write a summary
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Directory of documents, or a .jsonl/.csv manifest')
+    parser.add_argument('--output', required=True, help='JSONL results file, appended to and resumed from')
+    parser.add_argument('--selfie-dir', help='Selfies named like the documents they belong to')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument('--summary', help='Also write the run summary as JSON here')
+    parser.add_argument('--root', help='Record manifest paths outside this directory as errors')
+    args = parser.parse_args()
+
+    from utils.logging_utils import configure_logging
+    configure_logging()
+    try:
+        summary = run_batch(args.source, args.output, args.selfie_dir, args.workers, args.chunk_size, args.root)
+    except BaseException as e:
+        summary = {'aborted': f'{type(e).__name__}: {e}'}
+        raise
+    finally:
+        if args.summary:
+            with open(args.summary, 'w') as f:
+                json.dump(summary, f)
+    print(json.dumps(summary))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Face embedding backends.
+
+embed_faces in verification/face_match.py hands aligned face crops to the
+backend selected by FACE_EMBEDDING_BACKEND:
+
+- 'deepface': DeepFace's Keras model for FACE_MODEL_NAME, on TensorFlow.
+- 'onnx' / 'onnx-int8': the same weights exported to ONNX (fp32, or with
+  int8-quantized weights) by utils/convert_face_model.py, on ONNX Runtime.
+  The Keras model is never built, and TensorFlow is not imported for
+  embedding.
+
+All backends take float32 BGR crops in [0, 1] resized to input_shape and
+return raw (unnormalised) embeddings. Embeddings from different backends are
+close but not identical, so a document and a selfie are always embedded by
+the same backend in a deployment.
+"""
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Tuple
+
+import numpy as np
+
+from config import FACE_MODEL_NAME, FACE_EMBEDDING_BACKEND, FACE_ONNX_DIR, FACE_ONNX_THREADS
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBackend(ABC):
+    """
+    Interface of an embedding backend.
+    """
+    name = None
+
+    @property
+    @abstractmethod
+    def input_shape(self) -> Tuple[int, int]:
+        """
+        (height, width) of the face crops the model takes.
+        """
+
+    @abstractmethod
+    def embed(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Embed a (n, height, width, 3) float32 batch.
+
+        Returns:
+            np.ndarray: (n, dim) float32 embeddings
+        """
+
+class DeepFaceBackend(EmbeddingBackend):
+    name = 'deepface'
+
+    def __init__(self, model_name: str = FACE_MODEL_NAME):
+        from deepface import DeepFace
+        self.model = DeepFace.build_model(model_name)
+
+    @property
+    def input_shape(self) -> Tuple[int, int]:
+        return tuple(self.model.input_shape)
+
+    def embed(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.model(batch, training=False), dtype=np.float32)
+
+def onnx_model_path(model_name: str = FACE_MODEL_NAME, quantized: bool = False, model_dir: str = FACE_ONNX_DIR) -> str:
+    suffix = '.int8.onnx' if quantized else '.onnx'
+    return os.path.join(model_dir, model_name.lower() + suffix)
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    A converted model on ONNX Runtime's CPU execution provider.
+    """
+
+    def __init__(self, model_path: str, intra_op_threads: int = FACE_ONNX_THREADS, name: str = 'onnx'):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f'{model_path} not found; create it with utils/convert_face_model.py')
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        # NHWC, as exported from Keras; the batch dimension is dynamic
+        self._input_shape = tuple(self.session.get_inputs()[0].shape[1:3])
+        self.name = name
+        logger.info("Loaded ONNX face model %s (%d intra-op threads)", model_path, intra_op_threads)
+
+    @property
+    def input_shape(self) -> Tuple[int, int]:
+        return self._input_shape
+
+    def embed(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.session.run(None, {self.input_name: batch})[0], dtype=np.float32)
+
+def create_embedding_backend(name: str = FACE_EMBEDDING_BACKEND) -> EmbeddingBackend:
+    """
+    Build the named backend.
+
+    Raises:
+        ValueError: If the name is not a known backend
+        FileNotFoundError: If an ONNX backend's model has not been converted
+    """
+    if name == 'deepface':
+        return DeepFaceBackend()
+    if name in ('onnx', 'onnx-int8'):
+        return OnnxBackend(onnx_model_path(quantized=name == 'onnx-int8'), name=name)
+    raise ValueError(f'Unknown face embedding backend: {name}')
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_embedding_backend() -> EmbeddingBackend:
+    """
+    The process-wide backend selected by FACE_EMBEDDING_BACKEND, built on first use.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            # Concurrent first requests must not each load the model
+            if _backend is None:
+                _backend = create_embedding_backend()
+    return _backend
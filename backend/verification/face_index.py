@@ -0,0 +1,396 @@
+"""
+Persistent index of verified selfie embeddings, to spot one face used for
+several documents.
+
+Embeddings are rows of a memory-mapped FACE_INDEX_DTYPE matrix in
+FACE_INDEX_DIR, with a parallel record array (creation time, document key,
+session id). The document key comes from the SHA-256 digest of the uploaded
+document, so re-verifying the same document is not taken for face reuse. Every process on the host maps the same files, so the pages are
+shared through the page cache and never copied into a worker's heap.
+
+A search is one matrix-vector product per block of rows. Once compaction has
+seen FACE_INDEX_IVF_MIN_ROWS rows it clusters them (spherical k-means) and
+stores them sorted by cluster, so a search only scans the FACE_INDEX_IVF_NPROBE
+clusters nearest to the query plus the rows appended since. Entries older
+than FACE_INDEX_TTL_SECONDS are ignored by searches and dropped by compaction.
+
+Files, where <gen> is bumped by each compaction:
+    index.json       dimension and dtype, fixed when the index is created
+    header           int64 [generation, count, capacity, ivf_rows]
+    vectors.<gen>    (capacity, dim) embeddings, L2-normalised
+    meta.<gen>       (capacity,) META_DTYPE records
+    ivf.<gen>.npz    cluster centroids and row offsets, if clustered
+    lock             flock'd by writers (exclusive) and header readers (shared)
+    compact.lock     flock'd by a compaction for its whole run
+
+Appends only ever write rows past count and publish them by raising count,
+so searches read rows without holding the lock.
+
+    cd backend && python -m verification.face_index stats|compact
+"""
+import argparse
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import numpy as np
+
+from config import (FACE_INDEX_ENABLED, FACE_INDEX_DIR, FACE_INDEX_DTYPE, FACE_INDEX_TTL_SECONDS,
+                    FACE_INDEX_REUSE_THRESHOLD, FACE_INDEX_TOP_K, FACE_INDEX_IVF_MIN_ROWS, FACE_INDEX_IVF_NPROBE)
+
+logger = logging.getLogger(__name__)
+
+META_DTYPE = np.dtype([('created', '<f8'), ('doc_key', '<u8'), ('session', 'S32')])
+GENERATION, COUNT, CAPACITY, IVF_ROWS = range(4)
+INITIAL_CAPACITY = 4096
+SEARCH_BLOCK_ROWS = 65536
+CANDIDATE_SLACK = 16  # Extra candidates per block, for results dropped as expired or same-session
+KMEANS_SAMPLE_ROWS = 50_000
+KMEANS_ITERATIONS = 10
+
+def document_key(doc_digest: str) -> int:
+    """
+    Stable key of a document, from the SHA-256 hex digest of its upload. Lets
+    a re-verification of the same document be told apart from a new one; the
+    face embedding cannot, as it varies with the backend, detector tier and
+    batch it was computed in.
+    """
+    return int(doc_digest[:16], 16)
+
+def train_centroids(sample: np.ndarray, nlist: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means over L2-normalised rows; returns (nlist, dim) unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Clusters that lost every row keep their previous centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids
+
+class FaceIndex:
+    """
+    Append, search and compact the on-disk embedding index.
+    """
+
+    def __init__(self, path: str = FACE_INDEX_DIR, dtype: str = FACE_INDEX_DTYPE,
+                 ttl_seconds: float = FACE_INDEX_TTL_SECONDS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.ttl_seconds = ttl_seconds
+        self.dim = None
+        self._lock_fd = None
+        self._pid = None
+        # flock cannot tell this process's threads apart
+        self._write_lock = threading.Lock()
+        self._mapped = None  # (generation, capacity) of the maps below
+        self._vectors = None
+        self._meta = None
+        self._ivf = None
+        with self._locked(exclusive=True):
+            self._init_files()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        # A forked child shares its parent's open file description, and with
+        # it any flock; each process opens its own
+        if self._pid != os.getpid():
+            self._lock_fd = os.open(self._file('lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        if exclusive:
+            self._write_lock.acquire()
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            if exclusive:
+                self._write_lock.release()
+
+    def _init_files(self):
+        if os.path.exists(self._file('index.json')):
+            with open(self._file('index.json')) as f:
+                info = json.load(f)
+            if np.dtype(info['dtype']) != self.dtype:
+                raise ValueError(f'Face index at {self.path} stores {info["dtype"]}, not {self.dtype}')
+            self.dim = info['dim']
+        if not os.path.exists(self._file('header')):
+            np.zeros(4, dtype=np.int64).tofile(self._file('header'))
+        self._header = np.memmap(self._file('header'), dtype=np.int64, mode='r+', shape=(4,))
+
+    def _create(self, dim: int):
+        with open(self._file('index.json'), 'w') as f:
+            json.dump({'dim': dim, 'dtype': self.dtype.name}, f)
+        self.dim = dim
+
+    def _resize_files(self, generation: int, capacity: int):
+        for name, row_bytes in ((f'vectors.{generation}', self.dim * self.dtype.itemsize),
+                                (f'meta.{generation}', META_DTYPE.itemsize)):
+            with open(self._file(name), 'ab') as f:
+                f.truncate(capacity * row_bytes)
+
+    def _map(self):
+        """
+        (Re)map the current generation's files if the header moved on.
+        Call with the lock held.
+        """
+        generation, capacity = int(self._header[GENERATION]), int(self._header[CAPACITY])
+        if self._mapped == (generation, capacity):
+            return
+        if self.dim is None and os.path.exists(self._file('index.json')):
+            self._init_files()
+        if capacity:
+            self._vectors = np.memmap(self._file(f'vectors.{generation}'), dtype=self.dtype, mode='r+',
+                                      shape=(capacity, self.dim))
+            self._meta = np.memmap(self._file(f'meta.{generation}'), dtype=META_DTYPE, mode='r+', shape=(capacity,))
+        ivf_path = self._file(f'ivf.{generation}.npz')
+        self._ivf = None
+        if os.path.exists(ivf_path):
+            with np.load(ivf_path) as ivf:
+                self._ivf = (ivf['centroids'], ivf['offsets'])
+        self._mapped = (generation, capacity)
+
+    def __len__(self) -> int:
+        return int(self._header[COUNT])
+
+    def add(self, embedding: np.ndarray, session_id: str, doc_key: int = 0, created: Optional[float] = None):
+        """
+        Append an L2-normalised embedding for a verified session.
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._locked(exclusive=True):
+            if self.dim is None:
+                self._create(len(embedding))
+            elif len(embedding) != self.dim:
+                raise ValueError(f'Embedding has {len(embedding)} dimensions, the index {self.dim}')
+            generation, count, capacity = (int(v) for v in self._header[:IVF_ROWS])
+            if count == capacity:
+                capacity = max(INITIAL_CAPACITY, capacity * 2)
+                self._resize_files(generation, capacity)
+                self._header[CAPACITY] = capacity
+            self._map()
+            self._vectors[count] = embedding
+            self._meta[count] = (created or time.time(), doc_key, session_id.encode('ascii'))
+            # Publish the row only once it is written
+            self._header[COUNT] = count + 1
+
+    def _ranges(self, query: np.ndarray, count: int, ivf_rows: int, nprobe: int):
+        if self._ivf is None or not ivf_rows:
+            return [(0, count)]
+        centroids, offsets = self._ivf
+        nprobe = min(nprobe, len(centroids))
+        clusters = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        ranges = [(int(offsets[c]), int(offsets[c + 1])) for c in clusters]
+        ranges.append((ivf_rows, count))  # Appended since the last compaction
+        return ranges
+
+    def search(self, embedding: np.ndarray, k: int = FACE_INDEX_TOP_K, exclude_session: Optional[str] = None,
+               nprobe: int = FACE_INDEX_IVF_NPROBE) -> List[dict]:
+        """
+        The k most similar unexpired entries.
+
+        Returns:
+            List[dict]: {'session_id', 'doc_key', 'created', 'distance'} by
+            increasing cosine distance
+        """
+        with self._locked(exclusive=False):
+            count, ivf_rows = int(self._header[COUNT]), int(self._header[IVF_ROWS])
+            self._map()
+            vectors, meta = self._vectors, self._meta
+        if not count:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+
+        scores, rows = [], []
+        for start, stop in self._ranges(query, count, ivf_rows, nprobe):
+            for block_start in range(start, stop, SEARCH_BLOCK_ROWS):
+                block_stop = min(stop, block_start + SEARCH_BLOCK_ROWS)
+                block_scores = vectors[block_start:block_stop].astype(np.float32) @ query
+                take = min(len(block_scores), k + CANDIDATE_SLACK)
+                top = np.argpartition(-block_scores, take - 1)[:take]
+                scores.append(block_scores[top])
+                rows.append(top + block_start)
+        if not scores:
+            return []
+        scores = np.concatenate(scores)
+        rows = np.concatenate(rows)
+
+        cutoff = time.time() - self.ttl_seconds
+        exclude = exclude_session.encode('ascii') if exclude_session else None
+        results = []
+        for i in np.argsort(-scores):
+            record = meta[rows[i]]
+            if record['created'] < cutoff or record['session'] == exclude:
+                continue
+            results.append({'session_id': record['session'].decode('ascii'), 'doc_key': int(record['doc_key']),
+                            'created': float(record['created']), 'distance': float(1.0 - scores[i])})
+            if len(results) == k:
+                break
+        return results
+
+    def compact(self, nlist: Optional[int] = None) -> dict:
+        """
+        Rewrite the index without expired entries, clustered and sorted by
+        cluster once it is large enough. Searches and appends carry on
+        meanwhile; appends made during the rewrite are carried over.
+
+        Raises:
+            RuntimeError: If another compaction of the index is running
+        """
+        with open(self._file('compact.lock'), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError('Face index is already being compacted')
+            # Held until the new generation is published, so no other
+            # compaction writes the same generation's files
+            return self._compact(nlist)
+
+    def _compact(self, nlist: Optional[int]) -> dict:
+        with self._locked(exclusive=False):
+            generation, count = int(self._header[GENERATION]), int(self._header[COUNT])
+            self._map()
+            vectors, meta = self._vectors, self._meta
+        if not count:
+            return {'rows': 0, 'dropped': 0, 'clusters': 0}
+
+        keep = np.flatnonzero(meta['created'][:count] >= time.time() - self.ttl_seconds)
+        ivf = None
+        if len(keep) >= FACE_INDEX_IVF_MIN_ROWS:
+            nlist = nlist or int(math.sqrt(len(keep)))
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(keep, min(len(keep), KMEANS_SAMPLE_ROWS), replace=False))
+            centroids = train_centroids(vectors[sample_rows].astype(np.float32), nlist)
+            clusters = np.concatenate([
+                np.argmax(vectors[keep[i:i + SEARCH_BLOCK_ROWS]].astype(np.float32) @ centroids.T, axis=1)
+                for i in range(0, len(keep), SEARCH_BLOCK_ROWS)])
+            order = np.argsort(clusters, kind='stable')
+            keep = keep[order]
+            offsets = np.searchsorted(clusters[order], np.arange(nlist + 1))
+            ivf = (centroids, offsets)
+
+        new_generation = generation + 1
+        capacity = max(INITIAL_CAPACITY, 2 * len(keep))
+        self._resize_files(new_generation, capacity)
+        new_vectors = np.memmap(self._file(f'vectors.{new_generation}'), dtype=self.dtype, mode='r+',
+                                shape=(capacity, self.dim))
+        new_meta = np.memmap(self._file(f'meta.{new_generation}'), dtype=META_DTYPE, mode='r+', shape=(capacity,))
+        for i in range(0, len(keep), SEARCH_BLOCK_ROWS):
+            block = keep[i:i + SEARCH_BLOCK_ROWS]
+            new_vectors[i:i + len(block)] = vectors[block]
+            new_meta[i:i + len(block)] = meta[block]
+        if ivf is not None:
+            np.savez(self._file(f'ivf.{new_generation}.npz'), centroids=ivf[0], offsets=ivf[1])
+
+        with self._locked(exclusive=True):
+            if int(self._header[GENERATION]) != generation:
+                raise RuntimeError('Face index was compacted concurrently')
+            # Carry over rows appended during the rewrite
+            appended = int(self._header[COUNT]) - count
+            self._map()
+            total = len(keep) + appended
+            if total > capacity:
+                capacity = 2 * total
+                self._resize_files(new_generation, capacity)
+                new_vectors = np.memmap(self._file(f'vectors.{new_generation}'), dtype=self.dtype, mode='r+',
+                                        shape=(capacity, self.dim))
+                new_meta = np.memmap(self._file(f'meta.{new_generation}'), dtype=META_DTYPE, mode='r+',
+                                     shape=(capacity,))
+            new_vectors[len(keep):total] = self._vectors[count:count + appended]
+            new_meta[len(keep):total] = self._meta[count:count + appended]
+            new_vectors.flush()
+            new_meta.flush()
+            self._header[:] = (new_generation, total, capacity, len(keep) if ivf is not None else 0)
+            self._header.flush()
+        # Processes still mapping the old files keep them until they remap
+        for name in (f'vectors.{generation}', f'meta.{generation}', f'ivf.{generation}.npz'):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        stats = {'rows': total, 'dropped': count - len(keep), 'clusters': len(ivf[0]) if ivf is not None else 0}
+        logger.info("Compacted face index: %s", stats)
+        return stats
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_face_index() -> FaceIndex:
+    """
+    This process's handle on the shared index, opened on first use.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = FaceIndex()
+    return _index
+
+def check_face_reuse(selfie_embedding: np.ndarray, session_id: str, doc_digest: Optional[str]) -> List[dict]:
+    """
+    Find earlier sessions whose selfie matches this one for a different
+    document, then add this selfie to the index.
+
+    Args:
+        doc_digest: SHA-256 hex digest of the session's document upload
+
+    Returns:
+        List[dict]: The matching entries (see FaceIndex.search); empty if none,
+        if the index is disabled or unavailable, or without a document digest
+    """
+    if not FACE_INDEX_ENABLED:
+        return []
+    if not doc_digest:
+        logger.warning("No document digest for session %s, face reuse not checked", session_id)
+        return []
+    from utils.logging_utils import log_failure
+    from utils.metrics import increment, timed
+
+    try:
+        index = get_face_index()
+        doc_key = document_key(doc_digest)
+        with timed('face_index_search'):
+            matches = [m for m in index.search(selfie_embedding, exclude_session=session_id)
+                       if m['distance'] <= FACE_INDEX_REUSE_THRESHOLD and m['doc_key'] != doc_key]
+        index.add(selfie_embedding, session_id, doc_key)
+    except Exception as e:
+        logger.error("Face index unavailable: %s", e)
+        return []
+    if matches:
+        increment('altid_face_reuse_flagged_total')
+        log_failure('Face reused across sessions', {
+            'session_id': session_id,
+            'matching_sessions': [m['session_id'] for m in matches],
+            'min_distance': round(matches[0]['distance'], 4),
+        })
+    return matches
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or compact the face index')
+    parser.add_argument('command', choices=['stats', 'compact'])
+    parser.add_argument('--nlist', type=int, help='IVF clusters (default: sqrt of the row count)')
+    args = parser.parse_args()
+
+    index = FaceIndex()
+    if args.command == 'compact':
+        print(json.dumps(index.compact(args.nlist)))
+    else:
+        with index._locked(exclusive=False):
+            generation, count, capacity, ivf_rows = (int(v) for v in index._header)
+        print(json.dumps({'generation': generation, 'rows': count, 'capacity': capacity,
+                          'clustered_rows': ivf_rows, 'dim': index.dim, 'dtype': index.dtype.name}))
+
+if __name__ == '__main__':
+    main()
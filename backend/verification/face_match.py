@@ -1,95 +1,247 @@
 import cv2
 import numpy as np
-from deepface import DeepFace
 import logging
-from typing import Tuple, Optional
-import os
+from typing import List, Tuple, Optional, Union
+
+from config import FACE_DETECTOR_CASCADE, FACE_DETECTOR_MIN_CONFIDENCE, FACE_MATCH_THRESHOLD, FACE_INFERENCE_ADDRESS
+from verification.face_embedding import EmbeddingBackend, get_embedding_backend
+from utils.metrics import increment, timed
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def preprocess_image(image_path: str, target_size: Tuple[int, int] = (160, 160)) -> Optional[np.ndarray]:
+ImageInput = Union[str, np.ndarray]
+
+DETECTOR_TIER_COUNTER = 'altid_face_detector_tier_total'
+
+def _deepface():
+    # Imported on first use so that processes delegating to the inference
+    # service never load TensorFlow
+    from deepface import DeepFace
+    return DeepFace
+
+def _resize_face(face: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
     """
-    Load and preprocess an image for face recognition.
-    Returns preprocessed image or None if loading fails.
+    Fit a face crop into the model input size, keeping its aspect ratio and
+    zero-padding the remainder (the same layout DeepFace.represent uses).
     """
+    target_h, target_w = target_size
+    scale = min(target_h / face.shape[0], target_w / face.shape[1])
+    resized = cv2.resize(face, (max(1, int(face.shape[1] * scale)), max(1, int(face.shape[0] * scale))))
+    pad_h = target_h - resized.shape[0]
+    pad_w = target_w - resized.shape[1]
+    return np.pad(resized, ((pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2), (0, 0)))
+
+def _run_detector(image: ImageInput, detector_backend: str) -> List[dict]:
     try:
-        # Read image
-        if not os.path.exists(image_path):
-            logger.error(f"Image file not found: {image_path}")
-            return None
-            
-        img = cv2.imread(image_path)
-        if img is None:
-            logger.error(f"Failed to load image: {image_path}")
+        face_objs = _deepface().extract_faces(
+            img_path=image,
+            detector_backend=detector_backend,
+            enforce_detection=True,  # Will raise exception if no face is detected
+            align=True  # Align faces before embedding
+        )
+    except ValueError as ve:
+        if 'Face could not be detected' not in str(ve):
+            logger.error("Face detection error (%s): %s", detector_backend, ve)
+        return []
+    return sorted(face_objs, key=lambda f: f.get('confidence') or 0, reverse=True)
+
+@timed('face_detection')
+def detect_faces_with_tier(image: ImageInput, cascade: List[str] = FACE_DETECTOR_CASCADE,
+                           count: bool = True) -> Tuple[List[np.ndarray], Optional[str]]:
+    """
+    Detect and align the faces in an image using the detector cascade.
+
+    Each detector except the last decides the request only if it finds exactly
+    one face with at least its FACE_DETECTOR_MIN_CONFIDENCE; otherwise the
+    next, more expensive detector runs.
+
+    Args:
+        image: Path to an image file or a BGR numpy array
+        cascade: Detector backends to try, cheapest first
+        count: Whether to count the deciding tier in DETECTOR_TIER_COUNTER;
+            off for warm-up runs and for the inference service, whose
+            clients count the tier it returns
+
+    Returns:
+        Tuple[List[np.ndarray], Optional[str]]: BGR float face crops in [0, 1],
+        most confident first (empty if no face was found), and the detector
+        that decided the request
+    """
+    face_objs, tier = [], None
+    for i, tier in enumerate(cascade):
+        face_objs = _run_detector(image, tier)
+        if i == len(cascade) - 1:
+            break
+        min_confidence = FACE_DETECTOR_MIN_CONFIDENCE.get(tier, 0.0)
+        if len(face_objs) == 1 and (face_objs[0].get('confidence') or 0) >= min_confidence:
+            break
+        logger.debug("Detector %s found %d faces, escalating", tier, len(face_objs))
+
+    if count:
+        increment(DETECTOR_TIER_COUNTER, tier=tier)
+    if not face_objs:
+        logger.error("No face detected in image (decided by %s)", tier)
+        return [], tier
+    logger.debug("Detected %d faces with %s", len(face_objs), tier)
+    # extract_faces returns RGB crops; the recognition models expect BGR
+    return [f['face'][:, :, ::-1] for f in face_objs], tier
+
+def detect_faces(image: ImageInput) -> List[np.ndarray]:
+    """
+    Detect and align the faces in an image.
+
+    Args:
+        image: Path to an image file or a BGR numpy array
+
+    Returns:
+        List[np.ndarray]: BGR float face crops in [0, 1], most confident first.
+        Empty if no face was found.
+    """
+    return detect_faces_with_tier(image)[0]
+
+@timed('face_embedding')
+def embed_faces(faces: List[np.ndarray], backend: Optional[EmbeddingBackend] = None) -> np.ndarray:
+    """
+    Embed a batch of aligned face crops in a single forward pass.
+
+    Args:
+        faces: Face crops as returned by detect_faces
+        backend: Embedding backend, FACE_EMBEDDING_BACKEND's by default
+
+    Returns:
+        np.ndarray: (len(faces), dim) float32 matrix of L2-normalised embeddings
+    """
+    backend = backend or get_embedding_backend()
+    batch = np.stack([_resize_face(face, backend.input_shape) for face in faces]).astype(np.float32)
+    embeddings = backend.embed(batch)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+def get_face_embeddings(image: ImageInput) -> Optional[np.ndarray]:
+    """
+    Detect, align and embed every face found in an image.
+
+    When FACE_INFERENCE_ADDRESS is configured the work is delegated to the
+    shared inference service, otherwise it runs in this process.
+
+    Args:
+        image: Path to an image file or a BGR numpy array
+
+    Returns:
+        Optional[np.ndarray]: (n_faces, dim) float32 matrix of L2-normalised
+        embeddings, ordered by detector confidence, or None if no face was found
+    """
+    if FACE_INFERENCE_ADDRESS:
+        from verification.inference_server import get_client
+        with timed('face_inference'):
+            embeddings, tier = get_client().embed(image)
+        increment(DETECTOR_TIER_COUNTER, tier=tier)
+        return embeddings
+
+    faces = detect_faces(image)
+    if not faces:
+        return None
+    return embed_faces(faces)
+
+def get_face_embedding(image: ImageInput) -> Optional[np.ndarray]:
+    """
+    Embed the most confidently detected face in an image.
+
+    Args:
+        image: Path to an image file or a BGR numpy array
+
+    Returns:
+        Optional[np.ndarray]: L2-normalised float32 embedding, or None if no face was found
+    """
+    embeddings = get_face_embeddings(image)
+    if embeddings is None:
+        return None
+    return embeddings[0]
+
+def cosine_distances(reference: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    Cosine distance between one L2-normalised embedding and a matrix of them.
+
+    Args:
+        reference: (dim,) embedding
+        candidates: (n, dim) embeddings
+
+    Returns:
+        np.ndarray: (n,) distances in [0, 2]
+    """
+    return 1.0 - candidates @ reference
+
+def match_selfie_face(doc_embedding: np.ndarray, selfie_image: ImageInput,
+                      threshold: float = FACE_MATCH_THRESHOLD) -> Optional[np.ndarray]:
+    """
+    Find the face in a selfie that matches a precomputed document face embedding.
+
+    Args:
+        doc_embedding: L2-normalised embedding of the ID document face
+        selfie_image: Path to the selfie image or a BGR numpy array
+        threshold: Maximum cosine distance for a match, lower is more strict
+
+    Returns:
+        Optional[np.ndarray]: Embedding of the closest selfie face if it
+        matches, None otherwise or on error
+    """
+    try:
+        selfie_embeddings = get_face_embeddings(selfie_image)
+        if selfie_embeddings is None:
             return None
-            
-        # Convert BGR to RGB (DeepFace expects RGB)
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Resize if needed
-        if img_rgb.shape[0] != target_size[0] or img_rgb.shape[1] != target_size[1]:
-            img_rgb = cv2.resize(img_rgb, target_size, interpolation=cv2.INTER_AREA)
-            
-        return img_rgb
-        
+
+        distances = cosine_distances(doc_embedding, selfie_embeddings)
+        closest = int(distances.argmin())
+        distance = float(distances[closest])
+        is_verified = distance <= threshold
+
+        logger.info("Faces %s. Distance: %.4f, Threshold: %s",
+                    'match' if is_verified else 'do not match', distance, threshold)
+
+        return selfie_embeddings[closest] if is_verified else None
+
     except Exception as e:
-        logger.error(f"Error preprocessing image {image_path}: {str(e)}")
+        logger.error("Error during face matching: %s", e)
         return None
 
-def match_faces(id_image_path: str, selfie_image_path: str, threshold: float = 0.6) -> bool:
+def match_face_embedding(doc_embedding: np.ndarray, selfie_image: ImageInput,
+                         threshold: float = FACE_MATCH_THRESHOLD) -> bool:
     """
-    Compare faces in two images using DeepFace.
-    
+    Compare a precomputed document face embedding against the faces in a selfie.
+
+    Returns:
+        bool: True if any face in the selfie matches, False otherwise or on error
+    """
+    return match_selfie_face(doc_embedding, selfie_image, threshold) is not None
+
+def match_faces(id_image_path: str, selfie_image_path: str, threshold: float = FACE_MATCH_THRESHOLD) -> bool:
+    """
+    Compare faces in two images.
+
     Args:
         id_image_path: Path to the ID document image
         selfie_image_path: Path to the selfie image
-        threshold: Similarity threshold (0-1), lower is more strict
-        
+        threshold: Maximum cosine distance for a match, lower is more strict
+
     Returns:
         bool: True if faces match, False otherwise or on error
     """
-    try:
-        logger.info(f"Starting face match between {id_image_path} and {selfie_image_path}")
-        
-        # Preprocess images
-        id_img = preprocess_image(id_image_path)
-        selfie_img = preprocess_image(selfie_image_path)
-        
-        if id_img is None or selfie_img is None:
-            logger.error("Failed to preprocess one or both images")
+    from verification.image_ingest import decode_bgr
+
+    logger.debug("Starting face match between %s and %s", id_image_path, selfie_image_path)
+
+    # Decoded once at detection resolution rather than by DeepFace at full size
+    images = []
+    for path in (id_image_path, selfie_image_path):
+        with open(path, 'rb') as f:
+            image = decode_bgr(f.read())
+        if image is None:
             return False
-            
-        # Verify faces using DeepFace
-        result = DeepFace.verify(
-            img1_path=id_image_path,
-            img2_path=selfie_image_path,
-            model_name='Facenet',  # Good balance of speed and accuracy
-            detector_backend='retinaface',  # Good at detecting faces in various conditions
-            distance_metric='cosine',
-            enforce_detection=True,  # Will raise exception if no face is detected
-            align=True  # Align faces before comparison
-        )
-        
-        # Log detailed results
-        logger.info(f"Face match result: {result}")
-        
-        # Check if faces are similar enough
-        is_verified = result.get('verified', False)
-        distance = result.get('distance', 1.0)
-        
-        logger.info(f"Faces {'match' if is_verified else 'do not match'}. Distance: {distance:.4f}, Threshold: {threshold}")
-        
-        return is_verified
-        
-    except ValueError as ve:
-        if 'Face could not be detected' in str(ve):
-            logger.error("No face detected in one or both images")
-        else:
-            logger.error(f"Face detection error: {str(ve)}")
+        images.append(image)
+
+    doc_embedding = get_face_embedding(images[0])
+    if doc_embedding is None:
+        logger.error("Failed to embed face in ID image")
         return False
-        
-    except Exception as e:
-        logger.error(f"Error during face matching: {str(e)}")
-        return False
\ No newline at end of file
+
+    return match_face_embedding(doc_embedding, images[1], threshold)
@@ -0,0 +1,114 @@
+"""
+Shared image ingest: decode uploads once, at the resolution the consumer needs.
+
+Phone selfies are often 12+ MP while the face detectors and OCR work at a
+fraction of that. JPEGs are decoded with PIL's draft mode, which lets libjpeg
+scale by 1/2, 1/4 or 1/8 during the DCT, so the full-size bitmap is never
+built. EXIF orientation is applied once, the result is capped at
+INGEST_MAX_PIXELS, and the same image is handed to OCR and to the face
+pipeline. Images larger than INGEST_MAX_SOURCE_PIXELS are refused before
+decoding.
+"""
+import io
+import logging
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from config import INGEST_MAX_PIXELS, INGEST_MAX_SOURCE_PIXELS, FACE_INGEST_MAX_SIDE
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+EXIF_ORIENTATION = 0x0112
+# Orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+def _display_size(image: Image.Image) -> Tuple[int, int]:
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION, 1) in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+def _scale(size: Tuple[int, int], max_side: Optional[int], width: Optional[int], max_pixels: int) -> float:
+    w, h = size
+    scale = 1.0
+    if max_side:
+        scale = min(scale, max_side / max(w, h))
+    if width:
+        scale = min(scale, width / w)
+    return min(scale, math.sqrt(max_pixels / (w * h)))
+
+@timed('image_decode')
+def normalize_image(image: Image.Image, max_side: Optional[int] = None, width: Optional[int] = None,
+                    max_pixels: int = INGEST_MAX_PIXELS, mode: str = 'RGB',
+                    resample: int = Image.BILINEAR) -> Image.Image:
+    """
+    Decode (if not yet loaded), downscale and orient an opened image.
+
+    Args:
+        image: Image from Image.open; JPEGs not yet loaded are decoded in draft mode
+        max_side: Longest side of the result, in pixels
+        width: Width of the result, in pixels
+        max_pixels: Upper bound on the result's pixel count
+        mode: PIL mode of the result
+        resample: Resampling filter for the final resize (LANCZOS for OCR)
+
+    Returns:
+        Image.Image: Upright image no larger than requested (never upscaled)
+    """
+    display_size = _display_size(image)
+    scale = _scale(display_size, max_side, width, max_pixels)
+    target = (max(1, round(display_size[0] * scale)), max(1, round(display_size[1] * scale)))
+    # Scale in stored orientation and rotate last, so the rotation only
+    # touches the downscaled pixels
+    stored_target = target if display_size == image.size else target[::-1]
+    if scale < 1 and image.format == 'JPEG':
+        # Picks the smallest DCT scale that is still at least this size
+        image.draft(mode if mode in ('RGB', 'L') else 'RGB', stored_target)
+
+    if image.mode != mode:
+        image = image.convert(mode)
+    if scale < 1 and image.size != stored_target:
+        image = image.resize(stored_target, resample, reducing_gap=3.0)
+    return ImageOps.exif_transpose(image)
+
+def open_image(data: bytes, max_side: Optional[int] = None, width: Optional[int] = None,
+               max_pixels: int = INGEST_MAX_PIXELS, mode: str = 'RGB', resample: int = Image.BILINEAR) -> Image.Image:
+    """
+    Decode encoded image bytes (JPEG, PNG, ...) at a working resolution.
+    See normalize_image for the arguments.
+
+    Raises:
+        ValueError: If the image is larger than INGEST_MAX_SOURCE_PIXELS
+        PIL.UnidentifiedImageError: If the bytes are not a decodable image
+    """
+    image = Image.open(io.BytesIO(data))
+    if image.width * image.height > INGEST_MAX_SOURCE_PIXELS:
+        raise ValueError(f'Image too large: {image.width}x{image.height}')
+    return normalize_image(image, max_side, width, max_pixels, mode, resample)
+
+def to_bgr(image: Image.Image) -> np.ndarray:
+    """
+    Convert a decoded PIL image to the BGR array the face backend expects.
+    """
+    return np.ascontiguousarray(np.asarray(image.convert('RGB'))[:, :, ::-1])
+
+def decode_bgr(data: bytes, max_side: int = FACE_INGEST_MAX_SIDE) -> Optional[np.ndarray]:
+    """
+    Decode image bytes for face detection. Returns None if the bytes are not a
+    decodable image.
+    """
+    try:
+        return to_bgr(open_image(data, max_side=max_side))
+    except Exception as e:
+        logger.error("Failed to decode image: %s", e)
+        return None
+
+def face_input(image: Image.Image, max_side: int = FACE_INGEST_MAX_SIDE) -> np.ndarray:
+    """
+    BGR array for face detection from an already opened image.
+    """
+    return to_bgr(normalize_image(image, max_side=max_side))
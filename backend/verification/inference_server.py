@@ -0,0 +1,284 @@
+"""
+Long-lived local face inference service.
+
+Loads the detector and recognition model once and serves embedding jobs to
+the web workers over a local socket. Detection runs on one thread per
+connection; the aligned faces from concurrent jobs are then grouped into
+small batches so that the recognition model runs one forward pass per batch
+instead of one per request.
+
+Run from the backend directory:
+
+    ALTID_FACE_INFERENCE_ADDRESS=/run/altid/face.sock python -m verification.inference_server
+
+and start the web workers, as the same user, with the same
+ALTID_FACE_INFERENCE_ADDRESS.
+
+Requests are pickled, so a peer that authenticates can run code in the
+service. The supported transport is a unix socket, created with 0600
+permissions; unless ALTID_FACE_INFERENCE_AUTHKEY is set, the service writes a
+random key to <socket>.key (also 0600) at startup and clients read it from
+there. A TCP address is only served with an ALTID_FACE_INFERENCE_AUTHKEY of
+at least FACE_INFERENCE_MIN_AUTHKEY_BYTES bytes.
+"""
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from config import (FACE_INFERENCE_ADDRESS, FACE_INFERENCE_AUTHKEY, FACE_INFERENCE_MIN_AUTHKEY_BYTES,
+                    FACE_BATCH_MAX_SIZE, FACE_BATCH_MAX_WAIT_MS)
+
+logger = logging.getLogger(__name__)
+
+Address = Union[str, Tuple[str, int]]
+
+def parse_address(address: str) -> Address:
+    """
+    Turn 'host:port' into a TCP address and anything else into a unix socket path.
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and not address.startswith('/'):
+        return host, int(port)
+    return address
+
+def authkey_path(address: str) -> str:
+    """
+    Where the service publishes the generated key of a unix socket.
+    """
+    return f'{address}.key'
+
+def server_authkey(address: Address, authkey: Optional[bytes] = FACE_INFERENCE_AUTHKEY) -> bytes:
+    """
+    The key the service accepts. Without a configured key, a unix socket gets
+    a random one, written 0600 to authkey_path for the clients.
+
+    Raises:
+        ValueError: For a TCP address without a configured key of at least
+            FACE_INFERENCE_MIN_AUTHKEY_BYTES bytes
+    """
+    if authkey is not None and len(authkey) < FACE_INFERENCE_MIN_AUTHKEY_BYTES:
+        raise ValueError(f'ALTID_FACE_INFERENCE_AUTHKEY must be at least {FACE_INFERENCE_MIN_AUTHKEY_BYTES} bytes')
+    if not isinstance(address, str):
+        if authkey is None:
+            raise ValueError('A TCP inference address requires ALTID_FACE_INFERENCE_AUTHKEY')
+        return authkey
+    if authkey is not None:
+        return authkey
+    authkey = secrets.token_bytes(32)
+    path = authkey_path(address)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+    return authkey
+
+def client_authkey(address: Address, authkey: Optional[bytes] = FACE_INFERENCE_AUTHKEY) -> bytes:
+    """
+    The configured key, or the one a unix socket's service published.
+    """
+    if authkey is not None:
+        return authkey
+    if not isinstance(address, str):
+        raise ValueError('A TCP inference address requires ALTID_FACE_INFERENCE_AUTHKEY')
+    with open(authkey_path(address), 'rb') as f:
+        return f.read()
+
+class EmbeddingBatcher:
+    """
+    Collects face crops from concurrent jobs and embeds them in batches.
+
+    A batch is flushed once it holds max_batch_size faces or its oldest job
+    has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, max_batch_size: int = FACE_BATCH_MAX_SIZE,
+                 max_wait_ms: float = FACE_BATCH_MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, faces: List[np.ndarray]) -> Future:
+        future = Future()
+        self._jobs.put((faces, future))
+        return future
+
+    def _run(self):
+        from verification.face_match import embed_faces
+
+        while True:
+            batch = [self._jobs.get()]
+            n_faces = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while n_faces < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._jobs.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(job)
+                n_faces += len(job[0])
+
+            try:
+                embeddings = embed_faces([face for faces, _ in batch for face in faces])
+            except Exception as e:
+                logger.error("Batch embedding failed: %s", e)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            logger.debug("Embedded %d faces from %d jobs in one batch", n_faces, len(batch))
+            offset = 0
+            for faces, future in batch:
+                future.set_result(embeddings[offset:offset + len(faces)])
+                offset += len(faces)
+
+class InferenceServer:
+    """
+    Accepts embedding jobs over a multiprocessing connection.
+
+    Each request is a dict with an 'image' (file path or BGR array) and an
+    optional 'reference' embedding. The response holds the face 'embeddings'
+    (or None if no face was found), their cosine 'distances' to the
+    reference when one was given and the 'detector' tier that decided the
+    request, or an 'error' message.
+    """
+
+    def __init__(self, address: Address, authkey: Optional[bytes] = FACE_INFERENCE_AUTHKEY,
+                 batcher: Optional[EmbeddingBatcher] = None):
+        """
+        Raises:
+            ValueError: If the address cannot be served with this key (see server_authkey)
+        """
+        self.address = address
+        self.authkey = server_authkey(address, authkey)
+        self.batcher = batcher or EmbeddingBatcher()
+
+    def handle_request(self, request: dict) -> dict:
+        from verification.face_match import cosine_distances, detect_faces_with_tier
+
+        # The client counts the deciding tier, as it does when detecting in-process
+        faces, detector = detect_faces_with_tier(request['image'], count=False)
+        if not faces:
+            return {'embeddings': None, 'distances': None, 'detector': detector}
+        embeddings = self.batcher.submit(faces).result()
+        reference = request.get('reference')
+        distances = cosine_distances(reference, embeddings) if reference is not None else None
+        return {'embeddings': embeddings, 'distances': distances, 'detector': detector}
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = self.handle_request(request)
+                except Exception as e:
+                    logger.error("Inference request failed: %s", e)
+                    response = {'error': str(e)}
+                conn.send(response)
+
+    def _listen(self) -> Listener:
+        if not isinstance(self.address, str):
+            return Listener(self.address, authkey=self.authkey)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # The socket is created 0600, so only this user's processes can connect
+        umask = os.umask(0o177)
+        try:
+            return Listener(self.address, authkey=self.authkey)
+        finally:
+            os.umask(umask)
+
+    def serve_forever(self):
+        with self._listen() as listener:
+            logger.info("Face inference service listening on %s", self.address)
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.error("Rejected inference connection: %s", e)
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+class InferenceClient:
+    """
+    Thread-safe client for InferenceServer, keeping one connection per thread.
+    """
+
+    def __init__(self, address: Address, authkey: Optional[bytes] = FACE_INFERENCE_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Read for every connection: a restarted service publishes a new key
+            conn = Client(self.address, authkey=client_authkey(self.address, self.authkey))
+            self._local.conn = conn
+        return conn
+
+    def request(self, request: dict) -> dict:
+        # Retry once on a fresh connection in case the service was restarted
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send(request)
+                response = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._local.conn = None
+                if attempt:
+                    raise
+        if 'error' in response:
+            raise RuntimeError(f"Face inference service error: {response['error']}")
+        return response
+
+    def embed(self, image, reference: Optional[np.ndarray] = None) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """
+        Returns:
+            Tuple[Optional[np.ndarray], Optional[str]]: The face embeddings (None
+            if no face was found) and the detector tier that decided the request
+        """
+        response = self.request({'image': image, 'reference': reference})
+        return response['embeddings'], response.get('detector')
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> InferenceClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = InferenceClient(parse_address(FACE_INFERENCE_ADDRESS))
+        return _client
+
+if __name__ == '__main__':
+    if not FACE_INFERENCE_ADDRESS:
+        raise SystemExit('Set ALTID_FACE_INFERENCE_ADDRESS to the socket path or host:port to listen on')
+    from utils import metrics
+    from utils.logging_utils import configure_logging
+    from verification.warmup import warm_up_face_models
+    configure_logging()
+    metrics.init()
+    try:
+        server = InferenceServer(parse_address(FACE_INFERENCE_ADDRESS))
+    except ValueError as e:
+        raise SystemExit(str(e))
+    warm_up_face_models()
+    server.serve_forever()
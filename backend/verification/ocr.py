@@ -1,7 +1,121 @@
+import threading
+from datetime import date
+from typing import Optional, Tuple
+
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageOps
+
+try:
+    import tesserocr
+except ImportError:  # Fall back to spawning the tesseract CLI through pytesseract
+    tesserocr = None
+
+from config import OCR_TARGET_WIDTH, OCR_DPI, OCR_DOB_REGIONS, OCR_DOB_WHITELIST
+from utils.metrics import timed
+
+class OcrEngine:
+    """
+    OCR engine that keeps one tesseract API handle per thread.
+
+    With tesserocr installed the handle is a PyTessBaseAPI, so no tesseract
+    process is spawned per call; without it each call goes through pytesseract.
+    Images are normalised to a fixed width and DPI before recognition.
+    """
+
+    def __init__(self, target_width: int = OCR_TARGET_WIDTH, dpi: int = OCR_DPI):
+        self.target_width = target_width
+        self.dpi = dpi
+        self._local = threading.local()
+
+    def _api(self):
+        api = getattr(self._local, 'api', None)
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(lang='eng')
+            self._local.api = api
+        return api
+
+    def normalize(self, image: Image.Image) -> Image.Image:
+        """
+        Apply EXIF orientation, convert to grayscale and scale to the target width.
+        """
+        image = ImageOps.exif_transpose(image).convert('L')
+        if image.width != self.target_width:
+            height = max(1, round(image.height * self.target_width / image.width))
+            image = image.resize((self.target_width, height), Image.LANCZOS)
+        return image
+
+    @timed('ocr')
+    def recognize(self, image: Image.Image, whitelist: Optional[str] = None, single_block: bool = False) -> str:
+        """
+        Run OCR on an already normalised image.
+
+        Args:
+            image: Normalised image from normalize()
+            whitelist: Restrict recognition to these characters
+            single_block: Treat the image as one uniform block of text
+
+        Returns:
+            str: Recognised text
+        """
+        if tesserocr is None:
+            config = f'--dpi {self.dpi}'
+            if single_block:
+                config += ' --psm 6'
+            if whitelist:
+                config += f' -c tessedit_char_whitelist={whitelist}'
+            return pytesseract.image_to_string(image, config=config)
+
+        api = self._api()
+        api.SetPageSegMode(tesserocr.PSM.SINGLE_BLOCK if single_block else tesserocr.PSM.AUTO)
+        api.SetVariable('tessedit_char_whitelist', whitelist or '')
+        api.SetVariable('user_defined_dpi', str(self.dpi))
+        api.SetImage(image)
+        return api.GetUTF8Text()
+
+    def extract_text(self, image: Image.Image) -> str:
+        return self.recognize(self.normalize(image))
+
+    def find_dob(self, image: Image.Image) -> Tuple[Optional[date], str]:
+        """
+        Find the date of birth on an ID document image.
+
+        A cheap first pass OCRs only the regions where ID layouts usually
+        print the DOB, restricted to letters, digits and date separators. A
+        date found there is only taken if a DOB label precedes it; otherwise
+        full-page OCR runs and all the dates on the page are ranked.
+
+        Args:
+            image: Decoded document image
+
+        Returns:
+            Tuple[Optional[date], str]: Date of birth if found, and the text it was found in
+        """
+        from verification.age_verification import extract_dob_from_text
+
+        page = self.normalize(image)
+        for left, top, right, bottom in OCR_DOB_REGIONS:
+            region = page.crop((round(left * page.width), round(top * page.height),
+                                round(right * page.width), round(bottom * page.height)))
+            text = self.recognize(region, whitelist=OCR_DOB_WHITELIST, single_block=True)
+            dob = extract_dob_from_text(text, require_label=True)
+            if dob:
+                return dob, text
+
+        text = self.recognize(page)
+        return extract_dob_from_text(text), text
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_ocr_engine() -> OcrEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = OcrEngine()
+        return _engine
 
-def extract_text(image_path):
-    image = Image.open(image_path)
-    text = pytesseract.image_to_string(image)
-    return text 
\ No newline at end of file
+def extract_text(image):
+    # Accept an already decoded image so callers do not decode twice
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    return get_ocr_engine().extract_text(image)
@@ -0,0 +1,88 @@
+import io
+import logging
+from datetime import date
+from typing import Iterator, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from config import PDF_MIN_PHOTO_SIDE
+from utils.metrics import timed
+from verification.age_verification import extract_dob_from_text
+
+logger = logging.getLogger(__name__)
+
+class PdfDocument:
+    """
+    A PDF parsed once with PyMuPDF and shared by every stage that needs it:
+    DOB extraction, photo extraction and signature validation. PyMuPDF cannot
+    validate CMS signatures, so signature validation reads through pyHanko's
+    reader instead, opened at most once per document (see signature_reader).
+
+    Usable as a context manager; the document is closed on exit.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        with timed('pdf_open'):
+            self.doc = fitz.open(stream=data, filetype='pdf')
+        self._signature_reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.doc.close()
+
+    @property
+    def signature_reader(self):
+        """
+        pyHanko reader over the same bytes, opened on first use (documents
+        rejected on age never need it).
+        """
+        if self._signature_reader is None:
+            from verification.signature_validation import open_signature_reader
+            self._signature_reader = open_signature_reader(self.data)
+        return self._signature_reader
+
+    def iter_page_text(self) -> Iterator[str]:
+        """
+        Yield the text of each page, extracting it only when requested.
+        """
+        for page in self.doc:
+            yield page.get_text()
+
+    @timed('pdf_text')
+    def find_dob(self) -> Tuple[Optional[date], str]:
+        """
+        Scan pages in order and stop at the first one containing a valid DOB.
+
+        Returns:
+            Tuple[Optional[date], str]: Date of birth if found, and the text read so far
+        """
+        texts = []
+        for page_number, text in enumerate(self.iter_page_text()):
+            texts.append(text)
+            dob = extract_dob_from_text(text)
+            if dob:
+                logger.debug("DOB found on page %d of %d", page_number + 1, self.doc.page_count)
+                return dob, ''.join(texts)
+        return None, ''.join(texts)
+
+    @timed('pdf_photo')
+    def extract_photo(self, min_side: int = PDF_MIN_PHOTO_SIDE) -> Optional[Image.Image]:
+        """
+        Return the first embedded image large enough to hold a face, skipping
+        logos and other small decorations.
+        """
+        for page in self.doc:
+            for img in page.get_images(full=True):
+                xref, width, height = img[0], img[2], img[3]
+                if min(width, height) < min_side:
+                    continue
+                base_image = self.doc.extract_image(xref)
+                return Image.open(io.BytesIO(base_image['image']))
+        return None
@@ -0,0 +1,247 @@
+"""
+Document and selfie verification pipelines.
+
+These hold the CPU-heavy work behind /upload-doc and /upload-selfie. They take
+and return plain picklable values so that they can run either inline in the
+request handler or in a worker process (see utils/jobs.py). Each returns a
+(response_body, status_code, session_updates) tuple; the caller applies the
+session updates and sends the response.
+"""
+import logging
+from typing import Optional, Tuple
+
+from config import JWT_CLAIMS, JWT_ISSUER, MINIMUM_AGE, FACE_EMBEDDING_BACKEND
+from verification.age_verification import extract_dob_from_text, verify_age
+from utils.logging_utils import log_failure
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+PipelineResult = Tuple[dict, int, dict]
+
+@timed('document_pipeline')
+def process_document(doc_data: bytes, ext: str, session_id: str, digest: Optional[str] = None) -> PipelineResult:
+    """
+    Verify the age on an uploaded document and embed its photo.
+
+    Args:
+        doc_data: Raw uploaded document bytes
+        ext: Lower-case file extension ('.pdf', '.xml' or an image extension)
+        session_id: Verification session, for failure logs
+        digest: SHA-256 hex digest of doc_data; enables the document result cache
+
+    Returns:
+        PipelineResult: (response_body, status_code, session_updates)
+    """
+    from utils.result_cache import get_document_cache
+
+    cache = get_document_cache() if digest else None
+    # Cached document embeddings are only comparable with the same backend's
+    cache_key = f'{ext}:{FACE_EMBEDDING_BACKEND}:{digest}'
+    if cache is not None:
+        extraction = cache.get(cache_key)
+        if extraction is not None:
+            result = _document_result(extraction, session_id, digest)
+            if result is not None:
+                logger.debug("Document cache hit for session %s", session_id)
+                return result
+            # Cached before the photo stage ran (the holder was under age then)
+
+    if ext == '.pdf':
+        from verification.pdf_document import PdfDocument
+        # Parsed once; text, photo and signature stages all share this handle
+        try:
+            pdf = PdfDocument(doc_data)
+        except Exception as e:
+            log_failure('Error reading PDF', {'session_id': session_id, 'error': str(e)})
+            return {'error': 'Error processing PDF'}, 400, {}
+        with pdf:
+            extraction, failure = _extract_document(doc_data, ext, session_id, pdf)
+    else:
+        extraction, failure = _extract_document(doc_data, ext, session_id)
+    if failure is not None:
+        return failure
+
+    if cache is not None:
+        cache.put(cache_key, extraction)
+    return _document_result(extraction, session_id, digest)
+
+def _age_session_updates(dob) -> dict:
+    is_valid, age, _ = verify_age(dob)
+    return {'age_verified': is_valid, 'age': age, 'date_of_birth': dob}
+
+def _extract_document(doc_data: bytes, ext: str, session_id: str,
+                      pdf=None) -> Tuple[Optional[dict], Optional[PipelineResult]]:
+    """
+    Run the expensive stages and return (extraction, None), or (None, failure)
+    for failures that should not be cached.
+
+    The extraction holds only facts about the document: 'dob', then either
+    'doc_embedding' or 'photo_failure' (reason, body, status). The photo stage
+    is skipped when the holder is under age, as the result would go unused.
+    """
+    from PIL import Image
+    from config import OCR_TARGET_WIDTH
+    from verification.ocr import get_ocr_engine
+    from verification.face_match import get_face_embedding
+    from verification.image_ingest import face_input, open_image, to_bgr
+    from verification.aadhaar_xml import parse_aadhaar_xml, read_aadhaar_element
+    from verification.signature_validation import validate_xml_signature, validate_pdf_signature
+
+    doc_image = None
+    dob = None
+    # Extract text for age verification
+    extracted_text = ''
+    if ext == '.pdf':
+        try:
+            # Reads pages lazily and stops at the first one with a DOB
+            dob, extracted_text = pdf.find_dob()
+        except Exception as e:
+            log_failure('Error reading PDF', {'session_id': session_id, 'error': str(e)})
+            return None, ({'error': 'Error processing PDF'}, 400, {})
+    elif ext == '.xml':
+        signature = validate_xml_signature(doc_data)
+        if not signature:
+            log_failure('Invalid XML signature', {'session_id': session_id})
+            return None, ({'error': 'Invalid XML signature'}, 400, {})
+        try:
+            # The structured DOB, the photo and the text fields come from the
+            # element the signature covers, as parsed for the check; only with
+            # verification disabled are the bytes parsed (in one pass) here
+            if signature.signed_xml is not None:
+                aadhaar_xml = read_aadhaar_element(signature.signed_xml)
+            else:
+                aadhaar_xml = parse_aadhaar_xml(doc_data)
+        except Exception as e:
+            log_failure('Error reading XML', {'session_id': session_id, 'error': str(e)})
+            return None, ({'error': 'Error processing XML'}, 400, {})
+        dob = aadhaar_xml.dob
+        extracted_text = aadhaar_xml.text
+    else:  # For images
+        try:
+            # Decoded once at OCR resolution, upright, and reused for the face match below
+            doc_image = open_image(doc_data, width=OCR_TARGET_WIDTH, resample=Image.LANCZOS)
+            # OCRs the likely DOB regions first and the full page only if needed
+            dob, extracted_text = get_ocr_engine().find_dob(doc_image)
+        except Exception as e:
+            log_failure('Error extracting text from image',
+                       {'session_id': session_id, 'error': str(e)})
+            extracted_text = ''
+
+    # Extract and verify age
+    if dob is None:
+        dob = extract_dob_from_text(extracted_text)
+    if not dob:
+        log_failure('Could not extract date of birth', {'session_id': session_id})
+        return None, ({'error': 'Could not verify age from document'}, 400, {})
+
+    extraction = {'dob': dob}
+    if not verify_age(dob)[0]:
+        return extraction, None
+
+    # Extract photo for face matching
+    if ext == '.xml':
+        photo = aadhaar_xml.photo
+    elif ext == '.pdf':
+        if not validate_pdf_signature(pdf):
+            log_failure('Invalid PDF signature', {'session_id': session_id})
+            return None, ({'error': 'Invalid PDF signature'}, 400, _age_session_updates(dob))
+        photo = pdf.extract_photo()
+    else:  # For images
+        photo = doc_image
+
+    if photo is None:
+        extraction['photo_failure'] = ('Photo extraction failed', {'error': 'Photo extraction failed'}, 400)
+        return extraction, None
+    # Detect, align and embed the document face once; selfie retries
+    # only need to embed the selfie and compare against this vector
+    doc_embedding = get_face_embedding(to_bgr(photo) if photo is doc_image else face_input(photo))
+    if doc_embedding is None:
+        extraction['photo_failure'] = ('No face found in document photo',
+                                       {'error': 'No face found in document photo'}, 400)
+        return extraction, None
+    extraction['doc_embedding'] = doc_embedding
+    return extraction, None
+
+def _document_result(extraction: dict, session_id: str, digest: Optional[str] = None) -> Optional[PipelineResult]:
+    """
+    Apply the age policy to an extraction and build the endpoint response.
+    Returns None if the extraction stopped before the photo stage but the
+    holder now passes the age check. The upload digest is kept in the session
+    as the document's identity for the face index.
+    """
+    dob = extraction['dob']
+    is_valid, age, is_minor = verify_age(dob)
+    if not is_valid:
+        log_failure('Age verification failed',
+                  {'session_id': session_id, 'age': age, 'minimum_age': MINIMUM_AGE, 'is_minor': is_minor})
+        return {
+            'error': f'Age verification failed: Must be at least {MINIMUM_AGE} years old',
+            'age': age,
+            'is_minor': is_minor
+        }, 403, {}
+
+    # Age verification details are stored in the session even if the photo
+    # step failed
+    session_updates = {
+        'age_verified': is_valid,
+        'age': age,
+        'date_of_birth': dob
+    }
+    if 'photo_failure' in extraction:
+        reason, body, status = extraction['photo_failure']
+        log_failure(reason, {'session_id': session_id})
+        return body, status, session_updates
+    if 'doc_embedding' not in extraction:
+        return None
+    session_updates['doc_embedding'] = extraction['doc_embedding']
+    if digest:
+        session_updates['doc_digest'] = digest
+    return {'success': True}, 200, session_updates
+
+@timed('selfie_pipeline')
+def process_selfie(selfie_data: bytes, session: dict, session_id: str) -> PipelineResult:
+    """
+    Match a selfie against the session's document face and issue the token.
+
+    Args:
+        selfie_data: Raw uploaded selfie bytes
+        session: Current session contents, including 'doc_embedding'
+        session_id: Verification session, used as the token subject
+
+    Returns:
+        PipelineResult: (response_body, status_code, session_updates)
+    """
+    from verification.face_index import check_face_reuse
+    from verification.face_match import match_selfie_face
+    from verification.image_ingest import decode_bgr
+    from utils.jwt_utils import issue_token
+
+    selfie = decode_bgr(selfie_data)
+    if selfie is None:
+        log_failure('Could not decode selfie', {'session_id': session_id})
+        return {'error': 'Invalid selfie image'}, 400, {}
+    # Face match
+    selfie_embedding = match_selfie_face(session['doc_embedding'], selfie)
+    if selfie_embedding is None:
+        log_failure('Face match failed', {'session_id': session_id})
+        return {'error': 'Face match failed'}, 401, {}
+    # Flag (without blocking) a face already verified for another document
+    reused = check_face_reuse(selfie_embedding, session_id, session.get('doc_digest'))
+    # Get age verification status
+    age_verified = session.get('age_verified', False)
+
+    # Create JWT payload with age verification status
+    # Start with default claims and update with our values
+    payload = {**JWT_CLAIMS}  # Start with default claims
+    payload.update({
+        'sub': session_id,
+        'iss': JWT_ISSUER,
+        'age_verified': age_verified  # This will override the default False value
+    })
+    token = issue_token(payload)
+    callback_url = session['callback_url']
+    # Redirect with JWT as query param
+    redirect_url = f"{callback_url}?token={token}"
+    session_updates = {'face_reuse_sessions': [m['session_id'] for m in reused]} if reused else {}
+    return {'redirect_url': redirect_url, 'token': token}, 200, session_updates
@@ -0,0 +1,121 @@
+"""
+Model warm-up and readiness tracking.
+
+The verification modules pull in TensorFlow/DeepFace, OpenCV, PyMuPDF and
+tesseract, and the face models are downloaded and built on first use. warm_up
+does all of that up front, running each model once on a dummy input, so the
+first real request does not pay for it.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+from config import FACE_INFERENCE_ADDRESS
+
+logger = logging.getLogger(__name__)
+
+_state = {
+    'status': 'pending',  # pending -> warming -> ready | failed
+    'error': None,
+    'started_at': None,
+    'finished_at': None,
+}
+_state_lock = threading.Lock()
+
+def warm_up_face_models():
+    """
+    Build the face detector and recognition model by running them on a blank image.
+    """
+    import numpy as np
+    from config import FACE_DETECTOR_CASCADE
+    from verification.face_match import detect_faces_with_tier, embed_faces
+
+    # Run each tier on its own so every detector in the cascade gets built;
+    # these runs are not counted as requests decided by the tier
+    for detector in FACE_DETECTOR_CASCADE:
+        detect_faces_with_tier(np.zeros((160, 160, 3), dtype=np.uint8), cascade=[detector], count=False)
+    embed_faces([np.zeros((160, 160, 3), dtype=np.float32)])
+
+def warm_up_document_stack():
+    """
+    Import the document modules, run OCR once so tesseract is loaded and
+    parse the signature trust store.
+    """
+    import io
+    from PIL import Image
+    from verification.ocr import extract_text
+    import verification.aadhaar_xml  # noqa: F401
+    import verification.extract_photo  # noqa: F401
+    import verification.pdf_document  # noqa: F401
+    from verification.signature_validation import get_trust_store
+
+    blank = io.BytesIO()
+    Image.new('L', (64, 32), color=255).save(blank, 'PNG')
+    blank.seek(0)
+    extract_text(blank)
+    get_trust_store()
+
+def warm_up():
+    """
+    Import every heavy module and run each model once. Safe to call repeatedly.
+    """
+    with _state_lock:
+        if _state['status'] in ('warming', 'ready'):
+            return
+        _state.update(status='warming', error=None, started_at=time.time(), finished_at=None)
+
+    try:
+        warm_up_document_stack()
+        # With a shared inference service the models live in that process
+        if not FACE_INFERENCE_ADDRESS:
+            warm_up_face_models()
+    except Exception as e:
+        logger.error("Warm-up failed: %s", e)
+        with _state_lock:
+            _state.update(status='failed', error=str(e), finished_at=time.time())
+        return
+
+    with _state_lock:
+        _state.update(status='ready', finished_at=time.time())
+    logger.info("Warm-up finished in %.1fs", _state['finished_at'] - _state['started_at'])
+
+def warm_up_workers(workers: List[Future]):
+    """
+    Wait for process pool workers to warm up and take on their readiness.
+    Used instead of warm_up when the pipeline runs in a pool, whose workers
+    warm up in their initializer, so this process never loads the models.
+
+    Args:
+        workers: Futures of readiness() submitted to each worker
+    """
+    with _state_lock:
+        if _state['status'] in ('warming', 'ready'):
+            return
+        _state.update(status='warming', error=None, started_at=time.time(), finished_at=None)
+
+    try:
+        states = [future.result() for future in workers]
+    except Exception as e:
+        states = [{'status': 'failed', 'error': f'Worker failed to start: {e}'}]
+    errors = [state['error'] for state in states if state['status'] != 'ready']
+    with _state_lock:
+        if errors:
+            logger.error("Worker warm-up failed: %s", errors[0])
+            _state.update(status='failed', error=errors[0], finished_at=time.time())
+            return
+        _state.update(status='ready', finished_at=time.time())
+    logger.info("%d workers warmed up in %.1fs", len(states), _state['finished_at'] - _state['started_at'])
+
+def start_background_warm_up(target: Callable = warm_up, *args) -> threading.Thread:
+    thread = threading.Thread(target=target, args=args, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+def is_ready() -> bool:
+    return _state['status'] == 'ready'
+
+def readiness() -> dict:
+    with _state_lock:
+        return dict(_state)